@@ -0,0 +1,216 @@
+import os
+import threading
+import pygame
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+"""
+The Asset Manager decodes images and sounds on a pool of worker threads, so they can be
+loaded while the player is still in a menu instead of all at once when a battle starts.
+
+Workers only decode the file. Finished images are handed back to the main thread, which
+converts them to the display format when update is called, since that has to happen on
+the thread that owns the display.
+
+Anything that loads an image or a sound should go through getImage and getSound. If the
+file was preloaded, it comes out of the cache, otherwise it's loaded right away just like
+it would have been without the manager.
+"""
+asset_manager = None
+
+#The manager is first imported while the game is starting up, so this is the thread that owns the display
+main_thread = threading.current_thread()
+
+def getAssetManager():
+    global asset_manager
+    if asset_manager == None:
+        asset_manager = AssetManager()
+    return asset_manager
+
+IMAGE_TYPES = [".jpg",".png",".gif",".bmp",".pcx",".tga",".tif",".lbm",".pbm",".xpm"]
+SOUND_TYPES = [".wav",".ogg"]
+
+class AssetManager():
+    def __init__(self,_workerCount=4):
+        self.requests = Queue()
+        self.finished = Queue()
+        self.lock = threading.Lock()
+
+        #Each of these maps a path to a list of [asset, times it was requested]
+        self.images = {}
+        self.sounds = {}
+
+        #Paths that have been queued but haven't come back from the workers yet
+        self.pending = {}
+
+        #Progress counters, for loading screens
+        self.total = 0
+        self.completed = 0
+
+        self.workers = []
+        for _ in range(_workerCount):
+            worker = threading.Thread(target=self.work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    """
+    The worker thread loop. Takes requests off the queue forever, and puts
+    whatever it decodes onto the finished queue.
+    """
+    def work(self):
+        while True:
+            kind,path = self.requests.get()
+            asset = None
+            try:
+                if kind == 'image':
+                    asset = pygame.image.load(path)
+                else:
+                    asset = pygame.mixer.Sound(path)
+            except Exception as e:
+                print("Could not preload " + path, e)
+            self.finished.put((kind,path,asset))
+
+    """
+    Queue a single file to be decoded in the background. Preloading the same
+    file twice means two copies of it can be taken out of the cache.
+    """
+    def preload(self,_path):
+        path = os.path.normpath(_path)
+        ext = os.path.splitext(path)[1].lower()
+        if ext in IMAGE_TYPES: kind,cache = 'image',self.images
+        elif ext in SOUND_TYPES: kind,cache = 'sound',self.sounds
+        else: return
+
+        with self.lock:
+            if path in cache:
+                cache[path][1] += 1
+            elif path in self.pending:
+                self.pending[path] += 1
+            else:
+                self.pending[path] = 1
+                self.total += 1
+                self.requests.put((kind,path))
+
+    """
+    Queue every image and sound in a directory. If a prefix is given, only
+    files starting with it are loaded, to match how ImageLibrary picks a costume.
+    """
+    def preloadDirectory(self,_directory,_prefix=''):
+        if not os.path.isdir(_directory):
+            return
+        for f in os.listdir(_directory):
+            if f.startswith(_prefix or ''):
+                self.preload(os.path.join(_directory,f))
+
+    """
+    Hands everything the workers have finished over to the cache, converting images
+    for the display as it goes. This must be called from the main thread, and should
+    be called every frame while assets are loading.
+    """
+    def update(self,_block=False):
+        while True:
+            try:
+                kind,path,asset = self.finished.get(_block)
+            except Empty:
+                return
+            self.store(kind,path,asset)
+            _block = False
+
+    def store(self,_kind,_path,_asset):
+        with self.lock:
+            count = self.pending.pop(_path,0)
+            self.completed += 1
+        #Nothing wants it anymore if it was cleared while it was decoding
+        if _asset is None or count == 0:
+            return
+        if _kind == 'image':
+            if pygame.display.get_surface() is not None:
+                _asset = _asset.convert_alpha()
+            self.images[_path] = [_asset,count]
+        else:
+            self.sounds[_path] = [_asset,count]
+
+    """
+    Wait for a file that's already being decoded, instead of loading it a second time.
+    """
+    def waitFor(self,_path):
+        while _path in self.pending:
+            self.update(True)
+    
+    """
+    Only the main thread can take things out of the cache, since it might have to
+    finish converting them. Anything loading on another thread just goes to disk.
+    """
+    def canUseCache(self):
+        return threading.current_thread() is main_thread
+
+    def take(self,_cache,_path):
+        asset,count = _cache[_path]
+        if count > 1:
+            _cache[_path][1] -= 1
+            if _cache is self.images: return asset.copy()
+            return asset
+        del _cache[_path]
+        return asset
+
+    """
+    Get an image, from the cache if it was preloaded, or from disk if it wasn't.
+    The caller owns the surface it gets back and is free to modify it.
+
+    @_path - the path to the image file
+    @_convert - if True, a freshly loaded image is converted with convert_alpha.
+                Preloaded images have always been converted.
+    """
+    def getImage(self,_path,_convert=False):
+        path = os.path.normpath(_path)
+        if self.canUseCache():
+            self.waitFor(path)
+            if path in self.images:
+                return self.take(self.images,path)
+        image = pygame.image.load(_path)
+        if _convert:
+            image = image.convert_alpha()
+        return image
+
+    """
+    Get a sound, from the cache if it was preloaded, or from disk if it wasn't.
+    """
+    def getSound(self,_path):
+        path = os.path.normpath(_path)
+        if self.canUseCache():
+            self.waitFor(path)
+            if path in self.sounds:
+                return self.take(self.sounds,path)
+        return pygame.mixer.Sound(_path)
+
+    """
+    Returns True if there's nothing left waiting on the workers.
+    """
+    def isIdle(self):
+        return len(self.pending) == 0
+
+    """
+    How much of what's been queued has finished, from 0.0 to 1.0.
+    """
+    def getProgress(self):
+        if self.total == 0:
+            return 1.0
+        return float(self.completed) / self.total
+
+    """
+    Throw away anything that was preloaded but never used, like the images for a stage
+    that was highlighted but not picked. Anything still decoding will be thrown away
+    when it's finished.
+    """
+    def clear(self):
+        self.update()
+        self.images = {}
+        self.sounds = {}
+        with self.lock:
+            for path in self.pending:
+                self.pending[path] = 0
+            self.total = len(self.pending)
+            self.completed = 0
@@ -0,0 +1,305 @@
+import os
+import json
+import hashlib
+import pygame
+import assetManager
+
+"""
+The Atlas Manager packs all of a fighter's sprite sheets, along with the sheets for its articles,
+into a few large pages. Every frame is trimmed down to the part of it that isn't transparent before
+it's packed, and an index remembers where each frame ended up and where it sat in its original sheet.
+
+Atlases are saved next to the sprites they were made from, in a .atlas folder, along with a hash of
+the name, size, modification time and change time of every file that went into them. As long as none
+of those files change, loading a fighter only has to decode a handful of pages instead of every sheet.
+If anything changes, the atlas is rebuilt the next time it's needed.
+
+The atlas is a cache on disk and nothing more. Sheets are rebuilt at their original size out of the
+pages, and sprites are drawn from those the same as from sheets loaded on their own, since every
+fighter recolors its own copy of its sheets for its palette and they can't share the pages. The pages
+are only kept until the sheets have been taken out of them. Once every sheet in an atlas has been
+rebuilt, or the battle that loaded it is over, the pages are let go, and any sheet asked for after
+that is loaded from its source image.
+
+The source images are always the real data, so the .atlas folder can be deleted at any time.
+"""
+ATLAS_VERSION = 2
+ATLAS_DIRECTORY = '.atlas'
+PAGE_SIZE = 2048
+
+#Every atlas that's been loaded, by the path of its index
+atlases = {}
+#Every sheet in a loaded atlas, by the full path of its source image
+sheet_index = {}
+
+"""
+Get the atlas for a sprite directory, loading it from the cache on disk if it's up to date, or
+building a new one if it isn't. Once an atlas is loaded, any of its sheets can be taken out by
+path with getSheet.
+
+@_directory - the sprite directory to pack
+@_prefix - only sheets starting with this prefix are packed, like ImageLibrary's costume prefix
+@_frameWidth - the width of each frame in the sheets, so they can be trimmed frame by frame
+@_extraDirectories - other directories to pack every image from, like article sprites.
+                     These sheets are trimmed as a whole.
+"""
+def getAtlas(_directory,_prefix='',_frameWidth=0,_extraDirectories=[]):
+    sources = findSources(_directory,_prefix,_frameWidth,_extraDirectories)
+    index_path = getIndexPath(_directory,_prefix)
+    source_hash = fingerprintSources(sources)
+
+    atlas = atlases.get(index_path)
+    if atlas is None or atlas.source_hash != source_hash:
+        atlas = loadAtlas(index_path,source_hash)
+        if atlas is None:
+            atlas = buildAtlas(index_path,sources,source_hash)
+        registerAtlas(index_path,atlas)
+    return atlas
+
+"""
+Use an atlas that was loaded from somewhere other than the .atlas folder, like a fighter bundle.
+The index only needs the hash and sheets.
+"""
+def addAtlas(_indexPath,_index,_pages):
+    atlas = Atlas(os.path.dirname(os.path.dirname(_indexPath)),_index,_pages)
+    registerAtlas(_indexPath,atlas)
+    return atlas
+
+def registerAtlas(_indexPath,_atlas):
+    releaseAtlas(_indexPath)
+    _atlas.index_path = _indexPath
+    atlases[_indexPath] = _atlas
+    for name in _atlas.sheets:
+        sheet_index[_atlas.getPath(name)] = _atlas
+
+"""
+Let go of an atlas and its pages. Its sheets are loaded from their source images from then on.
+"""
+def releaseAtlas(_indexPath):
+    atlas = atlases.pop(_indexPath,None)
+    if atlas is None:
+        return
+    for name in atlas.sheets:
+        if sheet_index.get(atlas.getPath(name)) is atlas:
+            del sheet_index[atlas.getPath(name)]
+    atlas.pages = []
+
+"""
+Let go of every atlas that's still loaded. Called when a battle is over, since every sheet it
+needed has been taken out by then.
+"""
+def releaseAtlases():
+    for index_path in list(atlases.keys()):
+        releaseAtlas(index_path)
+
+"""
+Queue the pages of an atlas to be decoded in the background. This is safe to call from another
+thread. Returns False if there's no up to date atlas on disk yet, in which case the sheets
+themselves should be preloaded instead, since they'll be needed to build it.
+"""
+def preloadAtlas(_directory,_prefix='',_frameWidth=0,_extraDirectories=[]):
+    sources = findSources(_directory,_prefix,_frameWidth,_extraDirectories)
+    index_path = getIndexPath(_directory,_prefix)
+    source_hash = fingerprintSources(sources)
+
+    atlas = atlases.get(index_path)
+    if atlas is not None and atlas.source_hash == source_hash:
+        return True
+    index = readIndex(index_path,source_hash)
+    if index is None:
+        return False
+    for page in index['pages']:
+        assetManager.getAssetManager().preload(os.path.join(os.path.dirname(index_path),page))
+    return True
+
+"""
+Get a copy of a sheet out of whichever loaded atlas has it, rebuilt at its original size.
+The caller owns the surface. Returns None if the sheet isn't in any loaded atlas.
+Once every sheet in the atlas has been taken out, the atlas is let go.
+"""
+def getSheet(_path):
+    atlas = sheet_index.get(normalizePath(_path))
+    if atlas is None or not atlas.getName(_path) in atlas.sheets:
+        return None
+    sheet = atlas.getSheet(atlas.getName(_path))
+    if atlas.isUsedUp():
+        releaseAtlas(atlas.index_path)
+    return sheet
+
+def normalizePath(_path):
+    return os.path.normcase(os.path.abspath(_path))
+
+def getIndexPath(_directory,_prefix):
+    return os.path.join(_directory,ATLAS_DIRECTORY,(_prefix or '_all')+'.json')
+
+"""
+List every image that goes into an atlas, paired with the width of its frames.
+"""
+def findSources(_directory,_prefix,_frameWidth,_extraDirectories):
+    sources = []
+    for f in sorted(os.listdir(_directory)):
+        fname, ext = os.path.splitext(f)
+        if fname.startswith(_prefix or '') and ext in assetManager.IMAGE_TYPES:
+            sources.append((os.path.join(_directory,f),_frameWidth))
+    for directory in _extraDirectories:
+        if not os.path.isdir(directory) or normalizePath(directory) == normalizePath(_directory):
+            continue
+        for f in sorted(os.listdir(directory)):
+            if os.path.splitext(f)[1] in assetManager.IMAGE_TYPES:
+                sources.append((os.path.join(directory,f),0))
+    return sources
+
+"""
+A single hash of the name, size, modification time and change time of every source image, and how
+it's cut into frames. If this doesn't match the hash saved with an atlas, the atlas is out of date.
+Only the files' stats are read, so checking an atlas costs the same however big its sprites are.
+A tool can write a file and put its modification time back, but not its change time, which is set
+by any write. On Windows st_ctime is when the file was made instead, so an edit there that keeps
+the modification time and size won't be noticed.
+"""
+def fingerprintSources(_sources):
+    digest = hashlib.sha1()
+    digest.update(str(ATLAS_VERSION).encode('utf-8'))
+    for path,frame_width in _sources:
+        stat = os.stat(path)
+        digest.update(os.path.basename(path).encode('utf-8'))
+        digest.update((str(frame_width)+':'+str(stat.st_size)+':'+repr(stat.st_mtime)+':'+repr(stat.st_ctime)).encode('utf-8'))
+    return digest.hexdigest()
+
+def readIndex(_indexPath,_sourceHash):
+    if not os.path.exists(_indexPath):
+        return None
+    try:
+        with open(_indexPath,'r') as index_file:
+            index = json.load(index_file)
+    except Exception as e:
+        print("Could not read atlas " + _indexPath, e)
+        return None
+    if index.get('version') != ATLAS_VERSION or index.get('hash') != _sourceHash:
+        return None
+    for page in index['pages']:
+        if not os.path.exists(os.path.join(os.path.dirname(_indexPath),page)):
+            return None
+    return index
+
+def loadAtlas(_indexPath,_sourceHash):
+    index = readIndex(_indexPath,_sourceHash)
+    if index is None:
+        return None
+    directory = os.path.dirname(_indexPath)
+    pages = [assetManager.getAssetManager().getImage(os.path.join(directory,page),True) for page in index['pages']]
+    return Atlas(os.path.dirname(directory),index,pages)
+
+"""
+Cut every source into trimmed frames, pack them onto pages, and save the pages and index to disk.
+If the atlas can't be saved, it's still returned so it can be used for this session.
+"""
+def buildAtlas(_indexPath,_sources,_sourceHash):
+    base_directory = os.path.dirname(os.path.dirname(_indexPath))
+    sheets = {}
+    pieces = []
+    for path,frame_width in _sources:
+        try:
+            image = assetManager.getAssetManager().getImage(path)
+        except Exception as e:
+            print("Could not add " + path + " to atlas", e)
+            continue
+        width,height = image.get_size()
+        if frame_width <= 0:
+            frame_width = max(1,width)
+        entry = {'size': [width,height], 'frames': []}
+        for frame_num in range(width // frame_width):
+            frame_rect = pygame.Rect(frame_num*frame_width,0,frame_width,height)
+            trim = image.subsurface(frame_rect).get_bounding_rect()
+            trim.move_ip(frame_rect.topleft)
+            #Each frame is [page, x on page, y on page, x in sheet, y in sheet, width, height]
+            frame = [-1, 0, 0, trim.x, trim.y, trim.width, trim.height]
+            if trim.width > 0 and trim.height > 0:
+                pieces.append((frame,image.subsurface(trim)))
+            entry['frames'].append(frame)
+        sheets[os.path.relpath(path,base_directory)] = entry
+
+    page_sizes = packPieces([piece.get_size() for _,piece in pieces],[frame for frame,_ in pieces])
+    pages = [pygame.Surface(size,pygame.SRCALPHA,32) for size in page_sizes]
+    for frame,piece in pieces:
+        #Adding onto a blank surface copies the pixels exactly, alpha and all
+        pages[frame[0]].blit(piece,(frame[1],frame[2]),special_flags=pygame.BLEND_RGBA_ADD)
+
+    prefix = os.path.splitext(os.path.basename(_indexPath))[0]
+    index = {'version': ATLAS_VERSION,
+             'hash': _sourceHash,
+             'pages': [prefix+'_'+str(i)+'.png' for i in range(len(pages))],
+             'sheets': sheets}
+    try:
+        directory = os.path.dirname(_indexPath)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for i,page in enumerate(pages):
+            pygame.image.save(page,os.path.join(directory,index['pages'][i]))
+        with open(_indexPath,'w') as index_file:
+            json.dump(index,index_file)
+    except Exception as e:
+        print("Could not save atlas " + _indexPath, e)
+
+    if pygame.display.get_surface() is not None:
+        pages = [page.convert_alpha() for page in pages]
+    return Atlas(base_directory,index,pages)
+
+"""
+Place every piece onto pages in rows, tallest first, writing the page and position into each frame.
+Returns the size of each page that was used.
+"""
+def packPieces(_sizes,_frames):
+    page_width = max([PAGE_SIZE] + [w for w,_ in _sizes])
+    page_height = max([PAGE_SIZE] + [h for _,h in _sizes])
+    page_sizes = []
+    x = y = row_height = 0
+    for i in sorted(range(len(_sizes)), key=lambda i: (-_sizes[i][1],-_sizes[i][0])):
+        w,h = _sizes[i]
+        if x + w > page_width:
+            x = 0
+            y += row_height
+            row_height = 0
+        if y + h > page_height or not page_sizes:
+            page_sizes.append([0,0])
+            x = y = row_height = 0
+        _frames[i][0:3] = [len(page_sizes)-1,x,y]
+        page_sizes[-1] = [max(page_sizes[-1][0],x+w),max(page_sizes[-1][1],y+h)]
+        x += w
+        row_height = max(row_height,h)
+    return [tuple(size) for size in page_sizes]
+
+class Atlas():
+    def __init__(self,_baseDirectory,_index,_pages):
+        self.base_directory = _baseDirectory
+        self.source_hash = _index['hash']
+        self.sheets = _index['sheets']
+        self.pages = _pages
+        self.index_path = None
+        #the sheets that have been taken out so far
+        self.taken = set()
+
+    def getPath(self,_name):
+        return normalizePath(os.path.join(self.base_directory,_name))
+
+    def getName(self,_path):
+        return os.path.relpath(os.path.abspath(_path),os.path.abspath(self.base_directory))
+
+    """
+    Rebuild a sheet at its original size by blitting each of its frames back where it came from.
+    """
+    def getSheet(self,_name):
+        self.taken.add(_name)
+        entry = self.sheets[_name]
+        if self.pages:
+            sheet = pygame.Surface(entry['size'],pygame.SRCALPHA,self.pages[0])
+        else:
+            sheet = pygame.Surface(entry['size'],pygame.SRCALPHA,32)
+        for page,page_x,page_y,sheet_x,sheet_y,width,height in entry['frames']:
+            if page >= 0:
+                sheet.blit(self.pages[page],(sheet_x,sheet_y),pygame.Rect(page_x,page_y,width,height),
+                           special_flags=pygame.BLEND_RGBA_ADD)
+        return sheet
+
+    def isUsedUp(self):
+        return len(self.taken) >= len(self.sheets)
@@ -5,6 +5,8 @@ import spriteManager
 import sys
 import os
 import musicManager
+import assetManager
+import atlasManager
 import engine.hitbox as hitbox
 import menu.debugConsole as debugConsole
 import engine.optimize_dirty_rects
@@ -17,6 +19,7 @@ import inspect
 import bdb
 
 import engine.network as network
+import engine.controller as controller
 
 from collections import namedtuple
 
@@ -116,6 +119,9 @@ class Battle():
                 
                 self.gui_objects.append(percent_sprite)
             
+            #Everything that was preloaded for this battle has been used by now, so let go of the rest
+            assetManager.getAssetManager().clear()
+            
             center_stage_rect = pygame.rect.Rect((0,0),(16,16))
             center_stage_rect.center = self.stage.size.center
             self.stage.follows.append(center_stage_rect)
@@ -137,9 +143,25 @@ class Battle():
             data_log.addSection('test', 1)
             data_log.setData('test', 3, (lambda x,y: x + y))
             self.dirty_rects = [pygame.Rect(0,0,self.settings['windowWidth'],self.settings['windowHeight'])]
+            #Where the game objects were drawn last frame, and what the camera was looking at
+            self.object_rects = []
+            self.last_camera = None
+            self.background_cache = None
             
             #initialises network
             self.network = network.Network()
+            if self.network.enabled:
+                self.setupRemoteControllers()
+                self.network_sprite = spriteManager.TextSprite('Connecting','Orbitron Medium',12,[0,0,0])
+                self.gui_objects.append(self.network_sprite)
+                #the netplay overlay, toggled with F3
+                self.network_overlay = []
+                for line in self.network.getOverlayLines():
+                    line_sprite = spriteManager.TextSprite(line,'Orbitron Medium',12,[0,0,0])
+                    line_sprite.visible = False
+                    self.network_overlay.append(line_sprite)
+                    self.gui_objects.append(line_sprite)
+                self.updateNetworkSprite()
             while self.exit_status == 0:
                 self.gameEventLoop()
                 
@@ -153,6 +175,11 @@ class Battle():
         for fighter in self.current_fighters:
             print('Fighter '+fighter.name+' Player '+str(fighter.player_num))
             print(fighter.input_buffer.buffer)   
+        #every sheet the battle needs has been taken out of the atlases by now
+        atlasManager.releaseAtlases()
+        if hasattr(self,'network') and self.network.enabled:
+            print(self.network.getStats())
+            self.network.closeTelemetry()
              
         if self.exit_status == 1:
             musicManager.getMusicManager().stopMusic(1000)
@@ -188,8 +215,24 @@ class Battle():
         for cont in self.controllers:
             cont.passInputs()
         rawEvents = pygame.event.get()
+        for event in rawEvents:
+            #the overlay only shows on this screen, so it doesn't wait for the network
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3 and self.network.enabled:
+                for line_sprite in self.network_overlay:
+                    line_sprite.visible = not line_sprite.visible
         #process events through network.
         events = self.network.processEvents(rawEvents)
+        if events is None:
+            #Waiting on the other player, so keep drawing but don't move the game on
+            for event in rawEvents:
+                if event.type == pygame.QUIT:
+                    os._exit(1)
+            if self.network.isDisconnected():
+                #They've stopped answering, or the connection's gone
+                self.exit_status = -1
+            self.updateNetworkSprite()
+            self.draw()
+            return
         for event in events:
             if event.type == pygame.QUIT:
                 os._exit(1)
@@ -253,8 +296,10 @@ class Battle():
                         fight.die()
                         self.stage.follows.append(fight.ecb.tracking_rect)
         # End object updates
-        self.draw()
-        pygame.display.update()
+        self.updateNetworkSprite()
+        #a spectator that's behind the match plays frames as fast as it can without drawing them
+        if not self.network.isCatchingUp():
+            self.draw()
         if self.debug_mode:
             print("Paused, press shift key again to continue, press tab to drop into the debugger console")
             self.cameraX = 0
@@ -263,6 +308,43 @@ class Battle():
             while self.debug_mode:
                 self.debugLoop()
 
+    """
+    Over the network, every player is played by a RemoteController, fed by the buttons the network plays
+    back for them. Input on this machine is read with the first player's bindings, since those are the
+    controls of whoever's sitting here, whichever player they are in the match. CPU players still play
+    themselves, the same way on every machine.
+    """
+    def setupRemoteControllers(self):
+        self.network.setLocalController(self.controllers[0])
+        self.controllers = []
+        for player in self.players:
+            if player.key_bindings.type == 'CPU':
+                self.controllers.append(player.key_bindings)
+                continue
+            remote = controller.RemoteController(player.player_num,getattr(player.key_bindings,'timing_window',dict()))
+            remote.linkObject(player)
+            player.key_bindings = remote
+            self.controllers.append(remote)
+    
+    """
+    Show how the connection is holding up in the top left corner, with the netplay overlay under it if it's on.
+    """
+    def updateNetworkSprite(self):
+        if not self.network.enabled:
+            return
+        text,color = self.network.getConnectionQuality()
+        if text != self.network_sprite.text or color != self.network_sprite.color:
+            self.network_sprite.color = color
+            self.network_sprite.changeText(text)
+            self.network_sprite.rect.topleft = (4,4)
+        if self.network_overlay[0].visible:
+            top = self.network_sprite.rect.bottom + 2
+            for line_sprite,line in zip(self.network_overlay,self.network.getOverlayLines()):
+                if line != line_sprite.text:
+                    line_sprite.changeText(line)
+                line_sprite.rect.topleft = (4,top)
+                top = line_sprite.rect.bottom
+        
     def checkHitboxClanks(self):
         hitbox_hits = pygame.sprite.groupcollide(self.active_hitboxes, self.active_hitboxes, False, False)
         for hbox in hitbox_hits:
@@ -297,12 +379,119 @@ class Battle():
                     hbox.onCollision(hurtbox)
                         
 
+    """
+    Draw the frame and put it on the display. While the camera is still, only the parts of the screen
+    that changed are redrawn and updated. Any time it moves or zooms, the whole screen is redrawn instead.
+    """
     def draw(self):
+        object_rects = self.getObjectRects()
+        if self.canDrawPartial():
+            self.drawPartial(object_rects)
+        else:
+            self.drawFull()
+        self.object_rects = object_rects
+        
+        if self.track_time and self.clock_time <= 5:
+            self.count_alpha = max(0,self.count_alpha - 5)
+            self.countdown_sprite.alpha(self.count_alpha)
+         
+        self.clock.tick(self.network.getFrameRate(self.clock_speed))
+        
+    """
+    Partial redraws only work if nothing on the screen can change without the battle knowing about it.
+    """
+    def canDrawPartial(self):
+        camera = tuple(self.stage.camera_position)
+        moved = camera != self.last_camera
+        self.last_camera = camera
+        if moved or self.stage.checkLayers():
+            return False
+        for setting in ['showHurtboxes','showHitboxes','showECB','showSpriteArea']:
+            if self.settings[setting]:
+                return False
+        return True
+    
+    """
+    Get the part of the screen that every game object and article is about to be drawn over.
+    """
+    def getObjectRects(self):
+        rects = []
+        scale = self.stage.getScale()
+        for obj in self.game_objects:
+            sprites = [obj.sprite]
+            if hasattr(obj, 'articles'):
+                sprites.extend([art.sprite for art in obj.articles])
+            for sprite in sprites:
+                #Animated sprites pick their frame when they're drawn, so pick it now to get the right size
+                if hasattr(sprite, 'get_image'): sprite.get_image()
+                rect = sprite.getDrawRect(self.stage.stageToScreen(sprite.rect),scale)
+                if rect: rects.append(rect)
+        return rects
+    
+    """
+    Redraw only where the game objects were last frame, where they are now, and any GUI that changed.
+    The background doesn't change while the camera is still, so it's drawn once and copied back in
+    wherever something moved off of it.
+    """
+    def drawPartial(self,_objectRects):
+        if self.background_cache is None:
+            self.background_cache = pygame.Surface(self.screen.get_size()).convert()
+            self.background_cache.fill(self.stage.background_color)
+            self.stage.drawBG(self.background_cache)
+        
+        self.dirty_rects.extend(self.object_rects)
+        self.dirty_rects.extend(_objectRects)
+        for obj in self.gui_objects:
+            if obj.needsRedraw(obj.rect.topleft,1):
+                if obj.lastDrawnPosition.width > 0: self.dirty_rects.append(obj.lastDrawnPosition)
+                draw_rect = obj.getDrawRect(obj.rect.topleft,1)
+                if draw_rect: self.dirty_rects.append(draw_rect)
+        
+        screen_rect = self.screen.get_rect()
+        optimized_rects = [rect.clip(screen_rect) for rect in engine.optimize_dirty_rects.optimize_dirty_rects(self.dirty_rects)]
+        optimized_rects = [rect for rect in optimized_rects if rect.width > 0 and rect.height > 0]
+        
+        for rect in optimized_rects:
+            self.screen.blit(self.background_cache,rect,rect)
+        self.drawObjects()
+        
+        #The rects never overlap, so drawing everything on top clipped to each one draws each pixel once
+        for rect in optimized_rects:
+            self.screen.set_clip(rect)
+            self.stage.drawFG(self.screen)
+            for obj in self.gui_objects:
+                draw_rect = obj.getDrawRect(obj.rect.topleft,1)
+                if draw_rect and draw_rect.colliderect(rect):
+                    obj.draw(self.screen, obj.rect.topleft,1)
+        self.screen.set_clip(None)
+        #Anything that's hidden now still needs to know it isn't on screen anymore
+        for obj in self.gui_objects:
+            if obj.getDrawRect(obj.rect.topleft,1) is None:
+                obj.draw(self.screen, obj.rect.topleft,1)
+        
+        pygame.display.update(optimized_rects)
+        self.dirty_rects = []
+        
+    def drawFull(self):
+        self.background_cache = None
         self.screen.fill(self.stage.background_color)
         
         draw_rects = self.stage.drawBG(self.screen)
         self.dirty_rects.extend(draw_rects)
-
+        
+        self.drawObjects()
+        
+        draw_rects = self.stage.drawFG(self.screen)    
+        self.dirty_rects.extend(draw_rects)
+        
+        for obj in self.gui_objects:
+            draw_rect = obj.draw(self.screen, obj.rect.topleft,1)
+            if draw_rect: self.dirty_rects.append(draw_rect)
+        
+        pygame.display.update()
+        self.dirty_rects = []
+        
+    def drawObjects(self):
         for obj in self.game_objects:
             foreground_articles = []
             if hasattr(obj, 'articles'):
@@ -334,24 +523,8 @@ class Battle():
                     if draw_rect: self.dirty_rects.append(draw_rect)
 
 
-        draw_rects = self.stage.drawFG(self.screen)    
-        self.dirty_rects.extend(draw_rects)
-        
-        for obj in self.gui_objects:
-            draw_rect = obj.draw(self.screen, obj.rect.topleft,1)
-            if draw_rect: self.dirty_rects.append(draw_rect)
-        if self.track_time and self.clock_time <= 5:
-            self.count_alpha = max(0,self.count_alpha - 5)
-            self.countdown_sprite.alpha(self.count_alpha)
-         
-        self.clock.tick(self.clock_speed)
-        optimized_rects = engine.optimize_dirty_rects.optimize_dirty_rects(self.dirty_rects)
-        #pygame.display.update(optimized_rects)
-        self.dirty_rects = []
-        
     def debugLoop(self):
         self.draw()
-        pygame.display.update()
         try:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
@@ -449,9 +622,11 @@ class Battle():
                     k = controls.getInputs(event)
                     if k == 'attack':
                         result_sprites[i].image.set_alpha(0)
+                        result_sprites[i].changed = True
                         confirmed_list[i] = True
                     elif k == 'special':
                         result_sprites[i].image.set_alpha(255)
+                        result_sprites[i].changed = True
                         confirmed_list[i] = False
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_RETURN:
@@ -492,6 +667,55 @@ class Replay(Battle):
         pass
     
 
+"""
+The damage numbers get redder as a fighter takes more damage. Rather than recolor the digit sheet
+every time the damage changes, every shade is baked once into an atlas, with one row of digits
+for each step of redness. The digits on the sheet are drawn much bigger than they're shown, so
+they're shrunk down to the size they're drawn at while the atlas is built.
+"""
+DAMAGE_COLOR_STEPS = 16
+#The digits are laid out at full size on this, then shrunk down to fit the HUD
+PERCENT_SIZE = (196,64)
+HUD_PERCENT_SIZE = (96,32)
+DIGIT_SIZE = 64
+#This is the width of each digit and the percent sign on the sheet, for kerning purposes
+KERNING_VALUES = [49,33,44,47,48,43,43,44,49,43,48]
+damage_atlas = None
+
+def getDamageAtlas():
+    global damage_atlas
+    if damage_atlas == None:
+        sheet = assetManager.getAssetManager().getImage(settingsManager.createPath('sprites/guisheet.png'),True)
+        w,h = sheet.get_size()
+        cell_w,cell_h = getDigitCellSize()
+        cells = w // DIGIT_SIZE
+        damage_atlas = pygame.Surface((cell_w*cells,cell_h*DAMAGE_COLOR_STEPS), pygame.SRCALPHA, 32).convert_alpha()
+        row = pygame.Surface((w,h), pygame.SRCALPHA, 32).convert_alpha()
+        #the lighter color and the darker color
+        base_colors = [damageColor(0,1.0),damageColor(0,0.785)]
+        for step in range(DAMAGE_COLOR_STEPS):
+            redness = float(step) / (DAMAGE_COLOR_STEPS - 1)
+            row.fill((0,0,0,0))
+            #Adding onto a blank surface copies the pixels exactly, alpha and all
+            row.blit(sheet,(0,0),special_flags=pygame.BLEND_RGBA_ADD)
+            spriteManager.recolorSurface(row,{base_colors[0]: damageColor(redness,1.0),
+                                              base_colors[1]: damageColor(redness,0.785)})
+            for cell in range(cells):
+                digit = row.subsurface(pygame.Rect(cell*DIGIT_SIZE,0,DIGIT_SIZE,min(h,DIGIT_SIZE)))
+                damage_atlas.blit(pygame.transform.smoothscale(digit,(cell_w,cell_h)),(cell*cell_w,step*cell_h),
+                                  special_flags=pygame.BLEND_RGBA_ADD)
+    return damage_atlas
+
+"""
+The size of each digit in the damage atlas, after it's been shrunk down.
+"""
+def getDigitCellSize():
+    return (int(round(DIGIT_SIZE * float(HUD_PERCENT_SIZE[0]) / PERCENT_SIZE[0])),
+            int(round(DIGIT_SIZE * float(HUD_PERCENT_SIZE[1]) / PERCENT_SIZE[1])))
+
+def damageColor(_redness,_value):
+    return tuple(int(i * 255) for i in colorsys.hsv_to_rgb(0,_redness,_value))
+
 """
 The HealthTracker object contains the sprites needed to display the percentages and stocks.
 
@@ -511,11 +735,13 @@ class HealthTracker(spriteManager.Sprite):
         self.rect = self.bg_sprite.image.get_rect()
         
         #Until I can figure out the percentage sprites
-        self.percent_sprites = spriteManager.SheetSprite(settingsManager.createPath('sprites/guisheet.png'), 64)
-        self.kerning_values = [49,33,44,47,48,43,43,44,49,43,48] #This is the width of each sprite, for kerning purposes
+        self.damage_atlas = getDamageAtlas()
+        self.digit_size = getDigitCellSize()
+        self.kerning_values = [int(round(k * float(HUD_PERCENT_SIZE[0]) / PERCENT_SIZE[0])) for k in KERNING_VALUES]
         
         self.percent_sprite = spriteManager.Sprite()
-        self.percent_sprite.image = pygame.Surface((196,64), pygame.SRCALPHA, 32).convert_alpha()
+        #The same surface is drawn over every time the damage changes
+        self.percent_sprite.image = pygame.Surface(HUD_PERCENT_SIZE, pygame.SRCALPHA, 32).convert_alpha()
         self.redness = 0
         
         self.updateDamage()
@@ -523,38 +749,33 @@ class HealthTracker(spriteManager.Sprite):
         self.percent_sprite.rect.center = self.rect.center
         
     def updateDamage(self):
-        #recolor the percentage
-        old_redness = self.redness
+        #pick the row of the atlas that's closest to our color
         self.redness = min(1.0,float(self.percent) / 300)
-        #the lighter color first
-        rgb_from = tuple(int(i * 255) for i in colorsys.hsv_to_rgb(0,old_redness,1.0))
-        rgb_to = tuple(int(i * 255) for i in colorsys.hsv_to_rgb(0,self.redness,1.0))
-        self.percent_sprites.recolor(self.percent_sprites.sheet, rgb_from, rgb_to)
-        #the darker color next
-        rgb_from = tuple(int(i * 255) for i in colorsys.hsv_to_rgb(0,old_redness,0.785))
-        rgb_to = tuple(int(i * 255) for i in colorsys.hsv_to_rgb(0,self.redness,0.785))
-        self.percent_sprites.recolor(self.percent_sprites.sheet, rgb_from, rgb_to)
+        cell_w,cell_h = self.digit_size
+        row = int(round(self.redness * (DAMAGE_COLOR_STEPS - 1))) * cell_h
         
-        
-        self.percent_sprite.image = pygame.Surface((196,64), pygame.SRCALPHA, 32).convert_alpha()
+        self.percent_sprite.image.fill((0,0,0,0))
         
         percent_string = str(int(self.percent)) #converting it to a string so we can iterate over it.
         length = 0
         for ch in percent_string:
             i = int(ch)
-            self.percent_sprite.image.blit(self.percent_sprites.getImageAtIndex(i), (length,0))
+            self.percent_sprite.image.blit(self.damage_atlas, (length,0), pygame.Rect(i*cell_w,row,cell_w,cell_h))
             length += self.kerning_values[i]
         
         #add the % sign at the end
-        self.percent_sprite.image.blit(self.percent_sprites.getImageAtIndex(10), (length,0))
-        
-        self.percent_sprite.image = pygame.transform.smoothscale(self.percent_sprite.image, (96,32))
+        self.percent_sprite.image.blit(self.damage_atlas, (length,0), pygame.Rect(10*cell_w,row,cell_w,cell_h))
         length += self.kerning_values[10]
+        self.percent_sprite.changed = True
+        
+    def needsRedraw(self,_offset,_scale):
+        return not self.percent == int(self.fighter.damage) or spriteManager.Sprite.needsRedraw(self,_offset,_scale)
         
     def draw(self,_screen,_offset,_scale):
         if not self.percent == int(self.fighter.damage):
             self.percent = int(self.fighter.damage)
             self.updateDamage()
+            self.changed = True
         
         h = int(round(self.rect.height * _scale))
         w = int(round(self.rect.width * _scale))
@@ -564,6 +785,16 @@ class HealthTracker(spriteManager.Sprite):
         
         rect = self.percent_sprite.rect
         self.percent_sprite.draw(_screen, (new_off[0] + rect.left,new_off[1] + rect.top), _scale)
+        
+        #The percentage is drawn inside of the icon, so the icon's rect covers all of it
+        new_rect = pygame.Rect(new_off,(w,h))
+        ret_rect = None
+        if self.changed or new_rect != self.lastDrawnPosition or self.image is not self.last_drawn_image:
+            ret_rect = new_rect.union(self.lastDrawnPosition) if self.lastDrawnPosition.width > 0 else new_rect
+        self.lastDrawnPosition = new_rect
+        self.last_drawn_image = self.image
+        self.changed = False
+        return ret_rect
 
 """
 The Data Log object keeps track of information that happens in-game, such as score, deaths, total damage dealt/received, etc.
@@ -14,6 +14,9 @@ import engine.article as article
 import engine.controller as controller
 import engine.actionLoader as actionLoader
 import engine.articleLoader
+import assetManager
+import atlasManager
+import engine.fighterBundle as fighterBundle
 from global_functions import *
 
 class AbstractFighter():
@@ -146,11 +149,16 @@ class AbstractFighter():
     current_color = 0
     current_costume = 0
     
-    css_icon = spriteManager.ImageSprite(settingsManager.createPath('sprites/icon_unknown.png'))
+    #The CSS icon is only loaded by the roster, so it isn't read from disk just by importing this
+    css_icon = None
     
     color_palettes = []
     palette_display = []
     
+    #The actions every fighter goes through in both directions, whose flipped sprites are worth making up front
+    common_actions = ['NeutralAction','Move','Dash','Run','Pivot','RunPivot','Stop','RunStop','Crouch',
+                      'Jump','AirJump','Fall','Land','Shield','HitStun','Tumble','Prone','Getup']
+    
     def __init__(self,_baseDir,_playerNum):
         """ Create a fighter. To start, all that's needed is the directory it is in, and the player number.
         It uses the directory to find its fighter.xml file and begin storing data.
@@ -234,6 +242,9 @@ class AbstractFighter():
         
         
         #TODO color palettes
+        #These start out as class lists, so give each fighter its own before filling them in
+        self.color_palettes = []
+        self.palette_display = []
         for color_palette in self.xml_data.findall('color_palette'):
             color_dict = {}
             for color_map in color_palette.findall('color_map'):
@@ -254,11 +265,7 @@ class AbstractFighter():
         self.current_color = self.player_num
           
         # Now that we've got all the paths, need to actually load the files
-        if self.css_icon_path[0] == '.': #If the path starts with a period, start from the top of the game directory instead
-            self.css_icon = spriteManager.ImageSprite(settingsManager.createPath(self.css_icon_path))
-        else:
-            self.css_icon = spriteManager.ImageSprite(os.path.join(self.base_dir,self.css_icon_path))
-        
+        # The CSS icon isn't needed once the fighter is picked, the roster already has it
         if self.franchise_icon_path[0] == '.': #If the path starts with a period, start from the top of the game directory instead
             self.franchise_icon = spriteManager.ImageSprite(settingsManager.createPath(self.franchise_icon_path))
         else:
@@ -276,11 +283,14 @@ class AbstractFighter():
         
         self.events = dict()
         
+        #If the fighter's been compiled and hasn't changed since, most of it can come from the bundle
+        self.bundle = fighterBundle.loadBundle(self.base_dir)
+        
         #try:
         if self.action_file.endswith('.py'):
             self.actions = settingsManager.importFromURI(os.path.join(_baseDir,'fighter.xml'),self.action_file,_suffix=str(self.player_num))
         else:
-            self.actions = actionLoader.ActionLoader(_baseDir,self.action_file)
+            self.actions = actionLoader.ActionLoader(_baseDir,self.action_file,self.bundle)
             self.events = self.actions.getGlobalEvents()
         #except:
         #    self.actions = baseActions
@@ -379,6 +389,16 @@ class AbstractFighter():
 
         if _color == None: _color = self.current_color
         
+        #Pack the sprites and article sheets together, so the sheets below come out of the atlas
+        prefix = self.costumes[self.current_costume % len(self.costumes)]
+        try:
+            if self.bundle is not None and self.bundle.hasAtlas(prefix):
+                self.bundle.loadAtlas(str(directory),prefix)
+            else:
+                atlasManager.getAtlas(str(directory),prefix,self.sprite_width,self.getArticleDirectories())
+        except Exception as e:
+            print("Could not load sprite atlas for " + self.name, e)
+        
         self.sprite = spriteManager.SpriteHandler(str(directory),
                                                   self.costumes[self.current_costume % len(self.costumes)],
                                                   self.default_sprite,
@@ -387,6 +407,63 @@ class AbstractFighter():
                                                   scale,
                                                   self.sprite_flip)
         self.rect = self.sprite.rect
+        if settingsManager.getSetting('prewarmFlippedSprites'):
+            self.sprite.prewarm(self.getCommonSprites())
+    
+    def getCommonSprites(self):
+        """ Get the names of the sprites used by the fighter's common actions,
+        the ones that are likely to be seen facing both ways in every match.
+        
+        Return
+        -----------
+        list : The sprite names of every action in common_actions that
+               the fighter has.
+        """
+        sprite_names = []
+        for action_name in self.common_actions:
+            try:
+                action = self.getAction(action_name)
+            except Exception as e:
+                print("Could not load common action " + action_name, e)
+                continue
+            if action is not None and action.sprite_name and not action.sprite_name in sprite_names:
+                sprite_names.append(action.sprite_name)
+        return sprite_names
+    
+    def getArticleDirectories(self):
+        """ Get the directories that hold article sprites, if the fighter has any.
+        
+        Return
+        -----------
+        list : The full paths of the article sprite directories
+        """
+        if self.article_path_short:
+            return [self.article_path]
+        return []
+    
+    def preloadAssets(self):
+        """ Queue up the sprite sheets for the chosen costume and the sound effects
+        to be decoded in the background, so they're ready by the time the battle
+        starts. Uses the current costume, so call this after it's been set.
+        """
+        assets = assetManager.getAssetManager()
+        directory = os.path.join(self.base_dir,self.sprite_directory)
+        prefix = self.costumes[self.current_costume % len(self.costumes)]
+        #A bundled atlas only needs decompressing, which can be done right here on the loader thread
+        if self.bundle is not None and self.bundle.hasAtlas(prefix):
+            try:
+                self.bundle.preloadAtlas(prefix)
+            except Exception as e:
+                print("Could not preload fighter bundle for " + self.name, e)
+        elif not atlasManager.preloadAtlas(directory,prefix,self.sprite_width,self.getArticleDirectories()):
+            assets.preloadDirectory(directory,prefix)
+            for article_directory in self.getArticleDirectories():
+                assets.preloadDirectory(article_directory)
+        if self.bundle is not None:
+            for sound in self.bundle.sounds:
+                assets.preload(sound)
+        elif self.sound_path:
+            assets.preloadDirectory(os.path.join(self.base_dir,self.sound_path))
     
     def initialize(self):
         """ This method is called when shit gets real. It creates the collision box, sprite library,
@@ -405,22 +482,20 @@ class AbstractFighter():
         if self.sound_path:
             settingsManager.getSfx().addSoundsFromDirectory(os.path.join(self.base_dir,self.sound_path), self.name)
 
-        if self.xml_data is not None:
+        if self.bundle is not None:
+            stats = self.bundle.stats.items()
+            self.default_vars.update(self.bundle.variables)
+        elif self.xml_data is not None:
+            stats = []
             if self.xml_data.find('stats') is not None:
-                for stat in self.xml_data.find('stats'):
-                    vartype = type(self.default_stats[stat.tag]).__name__
-                    if vartype == 'int': self.default_stats[stat.tag] = int(stat.text)
-                    if vartype == 'float': self.default_stats[stat.tag] = float(stat.text)
-            
-            if self.xml_data.find('variables') is not None:
-                for variable in self.xml_data.find('variables'):
-                    vartype = 'string'
-                    if variable.attrib.has_key('type'): vartype = variable.attrib['type']
-                    val = variable.text
-                    if vartype == 'int': val = int(val)
-                    elif vartype == 'float': val = float(val)
-                    elif vartype == 'bool': val = bool(val)
-                    self.default_vars[variable.tag] = val
+                stats = [(stat.tag,stat.text) for stat in self.xml_data.find('stats')]
+            self.default_vars.update(fighterBundle.parseVariables(self.xml_data))
+        else: stats = []
+        
+        for tag,text in stats:
+            vartype = type(self.default_stats[tag]).__name__
+            if vartype == 'int': self.default_stats[tag] = int(text)
+            if vartype == 'float': self.default_stats[tag] = float(text)
         self.onRespawn()
     
         
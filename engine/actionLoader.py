@@ -8,21 +8,51 @@ import xml.dom.minidom as minidom
 import os
 import traceback
 from ast import literal_eval as make_tuple
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 class ActionLoader():
-    def __init__(self, _baseDir, _actions):
+    """
+    If the fighter has a bundle, its compiled actions are passed in, and the XML isn't
+    parsed until something actually needs it, like loading a Python action or saving.
+    """
+    def __init__(self, _baseDir, _actions, _bundle=None):
         self.actions_xml_data = os.path.join(_baseDir,_actions)
         self.base_dir = _baseDir
+        self.action_names = None
+        self.templates = {}
+        self.events = None
+        if _bundle is not None and _bundle.action_names is not None:
+            self.action_names = _bundle.action_names
+            self.templates = _bundle.action_templates
+            self.events = _bundle.events
+        else:
+            self.parseXml()
+    
+    def parseXml(self):
         self.actions_xml_full = ElementTree.parse(self.actions_xml_data)
         self.actions_xml = self.actions_xml_full.getroot()
         print('actions_xml: ' + str(self.actions_xml))
     
+    def __getattr__(self, _name):
+        #Only called when the XML hasn't been parsed yet
+        if _name in ('actions_xml','actions_xml_full'):
+            self.parseXml()
+            return getattr(self,_name)
+        raise AttributeError(_name)
+    
     def hasAction(self, _actionName):
+        if self.action_names is not None:
+            return _actionName in self.action_names
         if self.actions_xml.find(_actionName) is None:
             return False
         return True
     
     def getAllActions(self):
+        if self.action_names is not None:
+            return list(self.action_names)
         ret = []
         for item in list(self.actions_xml):
             ret.append(item.tag)
@@ -35,6 +65,8 @@ class ActionLoader():
     def getGlobalEvents(self):
         """ Grabs all event subactions at the top level and returns
         them into a dict."""
+        if self.events is not None:
+            return pickle.loads(self.events)
         retDict = dict()
         
         for eventNode in self.actions_xml.findall('event'):
@@ -48,6 +80,10 @@ class ActionLoader():
     object of the fighter.
     """
     def modifyAction(self,_actionName,_newAction):
+        #The compiled actions are out of date now, so go back to the XML
+        self.action_names = None
+        self.templates = {}
+        self.events = None
         action_xml = self.actions_xml.find(_actionName)
         if action_xml is not None:self.actions_xml.remove(action_xml)
         
@@ -159,6 +195,10 @@ class ActionLoader():
             self.actions_xml.append(ElementTree.fromstring(data))
             
     def loadAction(self,_actionName):
+        #Compiled actions just need to be copied out of the bundle
+        if _actionName in self.templates:
+            return pickle.loads(self.templates[_actionName])
+        
         #Load the action XML
         action_xml = self.actions_xml.find(_actionName)
         print('loading action',action_xml,_actionName)
@@ -70,6 +70,13 @@ class DynamicArticle():
         
         self.default_vars = {}
         self.variables = {}
+        
+        #If the article came from a pool, it goes back there when it's deactivated
+        self.pool = None
+        self.article_name = None
+        #The (action, name) pairs that loaded this article, so they can let go of it when it's deactivated
+        self.holders = []
+        self.base_sprite = self.sprite
 
     ########################################################
     #                   UPDATE METHODS                     #
@@ -191,6 +198,36 @@ class DynamicArticle():
         self.sprite = None
         if self in self.owner.articles:
             self.owner.articles.remove(self)
+        #Once it's back in the pool it could be handed to another action, so the old ones can't keep it
+        for action,name in self.holders:
+            if action.articles.get(name) is self:
+                del action.articles[name]
+        self.holders = []
+        if self.pool is not None:
+            self.pool.release(self)
+    
+    """
+    Put the article back the way it was when it was built, so it can be activated again.
+    """
+    def reset(self):
+        self.sprite = self.base_sprite
+        self.sprite.reset()
+        self.frame = 0
+        self.posx = 0
+        self.posy = 0
+        self.change_x = 0
+        self.change_y = 0
+        self.facing = self.starting_direction
+        self.ecb_size = [0,0]
+        self.ecb_offset = [0,0]
+        self.sprite_rate = self.base_sprite_rate
+        self.loop = True
+        self.hitboxes = {}
+        self.hitbox_locks = {}
+        self.platform_phase = 0
+        self.elasticity = 0
+        self.ground_elasticity = 0
+        self.variables = {}
 
     def collisionUpdate(self):
         if 'platform_phase' in self.variables:
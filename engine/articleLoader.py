@@ -1,21 +1,91 @@
 import os
+import copy
 import xml.etree.ElementTree as ElementTree
 import engine.subaction as subaction
 import engine.article as article
 import settingsManager
+import assetManager
+import atlasManager
 from ast import literal_eval as make_tuple
 
+#How many spare copies of each article a fighter holds on to once they've been deactivated
+ARTICLE_POOL_SIZE = 8
+
+"""
+An ArticlePool holds on to a fighter's articles once they're deactivated, so the next time an
+article with the same name is loaded, an old one can be reset and used again instead of being
+built from scratch. It also keeps every sprite sheet the articles use, so each one is only
+loaded once no matter how many copies of the article are out.
+"""
+class ArticlePool():
+    def __init__(self,_size=ARTICLE_POOL_SIZE):
+        self.size = _size
+        self.free = {}
+        self.sheets = {}
+        self.hits = {}
+        self.misses = {}
+    
+    """
+    Get a reset article with the given name, if there's one waiting. Returns None if there isn't,
+    in which case a new one needs to be built.
+    """
+    def acquire(self,_articleName):
+        free = self.free.get(_articleName)
+        if free:
+            self.hits[_articleName] = self.hits.get(_articleName,0) + 1
+            pooled_article = free.pop()
+            pooled_article.reset()
+            return pooled_article
+        self.misses[_articleName] = self.misses.get(_articleName,0) + 1
+        return None
+    
+    """
+    Take back an article that's been deactivated. If there are already enough of them waiting,
+    it's just thrown away.
+    """
+    def release(self,_article):
+        free = self.free.setdefault(_article.article_name,[])
+        if len(free) < self.size and not _article in free:
+            free.append(_article)
+    
+    def getSheet(self,_path):
+        if not _path in self.sheets:
+            sheet = atlasManager.getSheet(_path)
+            if sheet is None:
+                sheet = assetManager.getAssetManager().getImage(_path)
+            self.sheets[_path] = sheet
+        return self.sheets[_path]
+    
+    """
+    Get the hits, misses and number of spare articles waiting for every article that's been loaded.
+    """
+    def getReport(self):
+        report = {}
+        for name in set(self.hits) | set(self.misses):
+            report[name] = {'hits': self.hits.get(name,0),
+                            'misses': self.misses.get(name,0),
+                            'free': len(self.free.get(name,[]))}
+        return report
+
 class ArticleLoader():
     def __init__(self,_owner):
         self.owner = _owner
         self.base_dir = _owner.base_dir
         xml_path = _owner.article_loader_path
         self.article_path = _owner.article_path
+        self.pool = ArticlePool()
         if xml_path:
             self.articles_xml_path = os.path.join(self.base_dir,xml_path)
             self.articles_xml_full = ElementTree.parse(self.articles_xml_path)
             self.articles_xml = self.articles_xml_full.getroot()
         
+        #Every article is compiled into a template up front, so loading one mid-match doesn't touch the XML
+        self.templates = {}
+        #Python article modules, by file name, so each is only imported once
+        self.modules = {}
+        if xml_path:
+            self.compileArticles()
+        
     """
     Returns True if the XML data has the article of the given name.
     """
@@ -47,17 +117,53 @@ class ArticleLoader():
         pass
     
     """
-    Creates a DynamicArticle from the given XML object
+    Creates a DynamicArticle from its template, or reuses one from the pool.
     """
     def loadArticle(self,_articleName):
+        template = self.getTemplate(_articleName)
+        if template.article_class is None:
+            pooled_article = self.pool.acquire(_articleName)
+            if pooled_article is not None:
+                return pooled_article
+        return template.instantiate(self.owner,self.pool)
+    
+    """
+    Compile every article in the XML into a template. An article that can't be compiled is
+    left out, and will show the error again if it's ever loaded.
+    """
+    def compileArticles(self):
+        for article_name in self.getAllArticles():
+            try:
+                self.getTemplate(article_name)
+            except Exception as e:
+                print("Could not compile article " + article_name, e)
+    
+    def getTemplate(self,_articleName):
+        if not _articleName in self.templates:
+            self.templates[_articleName] = self.compileArticle(_articleName)
+        return self.templates[_articleName]
+    
+    """
+    Import a Python article file, or get it again if it's already been imported.
+    """
+    def getModule(self,_fileName):
+        if not _fileName in self.modules:
+            self.modules[_fileName] = settingsManager.importFromURI(os.path.join(self.base_dir,_fileName), _fileName)
+        return self.modules[_fileName]
+    
+    """
+    Read an article out of the XML and build every one of its subactions.
+    """
+    def compileArticle(self,_articleName):
         article_xml = self.articles_xml.find(_articleName)
+        template = ArticleTemplate(_articleName)
         
         #Check if it's a Python article
         if article_xml is not None and article_xml.find('loadCodeAction') is not None:
             file_name = article_xml.find('loadCodeAction').find('file').text
             article_name = article_xml.find('loadCodeAction').find('action').text
-            new_action = settingsManager.importFromURI(os.path.join(self.base_dir,file_name), file_name)
-            return getattr(new_action, article_name)()
+            template.article_class = getattr(self.getModule(file_name), article_name)
+            return template
     
         #Get the action variables
         length = int(self.loadNodeWithDefault(article_xml, 'length', 1))
@@ -189,26 +295,28 @@ class ArticleLoader():
                     collision_list.append(subaction.subactionFactory.buildFromXml(subact.tag,subact))
             collision_actions[col.attrib['other']] = collision_list
         
-        #Create and populate the Dynamic Action
-        dyn_article = article.DynamicArticle(self.owner, os.path.join(self.article_path,sprite_name),
-                                             img_width, origin_point, length, sprite_rate, facing_direction,
-                                             draw_depth,tags)
-        
-        dyn_article.actions_before_frame = subactions_before_frame
-        dyn_article.actions_at_frame = subactions_at_frame
-        dyn_article.actions_after_frame = subactions_after_frame
-        dyn_article.actions_at_last_frame = subactions_at_last_frame
-        dyn_article.set_up_actions = set_up_actions
-        dyn_article.tear_down_actions = tear_down_actions
-        dyn_article.actions_on_clank = actions_on_clank
-        dyn_article.actions_on_prevail = actions_on_prevail
-        dyn_article.events = event_actions
-        dyn_article.collision_actions = collision_actions
-        if sprite_name: dyn_article.sprite_name = sprite_name
-        if sprite_rate: dyn_article.base_sprite_rate = sprite_rate
-        
-        dyn_article.default_vars = article_vars
-        return dyn_article
+        template.length = length
+        template.sprite_name = sprite_name
+        template.sprite_path = os.path.join(self.article_path,sprite_name)
+        template.sprite_rate = sprite_rate
+        template.img_width = img_width
+        template.draw_depth = draw_depth
+        template.origin_point = origin_point
+        template.facing_direction = facing_direction
+        template.tags = tags
+        template.variables = article_vars
+        
+        template.actions_before_frame = subactions_before_frame
+        template.actions_at_frame = subactions_at_frame
+        template.actions_after_frame = subactions_after_frame
+        template.actions_at_last_frame = subactions_at_last_frame
+        template.set_up_actions = set_up_actions
+        template.tear_down_actions = tear_down_actions
+        template.actions_on_clank = actions_on_clank
+        template.actions_on_prevail = actions_on_prevail
+        template.events = event_actions
+        template.collision_actions = collision_actions
+        return template
     
     """
     Helper method to load a node from XML, and default it to something if the node is not there.
@@ -222,3 +330,43 @@ class ArticleLoader():
                 return _default
         else:
             return _default
+
+"""
+Everything needed to build an article, already read out of the XML. Subactions aren't stateless,
+execute sets values on them and some, like changeSpeed, replace their own fields for good, so each
+copy of the article gets its own deep copy of them.
+"""
+class ArticleTemplate():
+    def __init__(self,_name):
+        self.name = _name
+        #Python articles are built by calling this class instead
+        self.article_class = None
+        
+    def instantiate(self,_owner,_pool):
+        if self.article_class is not None:
+            return self.article_class()
+        
+        #Create and populate the Dynamic Action
+        dyn_article = article.DynamicArticle(_owner, _pool.getSheet(self.sprite_path),
+                                             self.img_width, self.origin_point, self.length, self.sprite_rate, self.facing_direction,
+                                             self.draw_depth,list(self.tags))
+        
+        #One memo for all of them, so a subaction that shows up in two lists is still the same object in both
+        memo = {}
+        dyn_article.actions_before_frame = copy.deepcopy(self.actions_before_frame,memo)
+        dyn_article.actions_at_frame = copy.deepcopy(self.actions_at_frame,memo)
+        dyn_article.actions_after_frame = copy.deepcopy(self.actions_after_frame,memo)
+        dyn_article.actions_at_last_frame = copy.deepcopy(self.actions_at_last_frame,memo)
+        dyn_article.set_up_actions = copy.deepcopy(self.set_up_actions,memo)
+        dyn_article.tear_down_actions = copy.deepcopy(self.tear_down_actions,memo)
+        dyn_article.actions_on_clank = copy.deepcopy(self.actions_on_clank,memo)
+        dyn_article.actions_on_prevail = copy.deepcopy(self.actions_on_prevail,memo)
+        dyn_article.events = copy.deepcopy(self.events,memo)
+        dyn_article.collision_actions = copy.deepcopy(self.collision_actions,memo)
+        if self.sprite_name: dyn_article.sprite_name = self.sprite_name
+        if self.sprite_rate: dyn_article.base_sprite_rate = self.sprite_rate
+        
+        dyn_article.default_vars = dict(self.variables)
+        dyn_article.pool = _pool
+        dyn_article.article_name = self.name
+        return dyn_article
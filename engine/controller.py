@@ -1,6 +1,9 @@
 import settingsManager
 import pygame
 
+#the event type the network plays back each player's button presses and releases as
+REMOTE_BUTTON_EVENT = pygame.USEREVENT+3
+
 class BaseController():
     def __init__(self,_bindings):
         self.keys_to_pass = []
@@ -131,6 +134,34 @@ class GamepadController(BaseController):
     def getKeysForAction(self,_action):
         return self.key_bindings.getKeysForAction(_action)
     
+"""
+In a networked game, every player is driven by one of these instead of their own controller, including
+the one playing on this machine. The network turns input into the buttons it presses and releases, by the
+names they're bound to, and plays them back on the frame they're for as REMOTE_BUTTON_EVENT events, with
+the number of the player they belong to. Each RemoteController only takes the ones for its own player.
+"""
+class RemoteController(BaseController):
+    def __init__(self,_playerNum,_timingWindow = dict()):
+        BaseController.__init__(self, {})
+        self.player_num = _playerNum
+        self.timing_window = _timingWindow
+        
+    def getInputs(self,_event,_push = True, _outputOnRelease = True):
+        if _event.type != REMOTE_BUTTON_EVENT or _event.player != self.player_num:
+            return None
+        k = _event.button
+        if _event.pressed:
+            if _push: self.keys_to_pass.append(k)
+            if k not in self.keys_held: self.keys_held.append(k)
+            return k
+        if _push: self.keys_to_release.append(k)
+        if k in self.keys_held: self.keys_held.remove(k)
+        if _outputOnRelease: return k
+        return None
+    
+    def getKeysForAction(self,_action):
+        return []
+    
 class PadBindings():
     def __init__(self,_joyName,_joystick,_axisBindings,_buttonBindings):
         self.name = _joyName
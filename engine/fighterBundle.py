@@ -0,0 +1,264 @@
+import os
+import zlib
+import struct
+import hashlib
+import threading
+import pygame
+import assetManager
+import atlasManager
+import engine.actionLoader as actionLoader
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+"""
+A fighter bundle is a fighter directory compiled down into a single file, so it can be loaded
+without parsing any XML or decoding any images. It holds:
+
+ * every action from the actions XML, already built and pickled, ready to be copied out
+ * the global events, stats and variables from the XML
+ * the packed sprite atlas for every costume, as zlib compressed RGBA pixels
+ * the paths of the fighter's sounds
+
+The bundle is saved as .bundle/fighter.bundle inside the fighter's directory. The file starts with
+a fixed size header, then the pickled metadata, then the compressed pixels of every atlas page one
+after another. Only the header and metadata are read when the bundle is opened. A costume's pages are
+read and decompressed when it's preloaded on the FighterLoader thread, and only made into surfaces
+when the battle starts, which is a copy and nothing more.
+
+Bundles are made by the build step, see main. Building one decodes and packs every costume, so
+it's never done while the game is running. The XML and images are always the real data. The header
+has a hash of the name, size, modification time and change time of every file in the fighter's directory, and if
+anything has changed, the bundle is ignored and the fighter is loaded from its XML until the build
+step is run again. The .bundle folder can be deleted at any time.
+
+Each bundle is only opened once, and shared by every fighter loaded from the same directory.
+"""
+BUNDLE_MAGIC = b'USSB'
+BUNDLE_VERSION = 3
+BUNDLE_DIRECTORY = '.bundle'
+BUNDLE_FILE = 'fighter.bundle'
+
+#magic, version, source hash, length of the metadata
+HEADER_FORMAT = '<4sI40sQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+#Anything in the fighter directory that isn't a source file
+IGNORED_DIRECTORIES = [BUNDLE_DIRECTORY, atlasManager.ATLAS_DIRECTORY, '__pycache__']
+IGNORED_EXTENSIONS = ['.pyc', '.pyo']
+
+#Every bundle that's open, by the fighter directory it's for. Fighters are loaded on FighterLoader
+#threads, so anything that looks at or changes it has to hold the lock
+bundles = {}
+bundles_lock = threading.Lock()
+
+def getBundlePath(_directory):
+    return os.path.join(_directory,BUNDLE_DIRECTORY,BUNDLE_FILE)
+
+"""
+A hash of the name, size, modification time and change time of every file in a fighter's directory,
+the same as atlasManager.fingerprintSources. Only the files' stats are read, so checking a bundle
+doesn't cost more for fighters with lots of sprites and sounds.
+"""
+def hashDirectory(_directory):
+    digest = hashlib.sha1()
+    digest.update(str(BUNDLE_VERSION).encode('utf-8'))
+    for root, dirs, files in os.walk(_directory):
+        dirs[:] = sorted([d for d in dirs if not d in IGNORED_DIRECTORIES])
+        for f in sorted(files):
+            if os.path.splitext(f)[1] in IGNORED_EXTENSIONS or f.endswith('~'):
+                continue
+            path = os.path.join(root,f)
+            stat = os.stat(path)
+            digest.update(os.path.relpath(path,_directory).replace(os.sep,'/').encode('utf-8'))
+            digest.update((':'+str(stat.st_size)+':'+repr(stat.st_mtime)+':'+repr(stat.st_ctime)+'\n').encode('utf-8'))
+    return digest.hexdigest()
+
+"""
+Load the bundle for a fighter directory. Returns None if there isn't one, or if it's out of date
+with the files in the directory, in which case the fighter should be loaded from its XML.
+"""
+def loadBundle(_directory):
+    path = getBundlePath(_directory)
+    source_hash = hashDirectory(_directory)
+    with bundles_lock:
+        bundle = bundles.get(path)
+        if bundle is not None:
+            if bundle.source_hash == source_hash:
+                return bundle
+            del bundles[path]
+        if not os.path.exists(path):
+            return None
+        try:
+            bundle = FighterBundle(path)
+        except Exception as e:
+            print("Could not read fighter bundle " + path, e)
+            return None
+        if bundle.source_hash != source_hash:
+            return None
+        bundles[path] = bundle
+        return bundle
+
+"""
+Compile a loaded fighter into a bundle and save it, then load it back. Building the atlases
+decodes every sprite, so this is slow, and it's only done by the build step. Returns None if
+the bundle couldn't be made.
+"""
+def compileBundle(_fighter):
+    directory = _fighter.base_dir
+    source_hash = hashDirectory(directory)
+    sprite_directory = os.path.join(directory,_fighter.sprite_directory)
+    metadata = {'stats': {}, 'variables': {}, 'action_names': None,
+                'action_templates': {}, 'events': None, 'sounds': [], 'atlases': {}}
+
+    if _fighter.xml_data is not None:
+        if _fighter.xml_data.find('stats') is not None:
+            for stat in _fighter.xml_data.find('stats'):
+                metadata['stats'][stat.tag] = stat.text
+        metadata['variables'] = parseVariables(_fighter.xml_data)
+
+    #Python actions are imported fresh for every fighter, so only XML actions can be compiled
+    if isinstance(_fighter.actions,actionLoader.ActionLoader):
+        loader = actionLoader.ActionLoader(directory,_fighter.action_file)
+        metadata['action_names'] = loader.getAllActions()
+        metadata['events'] = pickle.dumps(loader.getGlobalEvents(),2)
+        for action_name in metadata['action_names']:
+            action_xml = loader.actions_xml.find(action_name)
+            if action_xml.find('loadCodeAction') is not None:
+                continue
+            try:
+                metadata['action_templates'][action_name] = pickle.dumps(loader.loadAction(action_name),2)
+            except Exception as e:
+                print("Could not compile action " + action_name, e)
+
+    if _fighter.sound_path:
+        sound_directory = os.path.join(directory,_fighter.sound_path)
+        if os.path.isdir(sound_directory):
+            for f in sorted(os.listdir(sound_directory)):
+                if os.path.splitext(f)[1] in assetManager.SOUND_TYPES:
+                    metadata['sounds'].append(os.path.relpath(os.path.join(sound_directory,f),directory))
+
+    pages = []
+    page_offset = 0
+    for prefix in set(_fighter.costumes):
+        atlas = atlasManager.getAtlas(sprite_directory,prefix,_fighter.sprite_width,_fighter.getArticleDirectories())
+        page_entries = []
+        for page in atlas.pages:
+            data = zlib.compress(pygame.image.tostring(page,'RGBA'))
+            page_entries.append((page_offset,len(data),page.get_width(),page.get_height()))
+            pages.append(data)
+            page_offset += len(data)
+        metadata['atlases'][prefix] = ({'hash': atlas.source_hash, 'sheets': atlas.sheets}, page_entries)
+
+    path = getBundlePath(directory)
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        data = pickle.dumps(metadata,2)
+        with open(path,'wb') as bundle_file:
+            bundle_file.write(struct.pack(HEADER_FORMAT,BUNDLE_MAGIC,BUNDLE_VERSION,source_hash.encode('ascii'),len(data)))
+            bundle_file.write(data)
+            for page in pages:
+                bundle_file.write(page)
+    except Exception as e:
+        print("Could not save fighter bundle " + path, e)
+        return None
+    return loadBundle(directory)
+
+"""
+Read the variables out of fighter XML, converting each one to its type.
+"""
+def parseVariables(_xmlData):
+    variables = {}
+    if _xmlData.find('variables') is not None:
+        for variable in _xmlData.find('variables'):
+            vartype = 'string'
+            if 'type' in variable.attrib: vartype = variable.attrib['type']
+            val = variable.text
+            if vartype == 'int': val = int(val)
+            elif vartype == 'float': val = float(val)
+            elif vartype == 'bool': val = bool(val)
+            variables[variable.tag] = val
+    return variables
+
+class FighterBundle():
+    def __init__(self,_path):
+        self.path = _path
+        with open(_path,'rb') as bundle_file:
+            magic,version,source_hash,length = struct.unpack(HEADER_FORMAT,bundle_file.read(HEADER_SIZE))
+            if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+                raise ValueError("Not a version " + str(BUNDLE_VERSION) + " fighter bundle")
+            metadata = pickle.loads(bundle_file.read(length))
+        self.source_hash = source_hash.decode('ascii')
+        self.pages_start = HEADER_SIZE + length
+
+        self.stats = metadata['stats']
+        self.variables = metadata['variables']
+        self.action_names = metadata['action_names']
+        self.action_templates = metadata['action_templates']
+        self.events = metadata['events']
+        self.sounds = [os.path.join(os.path.dirname(os.path.dirname(_path)),sound) for sound in metadata['sounds']]
+        self.atlases = metadata['atlases']
+        #The decompressed pixels of each costume's pages that have been preloaded, by prefix
+        self.page_data = {}
+        self.lock = threading.Lock()
+
+    def hasAtlas(self,_prefix):
+        return _prefix in self.atlases
+
+    """
+    Read and decompress the pages of a costume's atlas, without making surfaces out of them.
+    This is safe to call from another thread, like preloading sheets with the asset manager.
+    """
+    def preloadAtlas(self,_prefix):
+        _,page_entries = self.atlases[_prefix]
+        pages = []
+        with open(self.path,'rb') as bundle_file:
+            for offset,length,width,height in page_entries:
+                bundle_file.seek(self.pages_start + offset)
+                pages.append(zlib.decompress(bundle_file.read(length)))
+        with self.lock:
+            self.page_data[_prefix] = pages
+        return pages
+
+    """
+    Hand the atlas for a costume over to the atlas manager. The pages come from preloadAtlas if
+    it's been called, or are read now if it hasn't.
+    """
+    def loadAtlas(self,_directory,_prefix):
+        index,page_entries = self.atlases[_prefix]
+        index_path = atlasManager.getIndexPath(_directory,_prefix)
+        atlas = atlasManager.atlases.get(index_path)
+        if atlas is not None and atlas.source_hash == index['hash']:
+            return atlas
+
+        with self.lock:
+            page_data = self.page_data.pop(_prefix,None)
+        if page_data is None:
+            page_data = self.preloadAtlas(_prefix)
+            with self.lock:
+                self.page_data.pop(_prefix,None)
+        pages = []
+        for data,(offset,length,width,height) in zip(page_data,page_entries):
+            page = pygame.image.fromstring(data,(width,height),'RGBA')
+            if pygame.display.get_surface() is not None:
+                page = page.convert_alpha()
+            pages.append(page)
+        return atlasManager.addAtlas(index_path,index,pages)
+
+"""
+The build step. Compiles the bundle of every fighter in the fighters directory that's out of date.
+Run it from the game directory with: python -m engine.fighterBundle
+"""
+def main():
+    import rosterManager
+    pygame.init()
+    for entry in rosterManager.getRoster().getEntries():
+        fighter = entry.getFighter(0)
+        if fighter.bundle is not None:
+            print(entry.name + " is up to date")
+        elif compileBundle(fighter) is not None:
+            print("Compiled " + entry.name)
+
+if __name__ == '__main__': main()
@@ -1,91 +1,58 @@
+import os
 import socket 
 import json 
 import select 
 import random
 import pygame
 import settingsManager
+import engine.controller as controller
+from engine.networkMessages import BUTTONS, NetworkEvt, NetworkTickMessage, NetworkFighterMessage, NetworkProgressMessage, NetworkPingMessage, NetworkInputMessage, NetworkSnapshotAckMessage, NetworkClockMessage, MessageBuffer, frameMessage, getDelayChangeFrame
+from engine.stateSync import StateSync
 
+import math
 import time
 
-class NetworkEvt(object):
-    pass#empty, for deserialising, attributes are added from json
+FRAME_RATE = 60
+#input delay is kept between these, in frames
+MIN_INPUT_DELAY = 2
+MAX_INPUT_DELAY = 15
+#frames of delay added on top of what the connection needs, to be safe
+DELAY_MARGIN = 1
+#how often to ask the server to join again while waiting for the match to start, in seconds, in case
+#the request or the answer was lost
+JOIN_INTERVAL = 0.5
+#how often to tell the server how far this client is progressing, in frames. Has to be no more than MIN_INPUT_DELAY
+PROGRESS_INTERVAL = 2
+#how often to ping the other player, in frames
+PING_INTERVAL = 30
+#how often to sync the clock with the server, in seconds, a lot more often until there are enough samples
+#to pick from, and how many of the latest samples to pick the best one from
+CLOCK_SYNC_INTERVAL = 1.0
+CLOCK_SYNC_STARTUP_INTERVAL = 0.1
+CLOCK_SAMPLES = 8
+#how often a row of telemetry is written to the match's CSV file, in frames
+TELEMETRY_INTERVAL = 30
+TELEMETRY_DIRECTORY = 'netplay'
+#how quickly the round trip and frame advantage follow new measurements, from 0 to 1
+RTT_SMOOTHING = 0.125
+ADVANTAGE_SMOOTHING = 0.2
+#the most the frame rate is nudged to keep in step with the other player, in frames per second
+MAX_DRIFT_CORRECTION = 2
+#how long a stall goes between reminders, in frames
+MAX_STALL_FRAMES = 100
+#how long a single stall can go on before giving up on the other player and leaving the match, in frames
+STALL_TIMEOUT = 600
+#over UDP, the most frames of unacknowledged input to send in each packet
+INPUT_REDUNDANCY = 16
+#how often player 1 sends a snapshot of the fighters, in frames, and how often it's a full one, for
+#spectators to start from
+SNAPSHOT_INTERVAL = 10
+KEYFRAME_INTERVAL = 120
+#a spectator further behind the match than this, in frames, plays without drawing until it catches up
+CATCH_UP_FRAMES = 30
+#biggest UDP packet to read
+UDP_PACKET_SIZE = 1024
 
-class NetworkUpdateMessage(object):
-    def __init__(self):
-        self.status = "u"
-        self.json = "{}"
-        self.type = 0
-        self.frame = 0
-    def toString(self):
-        return self.status+"_"+str(self.type)+"_"+str(self.frame)+"_"+self.json
-    def isValid(self,msg):
-        return (len(msg)>1 and msg[0] == "u" and msg.count("_")==3)
-    def isBlank(self):
-        return self.type == 0
-    def fromString(self,msg):
-        evt = NetworkEvt()
-        evtSplit = msg.split("_")
-        self.status = evtSplit[0]
-        self.type = int(evtSplit[1])
-        self.frame = int(evtSplit[2])
-        self.json = evtSplit[3]
-        evt.type = self.type
-        jsondict = json.loads(self.json).items()
-        for attr,val in jsondict:
-            setattr(evt,attr,val)
-        return evt
-    def update(self,_type,_json,_frame):
-        self.json = _json
-        self.type = _type
-        self.frame = _frame
-
-class NetworkTickMessage(object):
-    def __init__(self):
-        self.status = "t"
-        self.json = ""
-        self.tick = 0
-    def isValid(self,msg):
-        return (len(msg)>1 and msg[0] == "t" and msg.count("_")==2)
-    def fromString(self,msg):
-        evtSplit = msg.split("_")
-        self.status = evtSplit[0]
-        self.tick = int(evtSplit[1])
-        self.json = evtSplit[2]
-        return self
-
-class NetworkFighterMessage(object):
-    def __init__(self):
-        self.status = "f"
-        self.frame = 0
-        self.json = ""
-    def setFighter(self,_frame,_fighterAttrs):
-        self.frame = _frame
-        self.json = json.dumps(_fighterAttrs)
-    def isValid(self,msg):
-        return (len(msg)>1 and msg[0] == "f" and msg.count("|")==2)
-    def toString(self):
-        return self.status+"|"+str(self.frame)+"|"+self.json
-    def fromString(self,msg):
-        evtSplit = msg.split("|")
-        self.status = evtSplit[0]
-        self.frame = int(evtSplit[1])
-        self.json = evtSplit[2]
-        return self
-
-class NetworkProgressMessage(object):
-    def __init__(self):
-        self.status = "p"
-        self.frame = 0
-    def isValid(self,msg):
-        return (len(msg)>1 and msg[0] == "p" and msg.count("_")==1)
-    def toString(self):
-        return self.status+"_"+str(self.frame)
-    def fromString(self,msg):
-        evtSplit = msg.split("_")
-        self.status = evtSplit[0]
-        self.frame = int(evtSplit[1])
-        return self
-        
 class NetworkBufferEntry(object):
     def __init__(self):
         self.eventList = []
@@ -102,11 +69,16 @@ class Network(object):
         if(self.connect_mode == self.SOCKET_MODE_UDP):
             self.conn.sendto(msg, target)
         if(self.connect_mode == self.SOCKET_MODE_TCP):
-            if len(msg)<self.MESSAGE_SIZE:#fixed-width messages, could be made better by proper buffering 
-                msg='{message: <{fill}}'.format(message=msg, fill=self.MESSAGE_SIZE)
-            else:
-                print("message too long: "+str(len(msg)))
-            self.conn.sendall(msg)
+            #length-prefixed, and held until the next flush so everything from a frame goes out in one write
+            self.write_buffer.append(frameMessage(msg))
+    
+    """
+    Write everything sent over TCP since the last flush. Called at the end of processEvents and processFighters.
+    """
+    def flush(self):
+        if(self.connect_mode == self.SOCKET_MODE_TCP and self.write_buffer):
+            self.conn.sendall(b''.join(self.write_buffer))
+            self.write_buffer = []
         
     #TODO: replace hard-coded ports/addresses/buffer/etc with configurable ones
     def __init__(self):
@@ -114,7 +86,6 @@ class Network(object):
         #set to false to disable all networking and just run locally
         self.enabled = self.settings['networkEnabled']
         if(self.enabled):     
-            self.MESSAGE_SIZE = 96
             self.SOCKET_MODE_UDP = "udp"
             self.SOCKET_MODE_TCP = "tcp"
             
@@ -132,24 +103,87 @@ class Network(object):
                 self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self.conn.connect((self.serveraddr,self.serverport))
                 self.conn.setblocking(0)
+            #TCP messages waiting to be written, and what's been read that isn't a whole message yet
+            self.write_buffer = []
+            self.read_buffer = MessageBuffer()
             
             self.read_list = [self.conn]
             self.write_list = []
             
-            self.send("c", (self.serveraddr, self.serverport))
+            #spectators watch a match without playing in it
+            self.spectating = self.settings['networkSpectate']
+            self.next_join = 0
+            self.sendJoin()
+            self.flush()
             #count each frame with an id so that it can be identified when sent over the wire
             self.tick_count = 0
-            self.buffer_size = self.settings['networkBufferSize']#number of frames of latency to introduce locally (should be greater than the network latency)
-            self.max_frame = self.buffer_size
-            self.buffer = [NetworkBufferEntry() for x in range(self.buffer_size)]
-            for x in self.buffer:
-                x.receivedFrom['local']=[]
-            self.fighter_buffer = [[] for x in range(self.buffer_size)]
+            self.buffer_size = self.settings['networkBufferSize']#number of frames of latency to start with, until the connection has been measured
+            #frames of delay on local input, agreed with the other player and changed as the connection changes
+            self.input_delay = max(MIN_INPUT_DELAY,min(MAX_INPUT_DELAY,self.buffer_size))
+            #new input delays, by the frame they start at
+            self.delay_changes = {}
+            #the delay before the last change, and the frame the change happened on
+            self.previous_delay = self.input_delay
+            self.delay_changed_at = 0
+            self.max_frame = self.input_delay
+            #input for each frame that hasn't been played yet, by frame
+            self.buffer = {}
+            #local input from frames that were skipped while waiting for the other player
+            self.held_events = []
+            #the controller this machine's input is read with, see setLocalController
+            self.local_controller = None
+            #over UDP, the input this client has sent that hasn't been acknowledged yet, as (tick, delay, codes)
+            self.unacked_inputs = []
+            #the last tick the other player has received all of this client's input up to, and the same the other
+            #way around for each player input comes from
+            self.remote_ack = -1
+            self.received_tick = {}
+            #ticks received past received_tick, when packets arrive out of order
+            self.received_ahead = {}
+            #fighter snapshots received that haven't been played up to yet
+            self.fighter_messages = []
+            self.state_sync = StateSync()
+            #a spectator who joins partway through a match waits for a full snapshot to start from
+            self.waiting_for_keyframe = False
             
             self.STATE_WAITING_FOR_OPPONENT = 0
             self.STATE_PLAYING = 1
             self.current_state = self.STATE_WAITING_FOR_OPPONENT
             self.playerno = 0
+            
+            #round trip time to the other player and how much it varies, in seconds, or None until it's measured
+            self.rtt = None
+            self.rtt_deviation = 0
+            #how many frames ahead of the other player this client is, smoothed, and how long the last message
+            #from them took to get here, in seconds
+            self.frame_advantage = 0
+            self.one_way_latency = None
+            
+            #how far the server's clock is ahead of this one's, in seconds, or None until it's been synced,
+            #from the latest (round trip, offset) samples
+            self.clock_offset = None
+            self.server_rtt = None
+            self.clock_samples = []
+            self.next_clock_sync = 0
+            
+            #the CSV file telemetry for this match is written to, once it starts
+            self.telemetry_file = None
+            
+            #how often the game has had to wait for the other player, and input that came too late to use
+            self.start_time = time.time()
+            self.stalled = False
+            self.stall_count = 0
+            self.stall_frames = 0
+            #frames the current stall has gone on for, and whether this client has given up and left
+            self.current_stall = 0
+            self.disconnected = False
+            #the latest progress message sent, to send again while stalled in case it was lost
+            self.last_progress = None
+            self.late_inputs = 0
+            #what sending every input more than once costs, and how much input it saved
+            self.input_bytes = 0
+            self.single_input_bytes = 0
+            self.recovered_inputs = 0
             #TODO: on exit implement disconnect (message status "d" to server)
             #close TCP
             
@@ -161,122 +195,539 @@ class Network(object):
     
     Since this sends inputs per frame, if games are out of sync at the frame-level, this will diverge
     
-    there is a number of frames as a buffer. Local input is pushed onto the end of the buffer
-    at that stage the frame count is recorded and sent over the wire with the count
-    when receiving inputs, insert them onto the buffer at the correct frame
-    this assumes that latency never exceeds the number of frames in the buffer
-    it also assumes the frame rate of each client is very close to being the same
+    local input is played input_delay frames after it happens. At that stage the frame it will be played on
+    is recorded and sent over the wire with the input. When receiving inputs, they're added to that frame
+    
+    the game will be laggy to local input by the input delay, but will be consistent
+    
+    each client tells the server every few frames that it's progressing to frame X, where X is as far as
+    its input has been sent. When the server has heard this from every player, it tells them they can
+    progress. If a client gets to a frame it hasn't been told it can progress to, it stalls: the frame is
+    skipped, None is returned instead of events, and the local input is held until the next frame that runs.
+    The game should keep drawing while it's stalled. A player also stalls on a frame until the other
+    player's input for it has all arrived, see isMissingInput. Over UDP, the latest input and progress are sent again
+    every stalled frame, since a lost one would otherwise hold the match up for good. A stall that goes on
+    for STALL_TIMEOUT frames means the other player has gone, so this client leaves, and isDisconnected
+    tells the battle to end.
+    
+    the input delay follows the connection. Each client pings the other to measure the round trip and how
+    much it jitters, and sends the delay it would like along with its progress messages. The server picks
+    the largest, and the same answer is sent to everyone for every change point, so both clients change
+    their delay on the same frame, by at most one frame at a time.
     
-    the game will be laggy to local input by the size of the buffer, but will be consistent
+    Frame rates drift apart, so the pings also carry the frame each client is on. A client that's ahead
+    slows down by a frame or two a second until the other catches up, with getFrameRate, instead of
+    jumping its frame count.
     
-    ideally, the clients will be in sync as they would have the same frame rate.
-    since this is unlikely in practice, each client sends to the server a request to progress to frame X
-    where X = buffer_size
-    when the server receives this from every player, it sends back an acknowldgeemnt that the client can progress
-    if the client doesn't receive this, it stalls
+    To know how long ago the other player sent a ping, each client syncs its clock with the server's,
+    the way NTP does: it sends its own time, the server answers with its time, and the offset is taken
+    from the sample with the shortest round trip, since that's the one the least can have gone wrong
+    with. Pings carry the time they were sent on the server's clock, so the frame advantage doesn't
+    have to assume the trip each way takes half the round trip.
     
-    if the latency/frame rates of the clients never differs by more than buffer_size, then the games will play smoothly
-    if one begins to get ahead by too much, the game will stutter.
+    How all of this is going is shown on the netplay overlay, and written to a CSV file for each match
+    in the netplay directory, to track down where stutters come from.
     
-    Sample code has been written to sync fighters in the case that the game diverges.
-    This needs to be updated/enabled if it's needed.
-    In theory syncing fighters would be a safety net to re-sync the state.
-    (for example, in the case keyboard packets are lost over the network)
-    In practice, this should be avoided if possible because it will cause fighters to jump around
-    and it means tracking code changes to fighters in this class (making code slightly harder to maintain).
-    Additioanlly it requires possible engine changes to allow state rollback/fast forward
+    In case the games diverge anyway, processFighters syncs a set of fighter fields from player 1,
+    corrected smoothly so fighters don't jump around. The fields are listed in engine.stateSync, which
+    has to be kept up to date with changes to fighters.
     
-    TODO: implement a translation layer between controls?
-    player 1 keybindings on computer 1 should translate to player 2 keybindings on computer 2
+    spectators get everything the players send from the server, in batches. They play each frame once
+    the server says the players have got to it, and don't send anything back. One who joins partway
+    through starts from the last full snapshot and plays the input since as fast as it can. The snapshot
+    only has what engine.stateSync restores: fighters keep the action they're in on the spectator's side
+    until their input changes it, and the battle clock isn't synced.
+    
+    input isn't sent as the keys that were pressed. Local key and pad events are read with the local
+    controller's bindings, and the buttons they press and release are what's sent, so each player can
+    play with their own controls whichever player number they are. Every player's buttons, this
+    machine's included, come back out of the buffer as REMOTE_BUTTON_EVENT events for that player's
+    RemoteController. Everything else that happens locally, like closing the window, is played back
+    locally on the same frame.
     """
     def processEvents(self,events):
         if(not self.enabled):
             return events#not turned on, nothing to do
-        #enqueue/dequeue from buffer
-        bufferObj = NetworkBufferEntry()
-        bufferObj.receivedFrom['local']=events
-        self.buffer.insert(0,bufferObj)#enqueue event onto start of queue
-        nextEventObj = self.buffer.pop()#dequeue the frame that's persisted the length of the queue
-        nextEventList = nextEventObj.getEvents()
-        
-        self.sendBuffer()
+        if(self.disconnected):
+            return None
+        self.held_events.extend(events)
         self.readFromNetwork()
+        if(time.time() >= self.next_clock_sync):
+            self.syncClock()
         
-        MAX_STALL_COUNT = 100#1 second max 
-        while(self.tick_count > self.max_frame and MAX_STALL_COUNT>=0):
-            print("Stall at frame: "+str(self.tick_count)+" max: "+str(self.max_frame))
-            MAX_STALL_COUNT-=1
-            self.readFromNetwork()
-            time.sleep(0.01)#wait 1/100th of a second before checking again.
-        if(MAX_STALL_COUNT<0):
-            print("Max stalls exceeded.")
-            #TODO: lost connectivity? exit battle?
-            
-        if(self.current_state == self.STATE_WAITING_FOR_OPPONENT):
+        if(self.current_state == self.STATE_WAITING_FOR_OPPONENT and self.connect_mode == self.SOCKET_MODE_UDP and
+           time.time() >= self.next_join):
+            self.sendJoin()
+        if(self.current_state == self.STATE_WAITING_FOR_OPPONENT or self.waiting_for_keyframe):
+            self.held_events = []
+            self.flush()
             return []#absorb events until players are ready
+        if(self.tick_count > self.max_frame or self.isMissingInput()):
+            #the other player hasn't caught up, or their input for this frame hasn't all arrived, skip this frame
+            if(not self.stalled):
+                self.stall_count += 1
+                self.stalled = True
+            self.stall_frames += 1
+            self.current_stall += 1
+            if(self.stall_frames % MAX_STALL_FRAMES == 0):
+                print("Stalled at frame: "+str(self.tick_count)+" max: "+str(self.max_frame))
+            if(self.current_stall >= STALL_TIMEOUT):
+                print("Gave up waiting at frame: "+str(self.tick_count))
+                self.disconnect()
+                return None
+            if(self.connect_mode == self.SOCKET_MODE_UDP and not self.spectating):
+                #keep sending, in case the other player is still missing some of this client's input, or the
+                #server is still missing this client's progress
+                self.sendInputPacket()
+                if(self.last_progress is not None):
+                    self.send(self.last_progress,(self.serveraddr, self.serverport))
+            self.flush()
+            return None
+        self.stalled = False
+        self.current_stall = 0
         #TODO: stop clock (game countdown timer) from progressing while waiting.
+        
+        if(self.spectating):
+            #spectators only watch, so their own input isn't played, apart from closing the game
+            local_events = [e for e in self.held_events if e.type == pygame.QUIT]
+        else:
+            local_events = []
+            changes = self.translateEvents(self.held_events)
+            entry = self.getBufferEntry(self.tick_count+self.input_delay)
+            entry.receivedFrom['local'].extend(self.held_events)
+            entry.receivedFrom['local'].extend([self.makeButtonEvent(self.playerno-1,button,pressed) for button,pressed in changes])
+            self.sendBuffer(changes)
+        self.held_events = []
+        
+        nextEventObj = self.buffer.pop(self.tick_count,None)
+        nextEventList = (nextEventObj.getEvents() if nextEventObj else []) + local_events
         self.tick_count += 1
+        if(self.tick_count in self.delay_changes):
+            target = self.delay_changes.pop(self.tick_count)
+            self.previous_delay = self.input_delay
+            self.delay_changed_at = self.tick_count
+            self.input_delay += max(-1,min(1,target-self.input_delay))
+        if(self.tick_count % TELEMETRY_INTERVAL == 0):
+            self.writeTelemetry()
+        self.flush()
         return nextEventList
     
-    def sendBuffer(self):
-        bufferTicks = self.tick_count+(self.buffer_size)
-        b = self.buffer[0]
-        if('local' in b.receivedFrom):
-            events = b.receivedFrom['local']
-            for e in events:
-                #TODO: make this work for devices other than keyboard
-                if e.type == pygame.locals.KEYDOWN or e.type == pygame.locals.KEYUP:
-                    #send input to others
-                    msgEvt = NetworkUpdateMessage()
-                    msgEvt.update(e.type,json.dumps(e.__dict__),bufferTicks)
-                    self.send(msgEvt.toString(), (self.serveraddr, self.serverport))
-                    #print("sent input for frame: "+str(bufferTicks)+" current frame: "+str(self.tick_count))
-        #periodically send "progressing to frame X"
-        if(self.tick_count % self.buffer_size == 0):
+    """
+    Whether some of the other player's input that lands on the current frame hasn't arrived yet. The
+    server can say a frame is ready as soon as the other player has got to it, before a lost packet of
+    their input has been made up for, and input that turns up after its frame has been played is lost.
+    Input from each tick lands delay frames later, so every tick up to the current frame minus the delay
+    has to be in. Just after the delay changes, ticks from before the change land on a different frame
+    to ones after it, so the smaller of the two delays is used until all of them have landed.
+    Spectators don't check, they can start partway through and never get the earliest input.
+    """
+    def isMissingInput(self):
+        if(self.spectating):
+            return False
+        delay = self.input_delay
+        if(self.tick_count < self.delay_changed_at + MAX_INPUT_DELAY):
+            delay = min(delay,self.previous_delay)
+        return self.received_tick.get(self.serveraddr,-1) < self.tick_count - delay
+    
+    """
+    Ask the server to join a match, or to watch one. Over UDP this is sent again every JOIN_INTERVAL
+    until the match starts, and the server answers a player who's already in a started match with
+    the start message again.
+    """
+    def sendJoin(self):
+        self.send("w" if self.spectating else "c",(self.serveraddr, self.serverport))
+        self.next_join = time.time() + JOIN_INTERVAL
+    
+    def getBufferEntry(self,frame):
+        if(frame not in self.buffer):
+            self.buffer[frame] = NetworkBufferEntry()
+            self.buffer[frame].receivedFrom['local'] = []
+        return self.buffer[frame]
+    
+    """
+    Set the controller that local input is read with. Its bindings decide which buttons each key or pad
+    event presses, but it isn't given the input itself, the player's RemoteController is.
+    """
+    def setLocalController(self,localController):
+        self.local_controller = localController
+    
+    """
+    The buttons that local events press and release, in order, as (button, pressed).
+    """
+    def translateEvents(self,events):
+        changes = []
+        if(self.local_controller is None):
+            return changes
+        held = self.local_controller.keys_held
+        for e in events:
+            before = list(held)
+            self.local_controller.getInputs(e,False)
+            changes.extend([(button,True) for button in held if button not in before and button in BUTTONS])
+            changes.extend([(button,False) for button in before if button not in held and button in BUTTONS])
+        return changes
+    
+    def sendBuffer(self,changes):
+        bufferTicks = self.tick_count+self.input_delay
+        codes = [self.encodeButton(button,pressed) for button,pressed in changes]
+        self.unacked_inputs.append((self.tick_count,self.input_delay,codes))
+        if(self.connect_mode == self.SOCKET_MODE_TCP):
+            #TCP doesn't lose anything, so only the newest frame needs sending
+            self.unacked_inputs = self.unacked_inputs[-1:]
+        self.sendInputPacket()
+        #periodically send "progressing to frame X", along with the delay this client would like
+        if(self.tick_count % PROGRESS_INTERVAL == 0):
             msgProgress = NetworkProgressMessage()
-            msgProgress.frame = self.tick_count + self.buffer_size
-            self.send(msgProgress.toString(),(self.serveraddr, self.serverport))
+            msgProgress.frame = bufferTicks
+            msgProgress.delay = self.getDesiredDelay()
+            self.last_progress = msgProgress.toString()
+            self.send(self.last_progress,(self.serveraddr, self.serverport))
+        if(self.tick_count % PING_INTERVAL == 0):
+            msgPing = NetworkPingMessage()
+            msgPing.time = int(time.time()*1000)
+            msgPing.tick = self.tick_count
+            msgPing.sent = self.getServerTime()
+            self.send(msgPing.toString(),(self.serveraddr, self.serverport))
+    
+    """
+    Send the newest frames of input the other player hasn't acknowledged, and acknowledge theirs.
+    """
+    def sendInputPacket(self):
+        msgInput = NetworkInputMessage()
+        msgInput.player = self.playerno
+        msgInput.ack = self.received_tick.get(self.serveraddr,-1)
+        entries = self.unacked_inputs[-INPUT_REDUNDANCY:]
+        if(entries):
+            msgInput.first = entries[0][0]
+            msgInput.entries = [(delay,codes) for tick,delay,codes in entries]
+        msg = msgInput.toString()
+        self.send(msg,(self.serveraddr, self.serverport))
+        self.input_bytes += len(msg)
+        #what the packet would have been with only the newest frame in it
+        if(entries):
+            msgInput.first = entries[-1][0]
+            msgInput.entries = msgInput.entries[-1:]
+            self.single_input_bytes += len(msgInput.toString())
+        else:
+            self.single_input_bytes += len(msg)
+    
+    def handleInputPacket(self,msgInput,sender):
+        if(sender == self.serveraddr):
+            self.remote_ack = max(self.remote_ack,msgInput.ack)
+            while(self.unacked_inputs and self.unacked_inputs[0][0] <= self.remote_ack):
+                self.unacked_inputs.pop(0)
+        received_tick = self.received_tick.get(sender,-1)
+        received_ahead = self.received_ahead.setdefault(sender,set())
+        for i,(delay,codes) in enumerate(msgInput.entries):
+            tick = msgInput.first + i
+            if(tick <= received_tick or tick in received_ahead):
+                continue
+            if(i < len(msgInput.entries)-1):
+                #the packet that was meant to bring this was lost, or is still on its way
+                self.recovered_inputs += 1
+            self.addRemoteInput(tick + delay,sender,[self.decodeButton(msgInput.player-1,code) for code in codes])
+            received_ahead.add(tick)
+        while(received_tick+1 in received_ahead):
+            received_tick += 1
+            received_ahead.remove(received_tick)
+        self.received_tick[sender] = received_tick
+    
+    """
+    Put input from another player into the buffer for the frame it's played on.
+    """
+    def addRemoteInput(self,frame,sender,events):
+        if(frame >= self.tick_count):
+            entry = self.getBufferEntry(frame)
+            if(sender not in entry.receivedFrom):#initialise list
+                entry.receivedFrom[sender] = []
+            entry.receivedFrom[sender].extend(events)
+        elif(not self.spectating):
+            #Note: should never get here, it means the input took longer to arrive than the input delay
+            #spectators get input from before the frame they start on, which is already in the snapshot they start from
+            print("input for frame "+str(frame)+" arrived late at frame "+str(self.tick_count))
+            self.late_inputs += 1
+    
+    def encodeButton(self,button,pressed):
+        return ("d" if pressed else "u")+str(BUTTONS.index(button))
+    
+    def decodeButton(self,playerNum,code):
+        return self.makeButtonEvent(playerNum,BUTTONS[int(code[1:])],code[0] == "d")
+    
+    def makeButtonEvent(self,playerNum,button,pressed):
+        evt = NetworkEvt()
+        evt.type = controller.REMOTE_BUTTON_EVENT
+        evt.player = playerNum
+        evt.button = button
+        evt.pressed = pressed
+        return evt
+    
+    """
+    The input delay that would cover the trip to the other player, even when it jitters.
+    """
+    def getDesiredDelay(self):
+        if(self.rtt is None):
+            return self.input_delay
+        one_way = self.rtt/2.0 + 2*self.rtt_deviation
+        frames = int(math.ceil(one_way*FRAME_RATE)) + DELAY_MARGIN
+        return max(MIN_INPUT_DELAY,min(MAX_INPUT_DELAY,frames))
+    
+    """
+    The frame rate to run at, given the one the game wants. Nudged up or down to keep in step with
+    the other player.
+    """
+    def getFrameRate(self,frameRate):
+        if(not self.enabled or self.current_state != self.STATE_PLAYING or abs(self.frame_advantage) < 1):
+            return frameRate
+        correction = max(-MAX_DRIFT_CORRECTION,min(MAX_DRIFT_CORRECTION,self.frame_advantage/2.0))
+        return int(round(frameRate - correction))
+    
+    """
+    A short description of the connection and a color for it, green, yellow or red, for the battle to show.
+    """
+    def getConnectionQuality(self):
+        if(self.disconnected):
+            return ("Disconnected",[255,0,0])
+        if(self.spectating):
+            if(self.current_state == self.STATE_WAITING_FOR_OPPONENT or self.waiting_for_keyframe):
+                return ("Waiting for match",[255,255,0])
+            if(self.isCatchingUp()):
+                return ("Catching up",[255,255,0])
+            if(self.stalled):
+                return ("Spectating",[255,0,0])
+            return ("Spectating",[0,255,0])
+        if(self.current_state == self.STATE_WAITING_FOR_OPPONENT):
+            return ("Waiting for opponent",[255,255,0])
+        if(self.stalled):
+            return ("Waiting for opponent",[255,0,0])
+        if(self.rtt is None):
+            return ("Delay "+str(self.input_delay),[255,255,0])
+        text = "Ping "+str(int(self.rtt*1000))+"ms Delay "+str(self.input_delay)
+        if(self.input_delay <= 4):
+            return (text,[0,255,0])
+        if(self.input_delay <= 8):
+            return (text,[255,255,0])
+        return (text,[255,0,0])
+    
+    """
+    Whether this client has left the match, because the other player stopped answering or the connection
+    to the server was lost. The battle should end.
+    """
+    def isDisconnected(self):
+        return self.enabled and self.disconnected
+    
+    """
+    Leave the match, telling the server so the room is cleaned up, and close the connection.
+    """
+    def disconnect(self):
+        if(self.disconnected):
+            return
+        self.send("d",(self.serveraddr, self.serverport))
+        self.flush()
+        self.conn.close()
+        self.read_list = []
+        self.disconnected = True
+    
+    """
+    Whether this is a spectator that's fallen behind the match. The battle plays frames without drawing
+    them until it's caught up.
+    """
+    def isCatchingUp(self):
+        if(not self.enabled or not self.spectating or self.current_state != self.STATE_PLAYING):
+            return False
+        return self.max_frame - self.tick_count > CATCH_UP_FRAMES
+    
+    def measurePing(self,msgPing):
+        sample = max(0,time.time() - msgPing.time/1000.0)
+        if(self.rtt is None):
+            self.rtt = sample
+            self.rtt_deviation = sample/2.0
+        else:
+            self.rtt_deviation += RTT_SMOOTHING*2*(abs(sample-self.rtt) - self.rtt_deviation)
+            self.rtt += RTT_SMOOTHING*(sample-self.rtt)
+        self.measureAdvantage(msgPing.tick,msgPing.sent)
+    
+    """
+    Compare this client's frame with the other player's. If both clocks are synced with the server,
+    it's known when they sent it, otherwise it's taken to be half a round trip ago.
+    """
+    def measureAdvantage(self,remoteTick,remoteSent=None):
+        if(remoteSent is not None and self.clock_offset is not None):
+            self.one_way_latency = max(0,(self.getServerTime() - remoteSent)/1000.0)
+        elif(self.rtt is not None):
+            self.one_way_latency = self.rtt/2.0
+        else:
+            return
+        remote_now = remoteTick + self.one_way_latency*FRAME_RATE
+        self.frame_advantage += ADVANTAGE_SMOOTHING*((self.tick_count - remote_now) - self.frame_advantage)
+    
+    def syncClock(self):
+        msgClock = NetworkClockMessage()
+        msgClock.time = int(time.time()*1000)
+        self.send(msgClock.toString(),(self.serveraddr, self.serverport))
+        if(len(self.clock_samples) < CLOCK_SAMPLES):
+            self.next_clock_sync = time.time() + CLOCK_SYNC_STARTUP_INTERVAL
+        else:
+            self.next_clock_sync = time.time() + CLOCK_SYNC_INTERVAL
+    
+    def measureClock(self,msgClock):
+        now = time.time()
+        sent = msgClock.time/1000.0
+        round_trip = max(0,now - sent)
+        #the server's time is taken to be from halfway through the round trip
+        offset = msgClock.server_time/1000.0 - (sent + now)/2.0
+        self.clock_samples.append((round_trip,offset))
+        self.clock_samples = self.clock_samples[-CLOCK_SAMPLES:]
+        self.server_rtt,self.clock_offset = min(self.clock_samples)
+    
+    """
+    The time on the server's clock, in milliseconds, or None if it hasn't been synced yet.
+    """
+    def getServerTime(self):
+        if(self.clock_offset is None):
+            return None
+        return int((time.time() + self.clock_offset)*1000)
     
-    def handleMessage(self, msg):
-        msgEvt = NetworkUpdateMessage()
+    """
+    How the connection is doing right now, as (name, value) pairs, for the overlay and the CSV file.
+    Times are in milliseconds.
+    """
+    def getTelemetry(self):
+        def toMilliseconds(seconds):
+            return round(seconds*1000,1) if seconds is not None else ''
+        return [('time',round(time.time() - self.start_time,2)),
+                ('frame',self.tick_count),
+                ('max frame',self.max_frame),
+                ('input delay',self.input_delay),
+                ('rtt',toMilliseconds(self.rtt)),
+                ('jitter',toMilliseconds(self.rtt_deviation if self.rtt is not None else None)),
+                ('one way',toMilliseconds(self.one_way_latency)),
+                ('clock offset',toMilliseconds(self.clock_offset)),
+                ('server rtt',toMilliseconds(self.server_rtt)),
+                ('frame advantage',round(self.frame_advantage,2)),
+                ('frame rate',self.getFrameRate(FRAME_RATE)),
+                ('stalls',self.stall_count),
+                ('stalled frames',self.stall_frames),
+                ('late inputs',self.late_inputs)]
+    
+    """
+    The telemetry as a few short lines of text, for the netplay overlay.
+    """
+    def getOverlayLines(self):
+        telemetry = dict(self.getTelemetry())
+        return ['Frame '+str(telemetry['frame'])+' of '+str(telemetry['max frame'])+', delay '+str(telemetry['input delay']),
+                'RTT '+str(telemetry['rtt'])+'ms, jitter '+str(telemetry['jitter'])+'ms, one way '+str(telemetry['one way'])+'ms',
+                'Advantage '+str(telemetry['frame advantage'])+' frames at '+str(telemetry['frame rate'])+'fps',
+                'Clock offset '+str(telemetry['clock offset'])+'ms, server RTT '+str(telemetry['server rtt'])+'ms',
+                'Stalls '+str(telemetry['stalls'])+' ('+str(telemetry['stalled frames'])+' frames), late inputs '+str(telemetry['late inputs'])]
+    
+    def openTelemetry(self):
+        directory = settingsManager.createPath(TELEMETRY_DIRECTORY)
+        try:
+            if(not os.path.isdir(directory)):
+                os.makedirs(directory)
+            name = time.strftime('%Y-%m-%d %H-%M-%S')+' player '+str(self.playerno)+'.csv'
+            self.telemetry_file = open(os.path.join(directory,name),'w')
+            self.telemetry_file.write(','.join([key for key,_ in self.getTelemetry()])+'\n')
+        except (IOError,OSError) as e:
+            print("couldn't open telemetry file: "+str(e))
+            self.telemetry_file = None
+    
+    def writeTelemetry(self):
+        if(self.telemetry_file is not None):
+            self.telemetry_file.write(','.join([str(value) for _,value in self.getTelemetry()])+'\n')
+    
+    """
+    Finish the match's telemetry file. Called when the battle ends.
+    """
+    def closeTelemetry(self):
+        if(self.enabled and self.telemetry_file is not None):
+            self.writeTelemetry()
+            self.telemetry_file.close()
+            self.telemetry_file = None
+    
+    """
+    Handle a message from the server. sender is who sent it, the server itself for a player, or the
+    player it came from for a spectator.
+    """
+    def handleMessage(self, msg, sender=None):
+        if(sender is None):
+            sender = self.serveraddr
+        if(msg.startswith("b\n")):
+            #a batch of messages for a spectator, each one tagged with the player who sent it
+            for line in msg.split("\n")[1:]:
+                playerno,_,inner = line.partition(":")
+                self.handleMessage(inner,"player"+playerno)
+            return
         msgTick = NetworkTickMessage()
         msgFighter = NetworkFighterMessage()
+        msgSnapshotAck = NetworkSnapshotAckMessage()
         msgProgress = NetworkProgressMessage()
-        if(msgEvt.isValid(msg)):
-            fromString = msgEvt.fromString(msg)
-            receivedTime = msgEvt.frame
-            #print("received input for frame: "+str(msgEvt.frame)+" current frame: "+str(self.tick_count))
-            frameDiff = self.buffer_size - (receivedTime - self.tick_count)
-            if(frameDiff<self.buffer_size and frameDiff>=0):
-                if(self.serveraddr not in self.buffer[frameDiff].receivedFrom):#initialise list
-                    self.buffer[frameDiff].receivedFrom[self.serveraddr] = []
-                if(not msgEvt.isBlank()):
-                    self.buffer[frameDiff].receivedFrom[self.serveraddr].append(fromString)#new entry, insert into buffer
-            else:
-                print("frame outside range"+str(msgEvt.frame))
-                if msgEvt.frame>=self.buffer_size:
-                    #Note: should never get here, it means frame rates are out of sync by a lot
-                    #but if we have hit this, try and re-sync frame count
-                    print(str(self.tick_count)+" adjusted to: "+str(msgEvt.frame-self.buffer_size+1))
-                    self.tick_count = msgEvt.frame-self.buffer_size+1
+        msgPing = NetworkPingMessage()
+        msgInput = NetworkInputMessage()
+        msgClock = NetworkClockMessage()
+        if(msgClock.isValid(msg)):
+            msgClock.fromString(msg)
+            if(msgClock.server_time is not None):
+                self.measureClock(msgClock)
+        if(msgInput.isValid(msg)):
+            self.handleInputPacket(msgInput.fromString(msg),sender)
         if(msgTick.isValid(msg)):
             msgTick.fromString(msg)
             self.tick_count = msgTick.tick
+            self.max_frame = max(self.max_frame,self.tick_count)
             self.playerno = json.loads(msgTick.json)['playerno']
+            #the match is already going, so start from the snapshot that comes next
+            self.waiting_for_keyframe = self.spectating and self.tick_count > 0
+            if(self.telemetry_file is None):
+                self.openTelemetry()
             if(self.current_state == self.STATE_WAITING_FOR_OPPONENT):
                 self.current_state = self.STATE_PLAYING
             print("starting")
         if(msgFighter.isValid(msg)):
-            fromString = msgFighter.fromString(msg)
-            receivedTime = msgFighter.frame
-            frameDiff = receivedTime - self.tick_count
-            if(frameDiff-1<self.buffer_size and frameDiff-1>-1):
-                self.fighter_buffer[frameDiff-1].append(fromString)#insert into buffer
+            self.fighter_messages.append(msgFighter.fromString(msg))
+        if(msgSnapshotAck.isValid(msg) and not self.spectating):
+            self.state_sync.acknowledge(msgSnapshotAck.fromString(msg).frame)
         if(msgProgress.isValid(msg)):
-            fromString = msgProgress.fromString(msg)
-            self.max_frame = fromString.frame
-            
+            msgProgress.fromString(msg)
+            self.max_frame = max(self.max_frame,msgProgress.frame)
+            if(msgProgress.delay is not None):
+                change_frame = getDelayChangeFrame(msgProgress.frame)
+                if(change_frame > self.tick_count):
+                    self.delay_changes[change_frame] = msgProgress.delay
+        if(msgPing.isValid(msg) and not self.spectating):
+            msgPing.fromString(msg)
+            if(msgPing.status == "i"):
+                #send it straight back, with this client's frame for the other to compare against
+                self.measureAdvantage(msgPing.tick,msgPing.sent)
+                msgPing.status = "o"
+                msgPing.tick = self.tick_count
+                msgPing.sent = self.getServerTime()
+                self.send(msgPing.toString(),(self.serveraddr, self.serverport))
+            else:
+                self.measurePing(msgPing)
+    
+    """
+    How the connection has held up so far, to compare runs under different network conditions.
+    """
+    def getStats(self):
+        if(not self.enabled):
+            return None
+        minutes = max(time.time() - self.start_time,1) / 60.0
+        return {'stalls': self.stall_count,
+                'stalls per minute': round(self.stall_count / minutes,2),
+                'stalled frames': self.stall_frames,
+                'late inputs': self.late_inputs,
+                'input delay': self.input_delay,
+                'rtt': self.rtt,
+                'input bytes per second': round(self.input_bytes / (minutes*60),1),
+                'redundancy overhead %': round(100.0*(self.input_bytes-self.single_input_bytes)/max(self.single_input_bytes,1),1),
+                'inputs recovered': self.recovered_inputs,
+                'snapshot bytes per second': round(self.state_sync.bytes_sent / (minutes*60),1),
+                'desyncs': self.state_sync.desyncs,
+                'corrected fields': self.state_sync.corrected_fields}
+    
     def readFromNetwork(self):
+        if(not self.read_list):
+            return#the connection's closed
         repeat = True
         while(repeat):
             repeat = False
@@ -286,86 +737,82 @@ class Network(object):
             if self.connect_mode == self.SOCKET_MODE_UDP:
                 for f in readable:
                   if f is self.conn:
-                    msg,addr = f.recvfrom(self.MESSAGE_SIZE)
+                    msg,addr = f.recvfrom(UDP_PACKET_SIZE)
                     repeat = True#may be more than 1 message waiting to be read, catch up by looping until select returns nothing
                     self.handleMessage(msg)
             if self.connect_mode == self.SOCKET_MODE_TCP:
                 for f in readable:
                     if f is self.conn:
-                        msg,addr = f.recvfrom(self.MESSAGE_SIZE)              
-                        msg = msg.strip()
+                        if(not self.read_buffer.readFrom(f)):
+                            print("lost connection to the server")
+                            self.read_list.remove(f)
+                            self.disconnected = True
+                            break
                         repeat = True
-                        self.handleMessage(msg)
+                        for msg in self.read_buffer.getMessages():
+                            self.handleMessage(msg)
                         
+    """
+    Jump forward to a later frame, for a spectator starting from a keyframe after the one it was sent
+    when it joined. Input and delay changes for the frames in between are thrown away, the keyframe
+    already has what they did.
+    """
+    def skipTo(self,frame):
+        if(frame <= self.tick_count):
+            return
+        for skipped in [buffered for buffered in self.buffer if buffered < frame]:
+            del self.buffer[skipped]
+        for change_frame in sorted([change for change in self.delay_changes if change <= frame]):
+            target = self.delay_changes.pop(change_frame)
+            self.input_delay += max(-1,min(1,target-self.input_delay))
+        self.tick_count = frame
+    
+    """
+    Keep the fighters in sync, as a safety net for when the input alone hasn't. Both clients keep a
+    snapshot of every frame, player 1 sends its snapshot every SNAPSHOT_INTERVAL frames, and everyone
+    else corrects their fighters by however much they differ from it. See engine.stateSync.
+    Every KEYFRAME_INTERVAL frames the snapshot is a full one, so spectators can start from it.
+    This should be called every frame after the fighters have been updated.
+    """
     def processFighters(self,fighters):
         if(not self.enabled or
-           not self.current_state == self.STATE_PLAYING or 
-           not self.tick_count%100 == 0):
+           not self.current_state == self.STATE_PLAYING):
             return None
-        return None #TODO: enable by removing this statement.
-        #NOTE: before this can be enabled, some work needs to be done on the frame counts
-        #unlike the keyboard which can be predicted due to a local latency buffer
-        #the fighter's position is only known at the current frame,
-        #therefore by the time the opponent gets it the data is obsolete.
-        #in theory the best way of handling this would be to roll state forward/back
-        #the engine currently cannot do this
+        fighters = sorted(fighters,key=lambda fighter: fighter.player_num)
+        if(self.waiting_for_keyframe):
+            #only a full snapshot can be started from, the first one from this frame on. Over UDP the one
+            #sent when the spectator joined may have been lost, so a later one is fine too
+            keyframes = [fighter_message for fighter_message in self.fighter_messages
+                         if fighter_message.base_frame == -1 and fighter_message.frame >= self.tick_count]
+            keyframe = min(keyframes,key=lambda fighter_message: fighter_message.frame) if keyframes else None
+            if(keyframe is not None and self.state_sync.restore(keyframe.frame,keyframe.data,fighters)):
+                self.skipTo(keyframe.frame)
+                self.waiting_for_keyframe = False
+                self.fighter_messages = [fighter_message for fighter_message in self.fighter_messages
+                                         if fighter_message.frame > keyframe.frame]
+            else:
+                #nothing else is any use until then, so it isn't kept
+                self.fighter_messages = keyframes
+                return None
+        self.state_sync.update()
+        self.state_sync.record(self.tick_count,fighters)
         
-        #need to confirm minimal set params are that can capture fighter state
-        #e.g. x,y, speed?, angle?, state?, gravity? friction?
-        self.fighter_buffer.insert(0,[])#enqueue empty list to keep buffer the same size
-        nextFighterList = self.fighter_buffer.pop()#dequeue the frame that's persisted the length of the queue
         if self.playerno == 1:#player 1 is authorotive - it will send, rest will receive
-            for f in fighters:
+            if(self.tick_count % SNAPSHOT_INTERVAL == 0):
+                base_frame,data = self.state_sync.encode(self.tick_count,self.tick_count % KEYFRAME_INTERVAL == 0)
                 msg = NetworkFighterMessage()
-                msg.setFighter(self.tick_count,{
-                    'rectX':f.rect.top,
-                    'rectY':f.rect.left
-                })
-                """
-                    #'grounded' : f.grounded,
-                    #'back_walled' : f.back_walled,
-                    #'front_walled' : f.front_walled,
-                    #'ceilinged' : f.ceilinged,
-                    #'damage' : f.damage,
-                    #'landing_lag' : f.landing_lag,
-                    #'platform_phase' : f.platform_phase,
-                    #'tech_window' : f.tech_window,
-                    #'change_x' : f.change_x,
-                    #'change_y' : f.change_y,
-                    #'preferred_xspeed' : f.preferred_xspeed,
-                    #'preferred_yspeed' : f.preferred_yspeed,
-                    #'facing' : f.facing,
-                    #'no_flinch_hits' : f.no_flinch_hits,
-                    #'flinch_damage_threshold' : f.flinch_damage_threshold,
-                    #'flinch_knockback_threshold' : f.flinch_knockback_threshold,
-                    #'armor_damage_multiplier' : f.armor_damage_multiplier,
-                    #'invulnerable' : f.invulnerable,
-                    #'respawn_invulnerable' : f.respawn_invulnerable,
-                    #'shield' : f.shield,
-                    #'shield_integrity' : f.shield_integrity,
-                    #'hitstop' : f.hitstop,
-                    #'hitstop_vibration' : f.hitstop_vibration,
-                    #'hitstop_pos' : f.hitstop_pos,
-                    #'ledge_lock' : f.ledge_lock
-                    #jumps = var['jumps']#??
-                    #airdodges = 1#??
-                    
-                    #grabbing = None#??
-                    #grabbed_by = None#??
-                    #hit_tagged = None#??"""
-                self.send(msg.toString(), (self.serveraddr, self.serverport))
-        for fighter_message in nextFighterList:
-            fighter_data = json.loads(fighter_message.json).items()
-            print("updating fighter"+str(fighter_data.frame)+" "+str(self.tick_count))
-            for f in fighters:
-                for attr,val in fighter_data:
-                    if(attr == "rectX"):
-                        print("prev x was: "+str(f.rect.top)+" new: "+str(val))
-                        f.rect.x = val
-                        continue
-                    if(attr == "rectY"):
-                        print("prev y was: "+str(f.rect.left)+" new: "+str(val))
-                        f.rect.x = val
-                        continue
-                    setattr(f,attr,val)#currently completely broken
-                    
\ No newline at end of file
+                msg.setSnapshot(self.tick_count,base_frame,data)
+                self.send(msg.toString(),(self.serveraddr, self.serverport))
+        else:
+            #snapshots from frames this client hasn't got to yet are kept until it has
+            waiting = []
+            for fighter_message in self.fighter_messages:
+                if(fighter_message.frame > self.tick_count):
+                    waiting.append(fighter_message)
+                elif(self.state_sync.receive(fighter_message.frame,fighter_message.base_frame,fighter_message.data,fighters)
+                     and not self.spectating):
+                    msgAck = NetworkSnapshotAckMessage()
+                    msgAck.frame = fighter_message.frame
+                    self.send(msgAck.toString(),(self.serveraddr, self.serverport))
+            self.fighter_messages = waiting
+        self.flush()
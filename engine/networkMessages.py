@@ -0,0 +1,241 @@
+import base64
+import struct
+
+#the messages clients and the server send each other. These don't need pygame, so tools that
+#speak the protocol without running the game, like the load tester, can use them too
+
+#the input delay can only change on frames that are a multiple of this
+DELAY_CHANGE_INTERVAL = 60
+
+"""
+The frame that a delay sent with a progress message to frame X starts on. Every progress message
+before it carries the same delay, so a client only has to get one of them.
+"""
+def getDelayChangeFrame(_frame):
+    return (_frame // DELAY_CHANGE_INTERVAL + 1) * DELAY_CHANGE_INTERVAL
+
+#over TCP, every message goes with its length in front of it, so the other end can split the stream
+#back up however it arrives
+LENGTH_PREFIX = struct.Struct('>H')
+MAX_MESSAGE_SIZE = 65535
+
+def frameMessage(_msg):
+    if len(_msg) > MAX_MESSAGE_SIZE:
+        raise ValueError("message too long: "+str(len(_msg)))
+    return LENGTH_PREFIX.pack(len(_msg)) + _msg
+
+"""
+Splits a TCP stream back up into the messages that were sent. The socket is read straight into one
+buffer that's kept for the whole connection, and messages are sliced out of it with a memoryview, so
+nothing is copied until a whole message is there.
+"""
+class MessageBuffer(object):
+    def __init__(self,_size=4096):
+        self.buffer = bytearray(_size)
+        self.length = 0
+    
+    """
+    Read whatever's waiting on the socket. Returns False if the other end has closed it.
+    """
+    def readFrom(self,_sock):
+        if self.length == len(self.buffer):
+            #a message bigger than the buffer, so make room for it
+            self.buffer.extend(bytearray(len(self.buffer)))
+        view = memoryview(self.buffer)
+        count = _sock.recv_into(view[self.length:])
+        del view
+        self.length += count
+        return count > 0
+    
+    """
+    Take out every whole message that's been read so far.
+    """
+    def getMessages(self):
+        messages = []
+        view = memoryview(self.buffer)
+        offset = 0
+        while self.length - offset >= LENGTH_PREFIX.size:
+            size = LENGTH_PREFIX.unpack_from(self.buffer,offset)[0]
+            end = offset + LENGTH_PREFIX.size + size
+            if end > self.length:
+                break
+            messages.append(view[offset+LENGTH_PREFIX.size:end].tobytes())
+            offset = end
+        del view
+        if offset > 0:
+            #move the start of the next message to the front
+            self.buffer[:self.length-offset] = self.buffer[offset:self.length]
+            self.length -= offset
+        return messages
+
+class NetworkEvt(object):
+    pass#empty, the attributes of the event it stands in for are set on it
+
+class NetworkTickMessage(object):
+    def __init__(self):
+        self.status = "t"
+        self.json = ""
+        self.tick = 0
+    def isValid(self,msg):
+        return (len(msg)>1 and msg[0] == "t" and msg.count("_")==2)
+    def fromString(self,msg):
+        evtSplit = msg.split("_")
+        self.status = evtSplit[0]
+        self.tick = int(evtSplit[1])
+        self.json = evtSplit[2]
+        return self
+
+class NetworkFighterMessage(object):
+    #a packed snapshot of the fighters from engine.stateSync, made against the snapshot from base_frame,
+    #or a full one if base_frame is -1. The data is base64 so it survives being sent as text
+    def __init__(self):
+        self.status = "f"
+        self.frame = 0
+        self.base_frame = -1
+        self.data = b""
+    def setSnapshot(self,_frame,_baseFrame,_data):
+        self.frame = _frame
+        self.base_frame = _baseFrame
+        self.data = _data
+    def isValid(self,msg):
+        return (len(msg)>1 and msg[0] == "f" and msg.count("|")==3)
+    def toString(self):
+        return self.status+"|"+str(self.frame)+"|"+str(self.base_frame)+"|"+base64.b64encode(self.data).decode('ascii')
+    def fromString(self,msg):
+        evtSplit = msg.split("|")
+        self.status = evtSplit[0]
+        self.frame = int(evtSplit[1])
+        self.base_frame = int(evtSplit[2])
+        self.data = base64.b64decode(evtSplit[3])
+        return self
+
+class NetworkSnapshotAckMessage(object):
+    #sent back for each fighter snapshot that was taken in, so the next can be made against it
+    def __init__(self):
+        self.status = "k"
+        self.frame = 0
+    def isValid(self,msg):
+        return (len(msg)>1 and msg[0] == "k" and msg.count("_")==1)
+    def toString(self):
+        return self.status+"_"+str(self.frame)
+    def fromString(self,msg):
+        evtSplit = msg.split("_")
+        self.status = evtSplit[0]
+        self.frame = int(evtSplit[1])
+        return self
+
+class NetworkProgressMessage(object):
+    def __init__(self):
+        self.status = "p"
+        self.frame = 0
+        #from a client, the input delay it would like. From the server, the delay everyone agreed on
+        self.delay = None
+    def isValid(self,msg):
+        return (len(msg)>1 and msg[0] == "p" and msg.count("_") in [1,2])
+    def toString(self):
+        if self.delay is None:
+            return self.status+"_"+str(self.frame)
+        return self.status+"_"+str(self.frame)+"_"+str(self.delay)
+    def fromString(self,msg):
+        evtSplit = msg.split("_")
+        self.status = evtSplit[0]
+        self.frame = int(evtSplit[1])
+        self.delay = int(evtSplit[2]) if len(evtSplit) > 2 else None
+        return self
+
+#the buttons players press, by the names they're bound to. Input goes over the network as these,
+#not as the keys that were pressed, so it doesn't matter how each machine has its controls set up
+BUTTONS = ['left','right','up','down','attack','special','jump','shield']
+
+class NetworkInputMessage(object):
+    #over UDP, every frame's input is sent again in each packet until the other player acknowledges it,
+    #so a lost packet is covered by the next one. The frames are numbered by the tick they were sent on.
+    #Only the first tick is written and the rest count up from it, the input delay is only written when it
+    #changes, and each frame's input is a short code per button pressed ("d") or released ("u"), with the
+    #button's index in BUTTONS, so a frame with no input costs one byte
+    def __init__(self):
+        self.status = "r"
+        #the player number of the sender
+        self.player = 0
+        #the last tick the sender has received every frame of input up to
+        self.ack = -1
+        self.first = 0
+        #(input delay, [event codes]) for each tick from first on
+        self.entries = []
+    def isValid(self,msg):
+        return (len(msg)>1 and msg[0] == "r" and msg.count("_")==6)
+    def toString(self):
+        delay = self.entries[0][0] if self.entries else 0
+        parts = []
+        for entry_delay,codes in self.entries:
+            part = ",".join(codes)
+            if entry_delay != delay:
+                part = "="+str(entry_delay)+":"+part
+                delay = entry_delay
+            parts.append(part)
+        first_delay = self.entries[0][0] if self.entries else 0
+        return (self.status+"_"+str(self.player)+"_"+str(self.ack)+"_"+str(self.first)+"_"+str(len(self.entries))+
+                "_"+str(first_delay)+"_"+";".join(parts))
+    def fromString(self,msg):
+        evtSplit = msg.split("_")
+        self.status = evtSplit[0]
+        self.player = int(evtSplit[1])
+        self.ack = int(evtSplit[2])
+        self.first = int(evtSplit[3])
+        count = int(evtSplit[4])
+        delay = int(evtSplit[5])
+        self.entries = []
+        if count == 0:
+            return self
+        for part in evtSplit[6].split(";"):
+            if part.startswith("="):
+                delay_text,part = part[1:].split(":",1)
+                delay = int(delay_text)
+            self.entries.append((delay,part.split(",") if part else []))
+        return self
+
+class NetworkPingMessage(object):
+    #pings ("i") go to the other player through the server, and come back as pongs ("o")
+    #with the time the ping was sent, and the frame the other player was on when they answered.
+    #Once the sender's clock is synced with the server, each one also carries when it was sent on
+    #the server's clock, in milliseconds
+    def __init__(self):
+        self.status = "i"
+        self.time = 0
+        self.tick = 0
+        self.sent = None
+    def isValid(self,msg):
+        return (len(msg)>1 and (msg[0] == "i" or msg[0] == "o") and (msg.count("_")==2 or msg.count("_")==3))
+    def toString(self):
+        msg = self.status+"_"+str(self.time)+"_"+str(self.tick)
+        if(self.sent is not None):
+            msg += "_"+str(self.sent)
+        return msg
+    def fromString(self,msg):
+        evtSplit = msg.split("_")
+        self.status = evtSplit[0]
+        self.time = int(evtSplit[1])
+        self.tick = int(evtSplit[2])
+        self.sent = int(evtSplit[3]) if len(evtSplit) > 3 else None
+        return self
+
+class NetworkClockMessage(object):
+    #clock sync with the server. The client sends the time on its own clock ("s_T"), and the server
+    #sends it straight back with the time on the server's clock ("s_T_S"), both in milliseconds
+    def __init__(self):
+        self.status = "s"
+        self.time = 0
+        self.server_time = None
+    def isValid(self,msg):
+        return (len(msg)>1 and msg[0] == "s" and (msg.count("_")==1 or msg.count("_")==2))
+    def toString(self):
+        msg = self.status+"_"+str(self.time)
+        if(self.server_time is not None):
+            msg += "_"+str(self.server_time)
+        return msg
+    def fromString(self,msg):
+        evtSplit = msg.split("_")
+        self.status = evtSplit[0]
+        self.time = int(evtSplit[1])
+        self.server_time = int(evtSplit[2]) if len(evtSplit) > 2 else None
+        return self
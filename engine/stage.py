@@ -3,6 +3,13 @@ import pygame
 import spriteManager
 import settingsManager
 import math
+from collections import OrderedDict
+
+#The zoom has to stay the same for this many frames before a layer is drawn onto a surface at it.
+#While the camera is zooming, every frame is a new zoom, so the sprites are drawn one by one instead.
+LAYER_SETTLE_FRAMES = 10
+#How many zoom levels of each layer are kept, the one used longest ago is thrown away first
+LAYER_CACHE_SIZE = 4
 
 class Stage():
     def __init__(self):
@@ -37,6 +44,16 @@ class Stage():
         self.background_sprites = []
         self.foreground_sprites = []
         self.background_color = [100, 100, 100]
+        #Set this if anything in the background or foreground changes without the camera moving,
+        #so the battle knows it can't keep the stage drawn between frames. It's also set on its own
+        #as soon as a sprite in a cached layer is seen changing.
+        self.animated_layers = False
+        
+        #The background and foreground are drawn as StageLayers, built from the lists above
+        #the first time they're drawn. Any sprite that's seen changing gets drawn on its own.
+        self.layers = {}
+        self.animated_sprites = set()
+        self.platform_sprites = None
         
     """
     Puts the camera in the proper position.
@@ -227,27 +244,55 @@ class Stage():
     Draws the background elements in order.
     """
     def drawBG(self,_screen):
-        rects = []
-        for sprite,paralax in self.background_sprites:
-            x = sprite.rect.x - (self.camera_position.x * paralax)
-            y = sprite.rect.y - (self.camera_position.y)
-            rect = sprite.draw(_screen,(x,y),self.getScale())
-            if rect: rects.append(rect)
-        return rects
+        return self.drawLayers(_screen,'background',self.background_sprites)
             
     def drawFG(self,_screen):
         rects = []
         if settingsManager.getSetting('showPlatformLines'):
-            for plat in self.platform_list: 
-                platSprite = spriteManager.RectSprite(pygame.Rect(plat.rect.topleft,plat.rect.size))
-                rect = platSprite.draw(_screen,self.stageToScreen(platSprite.rect),self.getScale())
+            for plat,plat_sprite in self.getPlatformSprites():
+                plat_sprite.rect.topleft = plat.rect.topleft
+                rect = plat_sprite.draw(_screen,self.stageToScreen(plat_sprite.rect),self.getScale())
                 if rect: rects.append(rect)
         #for ledge in self.platform_ledges:
             #ledgeSprite = spriteObject.RectSprite(ledge.rect.topleft,ledge.rect.size,[0,0,255])
             #ledgeSprite.draw(_screen,self.stageToScreen(ledge.rect),self.getScale())
-        for sprite in self.foreground_sprites:
-            rect = sprite.draw(_screen,self.stageToScreen(sprite.rect),self.getScale())
-            if rect: rects.append(rect)
+        rects.extend(self.drawLayers(_screen,'foreground',[(sprite,1.0) for sprite in self.foreground_sprites]))
+        return rects
+    
+    def getPlatformSprites(self):
+        if self.platform_sprites is None or [plat for plat,_ in self.platform_sprites] != self.platform_list:
+            self.platform_sprites = [(plat,spriteManager.RectSprite(pygame.Rect(plat.rect.topleft,plat.rect.size))) for plat in self.platform_list]
+        return self.platform_sprites
+    
+    """
+    Get the layers for a list of (sprite, paralax) pairs, rebuilding them if the list has changed.
+    """
+    def getLayers(self,_name,_sprites):
+        if not _name in self.layers or self.layers[_name][0] != _sprites:
+            self.layers[_name] = (list(_sprites),buildLayers(_sprites,self.animated_sprites))
+        return self.layers[_name][1]
+    
+    """
+    Look for anything in a cached layer that's changed since it was drawn. Those sprites are pulled
+    out into layers of their own that aren't cached, and the stage is marked as animated.
+    Returns whether the stage has any animated layers.
+    """
+    def checkLayers(self):
+        for name,sprites in [('background',self.background_sprites),('foreground',[(sprite,1.0) for sprite in self.foreground_sprites])]:
+            changed = []
+            for layer in self.getLayers(name,sprites):
+                changed.extend(layer.getChangedSprites())
+            if changed:
+                self.animated_sprites.update(changed)
+                self.animated_layers = True
+                del self.layers[name]
+        return self.animated_layers
+    
+    def drawLayers(self,_screen,_name,_sprites):
+        self.checkLayers()
+        rects = []
+        for layer in self.getLayers(_name,_sprites):
+            rects.extend(layer.draw(_screen,self.camera_position,self.getScale()))
         return rects
     
     """
@@ -256,6 +301,182 @@ class Stage():
     """
     def addToBackground(self,_sprite,_paralaxFactor = 1.0):
         self.background_sprites.append((_sprite,_paralaxFactor))
+    
+    """
+    Adds a ScrollingSprite to the background. It's updated with the rest of the entities,
+    so it keeps scrolling on its own.
+    """
+    def addScrollingBackground(self,_sprite,_paralaxFactor = 1.0):
+        self.addToBackground(_sprite,_paralaxFactor)
+        self.entity_list.append(_sprite)
+        self.animated_layers = True
+
+"""
+Split a list of (sprite, paralax) pairs into layers. Sprites next to each other in the list
+with the same paralax factor share a layer, unless they're animated.
+"""
+def buildLayers(_sprites,_animatedSprites):
+    layers = []
+    for sprite,paralax in _sprites:
+        if isinstance(sprite,ScrollingSprite):
+            layers.append(ScrollingLayer(sprite,paralax))
+            continue
+        animated = sprite in _animatedSprites
+        if layers and layers[-1].paralax == paralax and layers[-1].animated == animated:
+            layers[-1].sprites.append(sprite)
+        else:
+            layers.append(StageLayer([sprite],paralax,animated))
+    return layers
+
+"""
+A StageLayer is a group of stage sprites that scroll together. Unless the layer is animated,
+all of its sprites are drawn once onto a single surface at each zoom level the camera settles on,
+so the whole layer is one blit. Animated layers, and any layer while the camera is zooming, draw
+each of their sprites every frame.
+"""
+class StageLayer():
+    def __init__(self,_sprites,_paralax,_animated=False):
+        self.sprites = _sprites
+        self.paralax = _paralax
+        self.animated = _animated
+        #(surface, bounds) for each zoom level, the most recently used last
+        self.cache = OrderedDict()
+        self.state = None
+        self.last_drawn_rect = None
+        #The zoom it was last drawn at, and how many frames in a row it's been drawn at it
+        self.last_scale = None
+        self.settled_frames = 0
+        
+    def getState(self):
+        return [(sprite.image,tuple(sprite.rect),sprite.angle,sprite.scale,sprite.visible) for sprite in self.sprites]
+    
+    """
+    Get every sprite that's moved or changed since the layer was drawn.
+    """
+    def getChangedSprites(self):
+        if self.animated or self.state is None:
+            return []
+        return [sprite for sprite,old,new in zip(self.sprites,self.state,self.getState()) if old != new or sprite.changed]
+    
+    """
+    Draw every sprite in the layer onto one surface, at their places on the stage. Returns the
+    surface and where it goes on a stage scaled to the given zoom.
+    """
+    def render(self,_zoom):
+        drawn = []
+        for sprite in self.sprites:
+            rect = sprite.getDrawRect(sprite.rect.topleft,_zoom)
+            if rect: drawn.append((sprite,rect))
+        self.state = self.getState()
+        if not drawn:
+            return (None,None)
+        
+        bounds = drawn[0][1].unionall([rect for _,rect in drawn[1:]])
+        surface = pygame.Surface(bounds.size,pygame.SRCALPHA,32)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha()
+        covered = []
+        for sprite,rect in drawn:
+            image = sprite.getScaledImage(_zoom)
+            rect = rect.move(-bounds.x,-bounds.y)
+            if rect.collidelist(covered) == -1:
+                #Adding onto a blank surface copies the pixels exactly, alpha and all
+                surface.blit(image,rect,special_flags=pygame.BLEND_RGBA_ADD)
+            else:
+                surface.blit(image,rect)
+            covered.append(rect)
+        for sprite in self.sprites:
+            sprite.changed = False
+        return (surface,bounds)
+    
+    def draw(self,_screen,_camera,_scale):
+        offset_x = _camera.x * self.paralax
+        offset_y = _camera.y
+        if _scale == self.last_scale:
+            self.settled_frames += 1
+        else:
+            self.last_scale = _scale
+            self.settled_frames = 0
+        if self.animated or (not _scale in self.cache and self.settled_frames < LAYER_SETTLE_FRAMES):
+            rects = []
+            for sprite in self.sprites:
+                rect = sprite.draw(_screen,(sprite.rect.x - offset_x,sprite.rect.y - offset_y),_scale)
+                if rect: rects.append(rect)
+            #Wherever the cached surface was last drawn needs drawing over too
+            if self.last_drawn_rect:
+                rects.append(self.last_drawn_rect)
+                self.last_drawn_rect = None
+            return rects
+        
+        if _scale in self.cache:
+            self.cache[_scale] = self.cache.pop(_scale)
+        else:
+            if len(self.cache) >= LAYER_CACHE_SIZE:
+                self.cache.popitem(False)
+            self.cache[_scale] = self.render(_scale)
+        surface,bounds = self.cache[_scale]
+        if surface is None:
+            return []
+        
+        rect = pygame.Rect((int(bounds.x - offset_x * _scale),int(bounds.y - offset_y * _scale)),bounds.size)
+        _screen.blit(surface,rect)
+        if rect == self.last_drawn_rect:
+            return []
+        ret_rect = rect.union(self.last_drawn_rect) if self.last_drawn_rect else rect
+        self.last_drawn_rect = rect
+        return [ret_rect]
+
+"""
+A ScrollingSprite is an image that's tiled sideways across a strip of the stage and scrolls along
+it forever, wrapping around at the end. The image itself is never touched, only the scroll offset
+moves, so it costs nothing to update.
+
+@_path - the image to tile
+@_width - how wide the strip is on the stage. Defaults to the width of the image.
+@_speed - how many pixels it scrolls to the right every frame. Negative speeds scroll left.
+"""
+class ScrollingSprite(spriteManager.ImageSprite):
+    def __init__(self,_path,_width = None,_speed = 1.0):
+        spriteManager.ImageSprite.__init__(self,_path)
+        self.width = _width or self.rect.width
+        self.speed = _speed
+        self.scroll = 0.0
+        
+    def update(self):
+        self.scroll = (self.scroll + self.speed) % self.rect.width
+
+"""
+The layer for a ScrollingSprite. The scaled tile is blitted in pieces straight to the screen,
+starting partway through the tile and wrapping back to the start of it, so a strip that's one
+tile wide is just two area blits.
+"""
+class ScrollingLayer(StageLayer):
+    def __init__(self,_sprite,_paralax):
+        StageLayer.__init__(self,[_sprite],_paralax,True)
+        self.sprite = _sprite
+        
+    def draw(self,_screen,_camera,_scale):
+        if not self.sprite.visible:
+            return []
+        zoom = _scale
+        image = self.sprite.getScaledImage(zoom)
+        self.sprite.changed = False
+        tile_width,tile_height = image.get_size()
+        if tile_width <= 0 or tile_height <= 0:
+            return []
+        
+        x = int((self.sprite.rect.x - _camera.x * self.paralax) * zoom)
+        y = int((self.sprite.rect.y - _camera.y) * zoom)
+        width = int(self.sprite.width * zoom)
+        #Scrolling right means each spot on the screen shows a part of the tile that's further left
+        source_x = int(-self.sprite.scroll * zoom) % tile_width
+        drawn = 0
+        while drawn < width:
+            piece_width = min(tile_width - source_x, width - drawn)
+            _screen.blit(image,(x + drawn,y),pygame.Rect(source_x,0,piece_width,tile_height))
+            drawn += piece_width
+            source_x = 0
+        return [pygame.Rect(x,y,width,tile_height)]
 """
 Platforms for the stage.
 Given two points (as a tuple of XY coordinates), it will
@@ -0,0 +1,258 @@
+import struct
+import zlib
+
+"""
+Fighter state sync, a safety net for when lockstep input isn't enough to keep both games the same.
+
+Every frame, each client takes a snapshot of a fixed set of fields from every fighter, its current
+action and its articles, and keeps the last few seconds of them. Every so often, player 1 sends its
+snapshot to everyone else. The other clients compare it to their own snapshot from the same frame,
+and whatever is different gets corrected in the present. Positions are moved over a few frames so
+fighters don't jump, everything else is fixed at once. The facing, grounded state and action can't
+be set from outside without breaking the fighter, so they're only compared, to count desyncs.
+
+A spectator who joins partway through a match is set straight to a full snapshot with restore. That
+covers every corrected field, stocks included, and the facing, which can be flipped. The action and
+grounded state are left as they are, so fighters start from whatever the spectator's game has them
+doing and pick up the right action from the next input that changes it. The battle clock isn't part of
+the snapshot either, it counts real time on each machine.
+
+Snapshots are packed into binary with struct. Once the other side has acknowledged a snapshot, the
+next one only sends the fields that have changed since then, with a bit for each field saying whether
+it's there. A fighter standing still costs a few bytes.
+"""
+#(attribute, struct format) for every fighter
+FIGHTER_FIELDS = [('posx','f'),('posy','f'),('change_x','f'),('change_y','f'),
+                  ('preferred_xspeed','f'),('preferred_yspeed','f'),('damage','f'),('shield_integrity','f'),
+                  ('facing','b'),('grounded','B'),('jumps','B'),('hitstop','h'),('tech_window','h'),
+                  ('landing_lag','h'),('platform_phase','h'),('invulnerable','h'),('respawn_invulnerable','h'),
+                  ('stocks','B')]
+#the current action's frame, and a checksum of what action it is
+ACTION_FIELDS = [('action_frame','H'),('action_id','I')]
+#articles are kept in a fixed number of slots, so every snapshot has the same fields
+MAX_ARTICLES = 4
+ARTICLE_FIELDS = [('posx','f'),('posy','f'),('change_x','f'),('change_y','f'),('frame','H')]
+
+#fields that are only compared, never corrected
+COMPARED_FIELDS = ['facing','grounded','action_id','article_count']
+#fields that are corrected over a few frames
+SMOOTHED_FIELDS = ['posx','posy']
+CORRECTION_FRAMES = 6
+#how far off a position can be, in pixels, before it counts as a desync
+DESYNC_DISTANCE = 8
+#frames of snapshots kept to compare against, and snapshots kept to decode deltas against
+HISTORY_SIZE = 120
+RECEIVED_SIZE = 32
+
+FIELDS_PER_FIGHTER = len(FIGHTER_FIELDS) + len(ACTION_FIELDS) + 1 + MAX_ARTICLES*len(ARTICLE_FIELDS)
+#where the article count is among each fighter's fields
+ARTICLE_COUNT_INDEX = len(FIGHTER_FIELDS) + len(ACTION_FIELDS)
+
+SNAPSHOT_FULL = 0
+SNAPSHOT_DELTA = 1
+HEADER_FORMAT = '<BB'
+
+layouts = {}
+
+"""
+Every field in a snapshot of the given number of fighters, as (fighter, article slot, attribute, format).
+The article slot is None for fields of the fighter or its action.
+"""
+def getLayout(_fighterCount):
+    if not _fighterCount in layouts:
+        layout = []
+        for fighter in range(_fighterCount):
+            for attr,fmt in FIGHTER_FIELDS + ACTION_FIELDS + [('article_count','B')]:
+                layout.append((fighter,None,attr,fmt))
+            for slot in range(MAX_ARTICLES):
+                for attr,fmt in ARTICLE_FIELDS:
+                    layout.append((fighter,slot,attr,fmt))
+        layouts[_fighterCount] = (layout,struct.Struct('<'+''.join([fmt for _,_,_,fmt in layout])))
+    return layouts[_fighterCount]
+
+def getActionId(_action):
+    name = _action.__class__.__name__ + str(getattr(_action,'name','')) + str(getattr(_action,'sprite_name',''))
+    return zlib.crc32(name.encode('utf-8')) & 0xffffffff
+
+def readField(_fighter,_slot,_attr):
+    if _slot is not None:
+        if _slot >= len(_fighter.articles):
+            return 0
+        return getattr(_fighter.articles[_slot],_attr,0)
+    if _attr == 'action_frame':
+        return _fighter.current_action.frame if _fighter.current_action else 0
+    if _attr == 'action_id':
+        return getActionId(_fighter.current_action) if _fighter.current_action else 0
+    if _attr == 'article_count':
+        return min(len(_fighter.articles),MAX_ARTICLES)
+    return getattr(_fighter,_attr,0)
+
+def convertField(_value,_fmt):
+    if _fmt == 'f':
+        return float(_value)
+    if _fmt == 'B' or _fmt == 'H' or _fmt == 'I':
+        return max(0,int(_value))
+    return int(_value)
+
+"""
+Take a snapshot of the fighters, as a tuple of every field in the layout. The values are packed and
+unpacked once, so they compare the same as what comes out of a decoded snapshot.
+"""
+def takeSnapshot(_fighters):
+    layout,packer = getLayout(len(_fighters))
+    values = [convertField(readField(_fighters[fighter],slot,attr),fmt) for fighter,slot,attr,fmt in layout]
+    return packer.unpack(packer.pack(*values))
+
+def encodeSnapshot(_values,_base):
+    count = len(_values)
+    fighter_count = count // FIELDS_PER_FIGHTER
+    layout,packer = getLayout(fighter_count)
+    if _base is None or len(_base) != count:
+        return struct.pack(HEADER_FORMAT,SNAPSHOT_FULL,fighter_count) + packer.pack(*_values)
+    mask = bytearray((count+7) // 8)
+    changed_formats = []
+    changed_values = []
+    for i in range(count):
+        if _values[i] != _base[i]:
+            mask[i // 8] |= 1 << (i % 8)
+            changed_formats.append(layout[i][3])
+            changed_values.append(_values[i])
+    return (struct.pack(HEADER_FORMAT,SNAPSHOT_DELTA,fighter_count) + bytes(mask) +
+            struct.pack('<'+''.join(changed_formats),*changed_values))
+
+"""
+Unpack a snapshot. Deltas need the snapshot they were made against, returns None if it doesn't fit.
+"""
+def decodeSnapshot(_data,_base):
+    kind,fighter_count = struct.unpack(HEADER_FORMAT,_data[:2])
+    layout,packer = getLayout(fighter_count)
+    data = _data[2:]
+    if kind == SNAPSHOT_FULL:
+        return packer.unpack(data)
+    if _base is None or len(_base) != len(layout):
+        return None
+    mask_size = (len(layout)+7) // 8
+    mask = bytearray(data[:mask_size])
+    changed = [i for i in range(len(layout)) if mask[i // 8] & (1 << (i % 8))]
+    values = list(_base)
+    changed_values = struct.unpack('<'+''.join([layout[i][3] for i in changed]),data[mask_size:])
+    for i,value in zip(changed,changed_values):
+        values[i] = value
+    return tuple(values)
+
+class StateSync(object):
+    def __init__(self):
+        #this client's own snapshots, by frame
+        self.history = {}
+        #snapshots sent that haven't been acknowledged, by frame, and the newest one that has been
+        self.sent = {}
+        self.acked_frame = -1
+        self.acked_values = None
+        #snapshots received, by frame, for deltas to be decoded against
+        self.received = {}
+        #corrections still being spread out, as [object, attribute, amount left, frames left]
+        self.corrections = []
+
+        self.snapshots_sent = 0
+        self.bytes_sent = 0
+        self.desyncs = 0
+        self.corrected_fields = 0
+
+    def record(self,_frame,_fighters):
+        self.history[_frame] = takeSnapshot(_fighters)
+        self.history.pop(_frame-HISTORY_SIZE,None)
+
+    """
+    Encode this client's snapshot of a frame against the newest one the other side has, or as a full
+    snapshot if _full is set. Returns the frame it was made against, or -1 for a full snapshot, and the data.
+    """
+    def encode(self,_frame,_full=False):
+        values = self.history[_frame]
+        base = None if _full else self.acked_values
+        data = encodeSnapshot(values,base)
+        self.sent[_frame] = values
+        self.snapshots_sent += 1
+        self.bytes_sent += len(data)
+        return (self.acked_frame if base is not None else -1),data
+
+    def acknowledge(self,_frame):
+        if _frame in self.sent and _frame > self.acked_frame:
+            self.acked_frame = _frame
+            self.acked_values = self.sent[_frame]
+            for frame in list(self.sent.keys()):
+                if frame <= _frame:
+                    del self.sent[frame]
+
+    """
+    Take in a snapshot from the other side, and correct the fighters to match it.
+    Returns False if it couldn't be decoded, in which case it shouldn't be acknowledged.
+    """
+    def receive(self,_frame,_baseFrame,_data,_fighters):
+        values = decodeSnapshot(_data,self.received.get(_baseFrame))
+        if values is None:
+            return False
+        self.received[_frame] = values
+        for frame in sorted(self.received.keys())[:-RECEIVED_SIZE]:
+            del self.received[frame]
+        local = self.history.get(_frame)
+        if local is not None and len(local) == len(values):
+            self.correct(_fighters,values,local)
+        return True
+
+    """
+    Set the fighters straight to a full snapshot, for a spectator starting partway through a match.
+    The facing is set too, by flipping the fighter. The action and grounded state aren't, see above.
+    """
+    def restore(self,_frame,_data,_fighters):
+        values = decodeSnapshot(_data,None)
+        local = takeSnapshot(_fighters)
+        if values is None or len(local) != len(values):
+            return False
+        self.received[_frame] = values
+        self.correct(_fighters,values,local,True)
+        layout,_ = getLayout(len(_fighters))
+        for i,(fighter_index,slot,attr,fmt) in enumerate(layout):
+            if attr == 'facing' and slot is None and values[i] != 0 and values[i] != local[i]:
+                _fighters[fighter_index].flip()
+        return True
+
+    def correct(self,_fighters,_authority,_local,_immediate=False):
+        layout,_ = getLayout(len(_fighters))
+        desynced = False
+        for i,(fighter_index,slot,attr,fmt) in enumerate(layout):
+            diff = _authority[i] - _local[i]
+            if diff == 0:
+                continue
+            fighter = _fighters[fighter_index]
+            if attr in COMPARED_FIELDS:
+                desynced = True
+                continue
+            if slot is None:
+                if attr == 'action_frame':
+                    continue
+                target = fighter
+            elif slot < len(fighter.articles) and slot < _authority[fighter_index*FIELDS_PER_FIGHTER + ARTICLE_COUNT_INDEX]:
+                target = fighter.articles[slot]
+            else:
+                continue
+            if attr in SMOOTHED_FIELDS and not _immediate:
+                if abs(diff) > DESYNC_DISTANCE:
+                    desynced = True
+                self.corrections.append([target,attr,diff,CORRECTION_FRAMES])
+            else:
+                setattr(target,attr,getattr(target,attr,0) + diff)
+            self.corrected_fields += 1
+        if desynced and not _immediate:
+            self.desyncs += 1
+
+    """
+    Move everything that's being corrected along by a frame.
+    """
+    def update(self):
+        for correction in self.corrections:
+            target,attr,amount,frames = correction
+            step = amount / float(frames)
+            setattr(target,attr,getattr(target,attr) + step)
+            correction[2] -= step
+            correction[3] -= 1
+        self.corrections = [correction for correction in self.corrections if correction[3] > 0]
@@ -14,7 +14,10 @@ class loadArticle(SubAction):
     def execute(self, _action, _actor):
         SubAction.execute(self, _action, _actor)
         if self.article:
-            _action.articles[self.name] = _actor.loadArticle(self.article)
+            loaded_article = _actor.loadArticle(self.article)
+            _action.articles[self.name] = loaded_article
+            if hasattr(loaded_article,'holders'):
+                loaded_article.holders.append((_action,self.name))
     
     def getDisplayName(self):
         return 'Load Article: ' + self.name
@@ -0,0 +1,51 @@
+import pygame
+import settingsManager
+
+"""
+The Font Manager keeps every font that's been opened, so each font file is only loaded once
+at each size, no matter how many pieces of text use it.
+
+Rendered strings are cached too, since labels like menu options and stat names get drawn over and
+over with the same text. Each one is rendered whole by Font.render, so kerning, bearing and
+characters that take more than one byte all come out the same as they always have.
+
+The surfaces that come out of renderText are shared. Anything that wants to change one in place
+has to copy it first.
+"""
+#Fonts, by (font name, size)
+fonts = {}
+#Rendered strings, by (font name, size, text, color, antialias)
+strings = {}
+#Once this many strings are cached, the cache is emptied and starts over
+STRING_CACHE_SIZE = 512
+
+"""
+Get the font with the given name from the game directory, opening it if it hasn't been yet.
+"""
+def getFont(_font,_size):
+    key = (_font,_size)
+    if not key in fonts:
+        fonts[key] = pygame.font.Font(settingsManager.createPath(_font+".ttf"),_size)
+    return fonts[key]
+
+"""
+Get a string rendered in the given font and color, from the cache if it's been rendered before.
+Don't change the surface that comes back, copy it first.
+"""
+def renderText(_text,_font="Orbitron Medium",_size=12,_color=[0,0,0],_antialias=False):
+    color = tuple(_color)
+    key = (_font,_size,_text,color,_antialias)
+    if key in strings:
+        return strings[key]
+
+    surface = convertAlpha(getFont(_font,_size).render(_text,_antialias,color))
+
+    if len(strings) >= STRING_CACHE_SIZE:
+        strings.clear()
+    strings[key] = surface
+    return surface
+
+def convertAlpha(_surface):
+    if pygame.display.get_surface() is not None:
+        return _surface.convert_alpha()
+    return _surface
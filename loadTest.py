@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import resource
+import subprocess
+from engine.networkMessages import BUTTONS, NetworkTickMessage, NetworkProgressMessage, NetworkInputMessage, NetworkPingMessage, NetworkClockMessage, frameMessage, LENGTH_PREFIX
+
+"""
+Load tester for the game server. Starts a server on localhost, then connects simulated clients to it
+in pairs. The clients don't run the game or need pygame, they just speak the same protocol as
+engine.network: they join, wait for their match to start, then play at 60 frames a second. Every
+frame they send a packet of the input the other player hasn't acknowledged, every other frame they
+send their progress and the input delay they'd like, and they ping each other and sync their clocks
+with the server as often as the real client does. Like the real client, they stall on a frame the
+server hasn't released or that the other player's input hasn't all arrived for, and send their input
+and progress again while they wait.
+
+Both ends of every ping are clients in this process, so a ping carries the time it was sent on the
+clock they share, and the time it took to come through the server can be measured. At the end, it reports:
+ * how long pings took to be forwarded, at a few percentiles
+ * frames of input that never arrived, that had to be recovered from a later packet, and that arrived
+   after the frame they were for had already been played
+ * how many frames were stalled, and how many clock syncs the server answered
+ * how much CPU the server used
+
+With a netProxy profile, the clients connect through the proxy, to see how the server and the
+lockstep hold up under those conditions.
+
+Like the server, this needs python 3.
+usage: python loadTest.py [clients] [seconds] [udp|tcp] [port] [proxy profile] [proxy seed]
+"""
+FRAME_RATE = 60
+#matches the default networkBufferSize
+INPUT_DELAY = 6
+#these match engine.network
+PROGRESS_INTERVAL = 2
+PING_INTERVAL = 30
+INPUT_REDUNDANCY = 16
+CLOCK_SYNC_INTERVAL = 1.0
+#how likely each client is to press or release a button on any frame
+BUTTON_CHANCE = 0.1
+#how long to wait for every match to start before giving up, and how often to ask to join again
+#over UDP until it does, like engine.network
+CONNECT_TIMEOUT = 10
+JOIN_INTERVAL = 0.5
+
+class LoadStats(object):
+    def __init__(self):
+        self.latencies = []
+        self.sent = 0
+        self.received = 0
+        self.recovered = 0
+        self.late = 0
+        self.stalled = 0
+        self.clock_syncs = 0
+        self.started = 0
+        self.errors = 0
+
+    def getPercentile(self,_percent):
+        if not self.latencies:
+            return 0
+        index = min(len(self.latencies)-1,int(len(self.latencies) * _percent / 100.0))
+        return self.latencies[index] * 1000
+
+    def getReport(self,_duration,_serverCpu):
+        self.latencies.sort()
+        report = {'sent': self.sent,
+                  'received': self.received,
+                  'dropped': self.sent - self.received,
+                  'recovered': self.recovered,
+                  'late': self.late,
+                  'stalled frames': self.stalled,
+                  'pings': len(self.latencies),
+                  'clock syncs': self.clock_syncs,
+                  'matches started': self.started // 2,
+                  'errors': self.errors,
+                  'server cpu %': round(100.0 * _serverCpu / _duration, 1) if _serverCpu is not None else None}
+        for percent in [50,90,99,100]:
+            report['p'+str(percent)+' ms'] = round(self.getPercentile(percent),2)
+        return report
+
+class SimClient(object):
+    def __init__(self,_stats,_protocol,_port):
+        self.stats = _stats
+        self.protocol = _protocol
+        self.port = _port
+        self.tick_count = 0
+        self.max_frame = INPUT_DELAY
+        self.playerno = 0
+        self.started = asyncio.Event()
+        self.transport = None
+        self.reader = None
+        self.writer = None
+        #buttons held down, the input sent that hasn't been acknowledged as (tick, delay, codes), and the
+        #latest progress message, the same as engine.network keeps
+        self.held = set()
+        self.unacked_inputs = []
+        self.last_progress = None
+        #the last tick the other player's input has all arrived up to, and ticks that came in past it
+        self.received_tick = -1
+        self.received_ahead = set()
+
+    def send(self,_msg):
+        data = _msg.encode('ascii')
+        if self.transport is not None:
+            self.transport.sendto(data)
+        elif self.writer is not None:
+            self.writer.write(frameMessage(data))
+
+    def handleMessage(self,_msg):
+        msg = _msg.decode('ascii')
+        msg_input = NetworkInputMessage()
+        msg_progress = NetworkProgressMessage()
+        msg_ping = NetworkPingMessage()
+        msg_clock = NetworkClockMessage()
+        msg_tick = NetworkTickMessage()
+        if msg_input.isValid(msg):
+            self.handleInputPacket(msg_input.fromString(msg))
+        elif msg_progress.isValid(msg):
+            self.max_frame = max(self.max_frame,msg_progress.fromString(msg).frame)
+        elif msg_ping.isValid(msg):
+            msg_ping.fromString(msg)
+            if msg_ping.status == "i":
+                self.stats.latencies.append(time.perf_counter() - msg_ping.time/1000000.0)
+                msg_ping.status = "o"
+                msg_ping.tick = self.tick_count
+                self.send(msg_ping.toString())
+        elif msg_clock.isValid(msg):
+            if msg_clock.fromString(msg).server_time is not None:
+                self.stats.clock_syncs += 1
+        elif msg_tick.isValid(msg):
+            msg_tick.fromString(msg)
+            self.playerno = json.loads(msg_tick.json)['playerno']
+            self.tick_count = msg_tick.tick
+            self.stats.started += 1
+            self.started.set()
+
+    def handleInputPacket(self,_msgInput):
+        while self.unacked_inputs and self.unacked_inputs[0][0] <= _msgInput.ack:
+            self.unacked_inputs.pop(0)
+        for i,(delay,codes) in enumerate(_msgInput.entries):
+            tick = _msgInput.first + i
+            if tick <= self.received_tick or tick in self.received_ahead:
+                continue
+            self.stats.received += 1
+            if i < len(_msgInput.entries)-1:
+                self.stats.recovered += 1
+            #the input was for a frame this client has already played
+            if tick + delay < self.tick_count:
+                self.stats.late += 1
+            self.received_ahead.add(tick)
+        while self.received_tick+1 in self.received_ahead:
+            self.received_tick += 1
+            self.received_ahead.remove(self.received_tick)
+
+    def sendInputPacket(self):
+        msg = NetworkInputMessage()
+        msg.player = self.playerno
+        msg.ack = self.received_tick
+        entries = self.unacked_inputs[-INPUT_REDUNDANCY:]
+        if entries:
+            msg.first = entries[0][0]
+            msg.entries = [(delay,codes) for tick,delay,codes in entries]
+        self.send(msg.toString())
+
+    def pressButtons(self):
+        if random.random() >= BUTTON_CHANCE:
+            return []
+        index = random.randrange(len(BUTTONS))
+        if index in self.held:
+            self.held.remove(index)
+            return ['u'+str(index)]
+        self.held.add(index)
+        return ['d'+str(index)]
+
+    async def connect(self):
+        loop = asyncio.get_event_loop()
+        if self.protocol == 'udp':
+            self.transport,_ = await loop.create_datagram_endpoint(lambda: SimProtocol(self), remote_addr=('127.0.0.1',self.port))
+        else:
+            self.reader,self.writer = await asyncio.open_connection('127.0.0.1',self.port)
+            loop.create_task(self.readStream())
+        self.send('c')
+
+    async def readStream(self):
+        try:
+            while True:
+                size, = LENGTH_PREFIX.unpack(await self.reader.readexactly(LENGTH_PREFIX.size))
+                self.handleMessage(await self.reader.readexactly(size))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def play(self,_duration):
+        give_up = time.perf_counter() + CONNECT_TIMEOUT
+        while not self.started.is_set():
+            if time.perf_counter() >= give_up:
+                self.stats.errors += 1
+                return
+            try:
+                await asyncio.wait_for(self.started.wait(),JOIN_INTERVAL)
+            except asyncio.TimeoutError:
+                if self.transport is not None:
+                    self.send('c')
+        frame_time = 1.0 / FRAME_RATE
+        next_frame = time.perf_counter()
+        end = next_frame + _duration
+        next_clock_sync = next_frame
+        while next_frame < end:
+            if time.perf_counter() >= next_clock_sync:
+                msg_clock = NetworkClockMessage()
+                msg_clock.time = int(time.time()*1000)
+                self.send(msg_clock.toString())
+                next_clock_sync += CLOCK_SYNC_INTERVAL
+            if self.tick_count > self.max_frame or self.received_tick < self.tick_count - INPUT_DELAY:
+                #stalled, waiting on the server or the other player's input
+                self.stats.stalled += 1
+                if self.transport is not None:
+                    self.sendInputPacket()
+                    if self.last_progress is not None:
+                        self.send(self.last_progress)
+            else:
+                self.unacked_inputs.append((self.tick_count,INPUT_DELAY,self.pressButtons()))
+                if self.transport is None:
+                    #TCP doesn't lose anything, so only the newest frame needs sending
+                    self.unacked_inputs = self.unacked_inputs[-1:]
+                self.sendInputPacket()
+                self.stats.sent += 1
+                if self.tick_count % PROGRESS_INTERVAL == 0:
+                    msg_progress = NetworkProgressMessage()
+                    msg_progress.frame = self.tick_count + INPUT_DELAY
+                    msg_progress.delay = INPUT_DELAY
+                    self.last_progress = msg_progress.toString()
+                    self.send(self.last_progress)
+                if self.tick_count % PING_INTERVAL == 0:
+                    msg_ping = NetworkPingMessage()
+                    #the other end is in this process, so the time can be finer than milliseconds
+                    msg_ping.time = int(time.perf_counter()*1000000)
+                    msg_ping.tick = self.tick_count
+                    self.send(msg_ping.toString())
+                self.tick_count += 1
+            next_frame += frame_time
+            await asyncio.sleep(max(0,next_frame - time.perf_counter()))
+
+    def close(self):
+        self.send('d')
+        if self.transport is not None:
+            self.transport.close()
+        if self.writer is not None:
+            self.writer.close()
+
+class SimProtocol(asyncio.DatagramProtocol):
+    def __init__(self,_client):
+        self.client = _client
+
+    def datagram_received(self,_data,_addr):
+        self.client.handleMessage(_data)
+
+    def error_received(self,_exc):
+        self.client.stats.errors += 1
+
+async def runClients(_count,_duration,_protocol,_port):
+    stats = LoadStats()
+    clients = [SimClient(stats,_protocol,_port) for _ in range(_count)]
+    #connect in pairs, so each pair lands in the same room
+    for client in clients:
+        await client.connect()
+    await asyncio.gather(*[client.play(_duration) for client in clients])
+    #give the last frames time to arrive
+    await asyncio.sleep(0.5)
+    for client in clients:
+        client.close()
+    return stats
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    protocol = sys.argv[3] if len(sys.argv) > 3 else 'udp'
+    port = int(sys.argv[4]) if len(sys.argv) > 4 else 9009
+    profile = sys.argv[5] if len(sys.argv) > 5 else None
+    seed = sys.argv[6] if len(sys.argv) > 6 else '0'
+    count -= count % 2
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen([sys.executable,os.path.join(directory,'server.py'),str(port),protocol])
+    proxy = None
+    client_port = port
+    if profile:
+        client_port = port + 1
+        proxy = subprocess.Popen([sys.executable,os.path.join(directory,'netProxy.py'),profile,seed,str(client_port),str(port),protocol])
+    time.sleep(1)
+    try:
+        stats = asyncio.run(runClients(count,duration,protocol,client_port))
+    finally:
+        server.terminate()
+        server.wait()
+        #only children that have been waited on are counted, so this is just the server
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        if proxy is not None:
+            proxy.terminate()
+            proxy.wait()
+    report = stats.getReport(duration,usage.ru_utime + usage.ru_stime)
+    print(str(count)+" clients, "+str(duration)+" seconds over "+protocol+(" through "+profile if profile else ""))
+    for key in ['matches started','sent','received','dropped','recovered','late','stalled frames','pings','clock syncs','errors',
+                'p50 ms','p90 ms','p99 ms','p100 ms','server cpu %']:
+        print('  '+key+': '+str(report[key]))
+
+if __name__ == '__main__': main()
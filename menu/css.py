@@ -10,6 +10,7 @@ import engine.cpuPlayer as cpuPlayer
 import engine.abstractFighter as abstractFighter
 import sss
 import musicManager
+import rosterManager
 
 class CSSScreen():
     def __init__(self,_rules=None):
@@ -29,6 +30,9 @@ class CSSScreen():
         self.player_controls = []
         self.player_panels = []
         
+        #Only fighters that have changed on disk since the last visit get reloaded
+        rosterManager.getRoster().scan()
+        
         for i in range(0,4):
             self.player_controls.append(settingsManager.getControls(i))
             self.player_panels.append(PlayerPanel(i))
@@ -109,25 +113,8 @@ class CSSWidget():
        
 class FighterWheel():
     def __init__(self,_playerNum):
-        self.fighters = []
-        
-        # Load all files.
-        directory = settingsManager.createPath("fighters")
-        fighter_count = 0
-        for subdir in next(os.walk(directory))[1]:
-            if(subdir == '__pycache__'):
-                continue
-            fighter_py = settingsManager.importFromURI(directory, os.path.join(directory,subdir,"fighter.py"),_suffix=str(fighter_count))
-            #try:
-            if fighter_py:
-                fighter = fighter_py.getFighter(os.path.join(directory,subdir),_playerNum)
-            else:
-                fighter = abstractFighter.AbstractFighter(os.path.join(directory,subdir),_playerNum)
-            if (fighter == None):
-                print("No fighter found at " + os.path.join(directory,subdir,"fighter.py"))
-            else:
-                fighter_count += 1
-                self.fighters.append(fighter)      
+        # The roster is shared between every wheel, so the fighters are only loaded once
+        self.fighters = rosterManager.getRoster().getEntries()
         
         self.current_index = 0
         self.current_fighter = self.fighters[0]
@@ -154,19 +141,16 @@ class FighterWheel():
     def animateWheel(self):
         self.visible_sprites[0] = self.fighterAt(0).css_icon
         for i in range(1,(self.wheel_size//2)+1):
-            self.visible_sprites[2*i-1] = self.fighterAt(i).css_icon
-            self.visible_sprites[2*i] = self.fighterAt(-1 * i).css_icon
-                        
-        [spriteManager.ImageSprite.alpha(sprite, 128) for sprite in self.visible_sprites]
-        self.visible_sprites[0].alpha(255)
+            self.visible_sprites[2*i-1] = self.fighterAt(i).css_icon_faded
+            self.visible_sprites[2*i] = self.fighterAt(-1 * i).css_icon_faded
         
     def draw(self, _screen, _location):
         center = 112
         blank_image = pygame.Surface([256,32], pygame.SRCALPHA, 32).convert_alpha()
-        blank_image.blit(self.visible_sprites[0].image, [center,0])
+        blank_image.blit(self.visible_sprites[0], [center,0])
         for i in range(1,(self.wheel_size//2)+1):
-            blank_image.blit(self.visible_sprites[2*i-1].image, [center + (32*i),0])
-            blank_image.blit(self.visible_sprites[2*i].image, [center - (32*i),0])
+            blank_image.blit(self.visible_sprites[2*i-1], [center + (32*i),0])
+            blank_image.blit(self.visible_sprites[2*i], [center - (32*i),0])
         
         blank_image.blit(self.wheel_shadow.image,[0,0])
         _screen.blit(blank_image, _location)
@@ -219,7 +203,7 @@ class PlayerPanel(pygame.Surface):
                 self.current_color = self.player_num
                 self.recolorIcon(True)
                 
-                self.icon = self.wheel.fighterAt(0).franchise_icon
+                self.icon = self.wheel.fighterAt(0).getFranchiseIcon()
                 self.icon.rect.center = self.get_rect().center
                 self.recolorIcon()
                 self.hold_time = 0
@@ -259,9 +243,10 @@ class PlayerPanel(pygame.Surface):
                 self.recolorIcon(True)
                 self.recolorIcon()
                 self.active_object = None
-                self.chosen_fighter = self.wheel.fighterAt(0)
-                self.chosen_fighter.current_color = self.current_color
-                self.chosen_fighter.current_costume = self.current_costume
+                #The full fighter loads in the background while everyone else picks and chooses a stage
+                self.chosen_fighter = self.wheel.fighterAt(0).loadFighter(self.player_num,
+                                                                          self.current_color,
+                                                                          self.current_costume)
         elif _key == 'jump':
             self.current_color += 1
             self.recolorIcon()
@@ -3,6 +3,7 @@ import cmd
 import pdb
 import io
 import settingsManager
+import fontManager
 import spriteManager
 import pygame
 import pygcurse
@@ -10,10 +11,10 @@ import pygcurse
 class debugConsole(pdb.Pdb):
     def __init__(self, _surface, _gameEnv, _font="unifont-9.0.02", _size=16, _height=24):
         self.game_env = _gameEnv
-        text_dims = pygame.font.Font(settingsManager.createPath(_font+".ttf"),_size).size(" ") #Used to determine how much space is available
+        text_dims = fontManager.getFont(_font,_size).size(" ") #Used to determine how much space is available
         self.text_width = int(_surface.get_width()/text_dims[0])
         self.render_corner = [0, _surface.get_height()-text_dims[1]*_height]
-        self.pyg_surface = pygcurse.PygcurseSurface(self.text_width, _height, pygame.font.Font(settingsManager.createPath(_font+".ttf"),_size))
+        self.pyg_surface = pygcurse.PygcurseSurface(self.text_width, _height, fontManager.getFont(_font,_size))
         self.pyg_surface.setscreencolors(fgcolor=None, bgcolor=None, clear=True)
         pdb.Pdb.__init__(self, stdin=self, stdout=self.pyg_surface) #Yay for duck typing
         self.use_rawinput = False
@@ -69,6 +70,25 @@ class debugConsole(pdb.Pdb):
         else: self.pyg_surface.write('Could not find player '+split_args[0]+'\n')
         return False
 
+    def do_spritememory(self, _args):
+        """Shows how many sprite surfaces each fighter is holding.\nSyntax: spritememory"""
+        for fighter in self.game_env.current_fighters:
+            report = fighter.sprite.getMemoryReport()
+            self.pyg_surface.write('Player '+str(fighter.player_num)+' ('+fighter.name+'): '+str(report['frames'])+' frames, '
+                                   +str(report['flipped'])+' flipped, '+str(report['bytes']//1024)+' KB\n')
+        return False
+
+    def do_articlepools(self, _args):
+        """Shows how often each fighter's articles are reused instead of built.\nSyntax: articlepools"""
+        for fighter in self.game_env.current_fighters:
+            if not hasattr(fighter.article_loader, 'pool'):
+                continue
+            self.pyg_surface.write('Player '+str(fighter.player_num)+' ('+fighter.name+'):\n')
+            for name,stats in sorted(fighter.article_loader.pool.getReport().items()):
+                self.pyg_surface.write('  '+name+': '+str(stats['hits'])+' reused, '+str(stats['misses'])+' built, '
+                                       +str(stats['free'])+' waiting\n')
+        return False
+
     def do_advance(self, _args):
         """Advances the game the given number of frames.\nSyntax: advance <num_frames>"""
         #TODO: Allow stepping without an argument
@@ -1,6 +1,7 @@
 import sys
 import io
 import settingsManager
+import fontManager
 import spriteManager
 import pygame
 import pygcurse
@@ -19,7 +20,7 @@ class panel(pygcurse.PygcurseSurface):
             bgcolor = _parent.bgcolor-pygame.Color(16, 16, 16)
         else:
             bgcolor = pygame.Color(255, 255, 255)
-        pygcurse.PygcurseSurface.__init__(self, _width, _height, font=pygame.font.Font(settingsManager.createPath(_font+".ttf"),_size), fgcolor=pygame.Color(0, 0, 0), bgcolor=bgcolor)
+        pygcurse.PygcurseSurface.__init__(self, _width, _height, font=fontManager.getFont(_font,_size), fgcolor=pygame.Color(0, 0, 0), bgcolor=bgcolor)
         self.children = []
         self.focused = None
 
@@ -262,7 +263,7 @@ class searchOption(pygcurse.PygcurseSurface):
         self.screen = _surface
         self.corner = _corner
         self.selection_height = _height-2
-        pygcurse.PygcurseSurface.__init__(self, _length, _height, pygame.font.Font(settingsManager.createPath(_font+".ttf"),_size))
+        pygcurse.PygcurseSurface.__init__(self, _length, _height, fontManager.getFont(_font,_size))
         self.setscreencolors(fgcolor='black', bgcolor='white', clear=True)
         self.current_selection = 0
         if _options is not None:
@@ -5,6 +5,7 @@ import battle
 import spriteManager
 import os
 import musicManager
+import assetManager
 import random
 
 class StageScreen():
@@ -15,6 +16,8 @@ class StageScreen():
         self.stages = []
         self.getStages()
         self.grid = StageGrid(self.stages)
+        self.preloaded_stages = set()
+        self.preloadStage(self.grid.getSelectedStage())
         
         self.height = settings['windowHeight']
         self.width = settings['windowWidth']
@@ -40,6 +43,7 @@ class StageScreen():
         while status == 0:
             music = musicManager.getMusicManager()
             music.doMusicEvent()
+            assetManager.getAssetManager().update()
             #Start event loop
             for event in pygame.event.get():
                 
@@ -47,12 +51,16 @@ class StageScreen():
                     k = bindings.getInputs(event,False,False)
                     if k == 'left':
                         self.grid.updateSelection(-1, 0)    
+                        self.preloadStage(self.grid.getSelectedStage())
                     elif k == 'right':
                         self.grid.updateSelection(1, 0)
+                        self.preloadStage(self.grid.getSelectedStage())
                     elif k == 'up':
                         self.grid.updateSelection(0, -1)  
+                        self.preloadStage(self.grid.getSelectedStage())
                     elif k == 'down':
                         self.grid.updateSelection(0, 1) 
+                        self.preloadStage(self.grid.getSelectedStage())
                     elif k == 'attack':
                         if not self.grid.isStageStruckAt(self.grid.getXY()[0],self.grid.getXY()[1]):
                             #choose
@@ -69,7 +77,11 @@ class StageScreen():
                             musicManager.getMusicManager().createMusicSet('stage', music_list)
                             musicManager.getMusicManager().rollMusic('stage')
                             bindings.flushInputs()
-                            current_battle = battle.Battle(self.rules,self.fighters,stage.getStage())
+                            #The fighters have been loading in the background since they were picked
+                            self.preloadStage(stage)
+                            self.showLoadingScreen(screen,clock)
+                            fighters = [loader.getFighter() for loader in self.fighters]
+                            current_battle = battle.Battle(self.rules,fighters,stage.getStage())
                             current_battle.startBattle(screen)
                             status = 1
                             #do something with battle result
@@ -91,6 +103,44 @@ class StageScreen():
             pygame.display.flip()
             clock.tick(60)
         
+    """
+    Start decoding a stage's images in the background, so they're ready if it gets picked.
+    """
+    def preloadStage(self,_stage):
+        if _stage == 'random' or _stage in self.preloaded_stages:
+            return
+        self.preloaded_stages.add(_stage)
+        stage_dir = os.path.dirname(_stage.__file__).replace('main.exe','')
+        assetManager.getAssetManager().preloadDirectory(os.path.join(stage_dir,"sprites"))
+    
+    """
+    Shows a progress bar until the fighters are done loading and everything that
+    was queued up for the battle has been decoded.
+    """
+    def showLoadingScreen(self,_screen,_clock):
+        assets = assetManager.getAssetManager()
+        loading_text = spriteManager.TextSprite('Loading...','Orbitron Medium',24,[255,255,255])
+        loading_text.rect.center = _screen.get_rect().center
+        bar_rect = pygame.Rect(0,0,_screen.get_width() // 2,16)
+        bar_rect.midtop = (loading_text.rect.centerx,loading_text.rect.bottom + 8)
+        
+        while True:
+            assets.update()
+            pygame.event.pump()
+            
+            fighters_done = len([loader for loader in self.fighters if not loader.is_alive()])
+            if fighters_done == len(self.fighters) and assets.isIdle():
+                return
+            progress = float(fighters_done + assets.completed) / (len(self.fighters) + assets.total)
+            
+            _screen.fill((0,0,0))
+            loading_text.draw(_screen,loading_text.rect.topleft,1)
+            pygame.draw.rect(_screen,[255,255,255],bar_rect,1)
+            fill_rect = pygame.Rect(bar_rect.topleft,(int(bar_rect.width * progress),bar_rect.height))
+            _screen.fill([255,255,255],fill_rect)
+            pygame.display.flip()
+            _clock.tick(60)
+    
     def getStages(self):
         # Load all files.
         directory = settingsManager.createPath("stages")
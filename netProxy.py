@@ -0,0 +1,234 @@
+import sys
+import json
+import time
+import random
+import asyncio
+
+"""
+A proxy that makes a local connection behave like a bad one. Clients connect to the proxy instead of
+the server, and the proxy passes everything on, holding back, dropping, duplicating or reordering
+messages along the way. Each direction has its own conditions, so upload and download can be set
+separately.
+
+The random numbers come from a seed, so the same seed and profile give the same drops and delays
+every time, and a bad run can be played again to see if a change fixed it.
+
+A profile is a list of phases. Each phase starts a number of seconds in and sets the conditions for
+both directions until the next phase starts. The last phase lasts until the proxy stops, or the
+profile loops if it's set to. Profiles can be picked by name from PROFILES, or loaded from a JSON
+file in the same shape.
+
+TCP can't lose or reorder anything, so over TCP only latency and jitter are used, and a message is
+never let through before the one in front of it.
+
+Like the server, this needs python 3.
+usage: python netProxy.py [profile or file] [seed] [listen port] [server port] [udp|tcp]
+"""
+#how much later than usual a reordered message is let through, in seconds
+REORDER_DELAY = 0.05
+#seconds between each stats report
+STATS_INTERVAL = 10
+
+#latency and jitter are in milliseconds, loss, duplicate and reorder are chances from 0 to 1
+PROFILES = {
+    'perfect': {'phases': [{'at': 0, 'up': {}, 'down': {}}]},
+    'lan': {'phases': [{'at': 0, 'up': {'latency': 2, 'jitter': 1}, 'down': {'latency': 2, 'jitter': 1}}]},
+    'wifi': {'phases': [{'at': 0, 'up': {'latency': 15, 'jitter': 8, 'loss': 0.01},
+                                  'down': {'latency': 15, 'jitter': 8, 'loss': 0.01}}]},
+    'cross country': {'phases': [{'at': 0, 'up': {'latency': 45, 'jitter': 5, 'loss': 0.005},
+                                           'down': {'latency': 45, 'jitter': 5, 'loss': 0.005}}]},
+    'bad': {'phases': [{'at': 0, 'up': {'latency': 80, 'jitter': 30, 'loss': 0.05, 'duplicate': 0.02, 'reorder': 0.05},
+                                 'down': {'latency': 80, 'jitter': 30, 'loss': 0.05, 'duplicate': 0.02, 'reorder': 0.05}}]},
+    #a second long lag spike every 30 seconds
+    'spikes': {'loop': True,
+               'phases': [{'at': 0, 'up': {'latency': 20, 'jitter': 4}, 'down': {'latency': 20, 'jitter': 4}},
+                          {'at': 29, 'up': {'latency': 1000}, 'down': {'latency': 1000}},
+                          {'at': 30}]},
+}
+
+class LinkConditions(object):
+    def __init__(self,_settings={}):
+        self.latency = _settings.get('latency',0) / 1000.0
+        self.jitter = _settings.get('jitter',0) / 1000.0
+        self.loss = _settings.get('loss',0)
+        self.duplicate = _settings.get('duplicate',0)
+        self.reorder = _settings.get('reorder',0)
+
+class Profile(object):
+    def __init__(self,_data):
+        self.loop = _data.get('loop',False)
+        self.phases = sorted(_data['phases'],key=lambda phase: phase['at'])
+        self.length = self.phases[-1]['at']
+
+    """
+    Get the conditions in a direction, 'up' or 'down', the given number of seconds after the proxy started.
+    A phase that doesn't list a direction keeps going with the one before it.
+    """
+    def getConditions(self,_direction,_elapsed):
+        if self.loop and self.length > 0:
+            _elapsed = _elapsed % self.length
+        settings = {}
+        for phase in self.phases:
+            if phase['at'] > _elapsed:
+                break
+            settings = phase.get(_direction,settings)
+        return LinkConditions(settings)
+
+def loadProfile(_name):
+    if _name in PROFILES:
+        return Profile(PROFILES[_name])
+    with open(_name,'r') as profile_file:
+        return Profile(json.load(profile_file))
+
+"""
+One direction of one connection. Decides what happens to each message going through it, and hands
+it on when its time comes.
+"""
+class Link(object):
+    def __init__(self,_proxy,_direction,_deliver,_ordered=False):
+        self.proxy = _proxy
+        self.direction = _direction
+        self.deliver = _deliver
+        #TCP links have to keep everything in order
+        self.ordered = _ordered
+        self.last_delivery = 0
+
+    def send(self,_data):
+        conditions = self.proxy.getConditions(self.direction)
+        stats = self.proxy.stats[self.direction]
+        rand = self.proxy.random
+        stats['messages'] += 1
+        copies = 1
+        if not self.ordered:
+            if rand.random() < conditions.loss:
+                stats['dropped'] += 1
+                return
+            if rand.random() < conditions.duplicate:
+                stats['duplicated'] += 1
+                copies = 2
+        for _ in range(copies):
+            delay = conditions.latency + rand.uniform(-conditions.jitter,conditions.jitter)
+            if not self.ordered and rand.random() < conditions.reorder:
+                stats['reordered'] += 1
+                delay += REORDER_DELAY
+            deliver_at = self.proxy.loop.time() + max(0,delay)
+            if self.ordered:
+                deliver_at = max(deliver_at,self.last_delivery)
+                self.last_delivery = deliver_at
+            self.proxy.loop.call_at(deliver_at,self.deliver,_data)
+
+class UDPClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self,_proxy):
+        self.proxy = _proxy
+
+    def connection_made(self,_transport):
+        self.transport = _transport
+
+    def datagram_received(self,_data,_addr):
+        self.proxy.getUDPSession(_addr).up.send(_data)
+
+"""
+Each client gets its own socket to the server, so the server still sees them as different players.
+"""
+class UDPSession(asyncio.DatagramProtocol):
+    def __init__(self,_proxy,_addr):
+        self.proxy = _proxy
+        self.addr = _addr
+        self.transport = None
+        self.waiting = []
+        self.up = Link(_proxy,'up',self.sendUp)
+        self.down = Link(_proxy,'down',self.sendDown)
+
+    def connection_made(self,_transport):
+        self.transport = _transport
+        for data in self.waiting:
+            self.transport.sendto(data)
+        self.waiting = []
+
+    def datagram_received(self,_data,_addr):
+        self.down.send(_data)
+
+    def sendUp(self,_data):
+        if self.transport is None:
+            self.waiting.append(_data)
+        else:
+            self.transport.sendto(_data)
+
+    def sendDown(self,_data):
+        self.proxy.client_transport.sendto(_data,self.addr)
+
+class NetProxy(object):
+    def __init__(self,_profile,_seed,_listenPort,_serverPort,_protocol):
+        self.profile = _profile
+        self.seed = _seed
+        self.random = random.Random(_seed)
+        self.listen_port = _listenPort
+        self.server_port = _serverPort
+        self.protocol = _protocol
+        self.sessions = {}
+        self.client_transport = None
+        self.start_time = time.time()
+        self.stats = {'up': {'messages': 0, 'dropped': 0, 'duplicated': 0, 'reordered': 0},
+                      'down': {'messages': 0, 'dropped': 0, 'duplicated': 0, 'reordered': 0}}
+
+    def getConditions(self,_direction):
+        return self.profile.getConditions(_direction,time.time() - self.start_time)
+
+    def getUDPSession(self,_addr):
+        session = self.sessions.get(_addr)
+        if session is None:
+            session = self.sessions[_addr] = UDPSession(self,_addr)
+            self.loop.create_task(self.loop.create_datagram_endpoint(lambda: session,remote_addr=('127.0.0.1',self.server_port)))
+        return session
+
+    async def handleConnection(self,_reader,_writer):
+        try:
+            server_reader,server_writer = await asyncio.open_connection('127.0.0.1',self.server_port)
+        except ConnectionError:
+            _writer.close()
+            return
+        up = Link(self,'up',server_writer.write,True)
+        down = Link(self,'down',_writer.write,True)
+        await asyncio.gather(self.pipe(_reader,up,server_writer),self.pipe(server_reader,down,_writer))
+
+    async def pipe(self,_reader,_link,_writer):
+        try:
+            while True:
+                data = await _reader.read(4096)
+                if not data:
+                    break
+                _link.send(data)
+        except ConnectionError:
+            pass
+        #let anything still held back go through before closing
+        await asyncio.sleep(max(0,_link.last_delivery - self.loop.time()))
+        _writer.close()
+
+    async def reportStats(self):
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            for direction in ['up','down']:
+                stats = self.stats[direction]
+                print(direction+": "+', '.join([key+' '+str(stats[key]) for key in ['messages','dropped','duplicated','reordered']]))
+
+    async def serve(self):
+        self.loop = asyncio.get_event_loop()
+        if self.protocol == 'udp':
+            self.client_transport,_ = await self.loop.create_datagram_endpoint(lambda: UDPClientProtocol(self),local_addr=('0.0.0.0',self.listen_port))
+        else:
+            self.tcp_server = await asyncio.start_server(self.handleConnection,'',self.listen_port)
+        await self.reportStats()
+
+    def run(self):
+        print("Proxying "+str(self.listen_port)+" to "+str(self.server_port)+" over "+self.protocol+" with seed "+str(self.seed))
+        asyncio.run(self.serve())
+
+def main():
+    profile = sys.argv[1] if len(sys.argv) > 1 else 'wifi'
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    listen_port = int(sys.argv[3]) if len(sys.argv) > 3 else 9010
+    server_port = int(sys.argv[4]) if len(sys.argv) > 4 else 9009
+    protocol = sys.argv[5] if len(sys.argv) > 5 else 'udp'
+    NetProxy(loadProfile(profile),seed,listen_port,server_port,protocol).run()
+
+if __name__ == '__main__': main()
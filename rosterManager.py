@@ -0,0 +1,198 @@
+import os
+import threading
+import xml.etree.ElementTree as ElementTree
+import pygame
+import settingsManager
+import spriteManager
+import engine.abstractFighter as abstractFighter
+
+"""
+The Roster Manager keeps a single cache of every fighter in the fighters directory,
+shared by every screen that needs to list them. Each fighter's metadata and icons
+are loaded once per process, and only re-loaded if something in that fighter's
+directory changes on disk. The rest of the fighter is only loaded once it's picked.
+"""
+roster = None
+
+def getRoster():
+    global roster
+    if roster == None:
+        roster = Roster()
+    return roster
+
+"""
+A RosterEntry is the lightweight header of a fighter: just enough to show it on the
+character select screen. Only the name, icons and palette display colors are read from
+fighter.xml. Stats, sprites, actions, articles and sounds aren't touched until the fighter
+is actually picked and loaded with loadFighter.
+
+Entries are shared between all of the player panels, so nothing in here should ever be
+modified after it's built. Anything a panel wants to change (like recoloring the franchise
+icon) should be done to a copy.
+"""
+class RosterEntry():
+    def __init__(self,_directory,_mtime):
+        self.directory = _directory
+        self.mtime = _mtime
+        self.fighter_module = None
+        
+        xml_data = None
+        if os.path.exists(os.path.join(self.directory,'fighter.xml')):
+            xml_data = ElementTree.parse(os.path.join(self.directory,'fighter.xml')).getroot()
+        
+        def loadNodeWithDefault(_tag,_default):
+            if xml_data is not None and xml_data.find(_tag) is not None and xml_data.find(_tag).text is not None:
+                return xml_data.find(_tag).text
+            return _default
+        
+        self.name = loadNodeWithDefault('name', abstractFighter.AbstractFighter.name)
+        self.css_icon_path = self.resolvePath(loadNodeWithDefault('css_icon', abstractFighter.AbstractFighter.css_icon_path))
+        self.franchise_icon_path = self.resolvePath(loadNodeWithDefault('icon', abstractFighter.AbstractFighter.franchise_icon_path))
+        
+        self.palette_display = []
+        if xml_data is not None:
+            for color_palette in xml_data.findall('color_palette'):
+                self.palette_display.append(pygame.Color(color_palette.attrib['displayColor']))
+        
+        css_icon = pygame.image.load(self.css_icon_path)
+        self.css_icon = withAlpha(css_icon, 255)
+        self.css_icon_faded = withAlpha(css_icon, 128)
+        self.franchise_icon = pygame.image.load(self.franchise_icon_path)
+    
+    """
+    Icon paths that start with a period are relative to the game directory, everything
+    else is relative to the fighter's own directory. This is the same rule AbstractFighter uses.
+    """
+    def resolvePath(self,_path):
+        if _path[0] == '.':
+            return settingsManager.createPath(_path)
+        return os.path.join(self.directory,_path)
+    
+    """
+    Build a new fighter from this entry for the given player. This is the full load, so
+    it's slow. Every call gives a new fighter object, so two players can pick the same
+    fighter safely.
+    """
+    def getFighter(self,_playerNum):
+        if self.fighter_module is None:
+            self.fighter_module = settingsManager.importFromURI(self.directory, os.path.join(self.directory,"fighter.py"),_suffix=os.path.basename(self.directory))
+        if self.fighter_module:
+            return self.fighter_module.getFighter(self.directory,_playerNum)
+        else:
+            return abstractFighter.AbstractFighter(self.directory,_playerNum)
+    
+    """
+    Start the full load of this fighter on a background thread. Returns the FighterLoader
+    doing the work, which will hand over the finished fighter when asked.
+    """
+    def loadFighter(self,_playerNum,_color,_costume):
+        loader = FighterLoader(self,_playerNum,_color,_costume)
+        loader.start()
+        return loader
+    
+    """
+    Get a copy of the franchise icon that the caller is free to recolor.
+    """
+    def getFranchiseIcon(self):
+        return spriteManager.ImageSprite(self.franchise_icon_path,self.franchise_icon)
+
+"""
+The FighterLoader does the full load of a fighter in the background, so the menus can keep
+running while stats, actions and sprites are read from disk. Call getFighter to wait for it
+to finish and get the loaded fighter.
+"""
+class FighterLoader(threading.Thread):
+    def __init__(self,_entry,_playerNum,_color,_costume):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.entry = _entry
+        self.player_num = _playerNum
+        self.color = _color
+        self.costume = _costume
+        self.fighter = None
+        self.error = None
+        
+    def run(self):
+        try:
+            self.fighter = self.entry.getFighter(self.player_num)
+            self.fighter.current_color = self.color
+            self.fighter.current_costume = self.costume
+            self.fighter.preloadAssets()
+        except Exception as e:
+            self.error = e
+    
+    """
+    Blocks until the fighter is done loading, then returns it.
+    If the load failed, the error is raised here, on the thread that asked for it.
+    """
+    def getFighter(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.fighter
+
+class Roster():
+    def __init__(self):
+        self.directory = settingsManager.createPath("fighters")
+        self.entries = {}
+        self.entry_list = []
+        self.scan()
+
+    """
+    Walk the fighters directory and bring the cache up to date. Directories that haven't
+    changed since the last scan keep their existing entry, so this is only a handful of
+    stat calls per fighter when nothing's been modified.
+    """
+    def scan(self):
+        entry_list = []
+        found = set()
+        for subdir in next(os.walk(self.directory))[1]:
+            if(subdir == '__pycache__'):
+                continue
+            path = os.path.join(self.directory,subdir)
+            mtime = getModifiedTime(path)
+            found.add(subdir)
+
+            entry = self.entries.get(subdir)
+            if entry is None or entry.mtime != mtime:
+                try:
+                    entry = RosterEntry(path,mtime)
+                except Exception as e:
+                    print("No fighter found at " + path, e)
+                    entry = None
+                self.entries[subdir] = entry
+            if entry is not None:
+                entry_list.append(entry)
+
+        #Throw away anything that's been deleted since the last scan
+        for subdir in list(self.entries.keys()):
+            if subdir not in found:
+                del self.entries[subdir]
+
+        self.entry_list = entry_list
+        return self.entry_list
+
+    def getEntries(self):
+        return self.entry_list
+
+"""
+The newest modification time of a fighter directory. The directory's own time only changes
+when files are added or removed, so the files that define the fighter are checked too.
+"""
+def getModifiedTime(_path):
+    mtime = os.path.getmtime(_path)
+    for f in ['fighter.xml','fighter.py']:
+        file_path = os.path.join(_path,f)
+        if os.path.exists(file_path):
+            mtime = max(mtime,os.path.getmtime(file_path))
+    return mtime
+
+"""
+Returns a copy of the surface with every non-transparent pixel set to the given alpha.
+"""
+def withAlpha(_surface,_alpha):
+    surface = _surface.copy()
+    arr = pygame.surfarray.pixels_alpha(surface)
+    arr[arr!=0] = _alpha
+    del arr
+    return surface
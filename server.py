@@ -1,152 +1,484 @@
-import socket
-import select
 import sys
-import json
-import settingsManager
-
-#remove this import if removing debug code
 import time
+import asyncio
+from engine.networkMessages import getDelayChangeFrame, frameMessage, LENGTH_PREFIX
 
 #lightweight server, for the most part just statelessly bounces messages between players
-#the state it does handle, is number of players online and what frame they can progress to
+#the state it does handle, is which room each player is in and what frame they can progress to
+#
+#every client is matched into a room. A room holds one match, and the server can host as many rooms
+#as it has clients for. Clients are looked up by address and rooms by name, so routing a message is
+#the same amount of work no matter how many matches are going on.
+#
+#any number of spectators can watch a room. They get everything the players send that the game needs
+#(input, progress and fighter snapshots) batched together into a few bigger packets. Player 1 sends a
+#full snapshot every so often as a keyframe, and a spectator who joins mid-match is sent the latest
+#keyframe and everything since, so they can fast forward to the live frame.
+#
+#over TCP, every message has its length in front of it, and everything sent to a client before the
+#event loop comes back around goes out in a single write.
+#
+#the server runs on asyncio, so it needs python 3. The game itself doesn't import it.
+
+SOCKET_MODE_UDP = "udp"
+SOCKET_MODE_TCP = "tcp"
+
+#number of players needed to start a match
+ROOM_SIZE = 2
+#seconds between each stats report
+STATS_INTERVAL = 10
+#seconds a UDP client can go without sending anything before it's dropped
+CLIENT_TIMEOUT = 30
+#messages that go straight on to the other players in the room: redundant input, fighter snapshots
+#and their acknowledgements, and pings
+PASSTHROUGH_COMMANDS = [b"r",b"f",b"k",b"i",b"o"]
+#messages that spectators are sent
+SPECTATOR_COMMANDS = [b"r",b"f",b"p"]
+#seconds between each batch sent to spectators, and the biggest batch to put in one UDP packet, which
+#has to fit in what the client reads at once. A lost batch is mostly made up for by the redundant
+#input in the ones after it, and the fighter snapshots
+SPECTATOR_BATCH_INTERVAL = 0.1
+SPECTATOR_BATCH_SIZE = 1000
+#the most messages kept for spectators who join mid-match
+HISTORY_SIZE = 8192
+
+class RoomStats(object):
+  def __init__(self):
+    self.created = time.time()
+    self.started = None
+    self.messages = 0
+    self.bytes = 0
+    self.forwarded = 0
+    self.progress = 0
+    self.spectator_batches = 0
+    self.spectator_bytes = 0
+
+  def getReport(self):
+    now = time.time()
+    return {'age': round(now-self.created,1),
+            'playing': round(now-self.started,1) if self.started else 0,
+            'messages': self.messages,
+            'bytes': self.bytes,
+            'forwarded': self.forwarded,
+            'progress': self.progress,
+            'spectator batches': self.spectator_batches,
+            'spectator bytes': self.spectator_bytes}
+
+class Room(object):
+  def __init__(self, name, size=ROOM_SIZE, public=True):
+    self.name = name
+    self.size = size
+    #public rooms are filled by matchmaking, private ones only by name
+    self.public = public
+    self.players = []
+    self.spectators = []
+    self.started = False
+    #messages for spectators that haven't been sent yet, each tagged with the number of the player who sent it
+    self.feed = []
+    #the latest full fighter snapshot, with the frame it's from, and the messages since the one before it,
+    #so anything sent before the keyframe for a frame after it is still there
+    self.keyframe = None
+    self.keyframe_frame = 0
+    self.history = []
+    self.previous_history = []
+    #the input delay everyone agreed on, and the frame it starts at
+    self.delay = None
+    self.delay_frame = None
+    #the furthest frame every player has got to, which they've all been told they can play up to, and the
+    #message that told them
+    self.released = 0
+    self.released_msg = None
+    self.stats = RoomStats()
+
+  def isFull(self):
+    return len(self.players) >= self.size
+
+  def add(self, client):
+    client.room = self
+    client.next_frame = 0
+    self.players.append(client)
+
+  def addSpectator(self, client):
+    client.room = self
+    client.spectating = True
+    self.spectators.append(client)
+    if self.started:
+      self.sendCatchUp(client)
+
+  #start a spectator from the keyframe, with everything since so they can catch up
+  def sendCatchUp(self, spectator):
+    spectator.send(('t_'+str(self.keyframe_frame)+'_{"playerno":0}').encode('ascii'))
+    entries = self.previous_history + self.history
+    if self.keyframe is not None:
+      entries = [self.keyframe] + entries
+    self.sendBatches(spectator, entries)
+
+  def remove(self, client):
+    if client in self.players:
+      self.players.remove(client)
+    if client in self.spectators:
+      self.spectators.remove(client)
+    client.room = None
+    client.spectating = False
+
+  def isEmpty(self):
+    return not self.players and not self.spectators
+
+  #the game is ready to start, send connect message to all
+  def start(self):
+    self.started = True
+    self.stats.started = time.time()
+    playerno = 1#give each player a unique number
+    for player in self.players:
+      player.playerno = playerno
+      self.sendStart(player)
+      playerno += 1
+    for spectator in self.spectators:
+      spectator.send(b't_0_{"playerno":0}')
+
+  def sendStart(self, player):
+    player.send(('t_0_{"playerno":'+str(player.playerno)+'}').encode('ascii'))
+
+  def forward(self, msg, sender):
+    for player in self.players:
+      if player is not sender:
+        player.send(msg)
+        self.stats.forwarded += 1
+    if msg[0:1] in SPECTATOR_COMMANDS:
+      self.record(msg, sender.playerno)
+
+  """
+  Keep a message for the spectators, and for anyone who starts spectating later.
+  """
+  def record(self, msg, playerno):
+    entry = str(playerno).encode('ascii')+b":"+msg
+    parts = msg.split(b"|")
+    if msg[0:1] == b"f" and len(parts) > 2 and parts[2] == b"-1":#a full snapshot, the new keyframe
+      self.keyframe = entry
+      self.keyframe_frame = int(parts[1])
+      self.previous_history = self.history
+      self.history = []
+    else:
+      self.history.append(entry)
+      if len(self.history) > HISTORY_SIZE:
+        self.history.pop(0)
+    if self.spectators:
+      self.feed.append(entry)
+
+  def flush(self):
+    for spectator in self.spectators:
+      self.sendBatches(spectator, self.feed)
+    self.feed = []
+
+  """
+  Send messages to a spectator, packed into as few packets as they fit in.
+  """
+  def sendBatches(self, spectator, entries):
+    batch = []
+    size = 0
+    for entry in entries:
+      if batch and size + len(entry) + 1 > SPECTATOR_BATCH_SIZE:
+        self.sendBatch(spectator, batch)
+        batch = []
+        size = 0
+      batch.append(entry)
+      size += len(entry) + 1
+    if batch:
+      self.sendBatch(spectator, batch)
+
+  def sendBatch(self, spectator, batch):
+    msg = b"b\n"+b"\n".join(batch)
+    self.stats.spectator_batches += 1
+    self.stats.spectator_bytes += len(msg)
+    spectator.send(msg)
+
+  #client is progressing to frame X, tell everyone they can play up to the furthest frame all the players
+  #have got to. A client asking about a frame that's already been let go is sent the answer again, since
+  #over UDP it may have lost it, and it stalls until it hears.
+  #clients also send the input delay they'd like, and get back the largest, so everyone uses the same one
+  def progress(self, client, msg, frame, delay=None):
+    client.next_frame = max(client.next_frame, frame)
+    client.desired_delay = delay
+    self.stats.progress += 1
+    released = min([player.next_frame for player in self.players])
+    if released <= self.released:
+      if frame <= self.released and self.released_msg is not None:
+        client.send(self.released_msg)
+      return
+    self.released = released
+    if delay is not None:
+      #every message until the change frame carries the same answer, in case some are lost
+      change_frame = getDelayChangeFrame(released)
+      if change_frame != self.delay_frame:
+        self.delay_frame = change_frame
+        self.delay = max([player.desired_delay or 0 for player in self.players])
+      msg = ("p_"+str(released)+"_"+str(self.delay)).encode('ascii')
+    else:
+      msg = ("p_"+str(released)).encode('ascii')
+    self.released_msg = msg
+    for player in self.players:
+      player.send(msg)
+    self.record(msg, 0)
+
+  def getReport(self):
+    report = self.stats.getReport()
+    report['name'] = self.name
+    report['players'] = len(self.players)
+    report['spectators'] = len(self.spectators)
+    report['started'] = self.started
+    return report
+
+class Client(object):
+  def __init__(self, server, addr, writer=None):
+    self.server = server
+    self.addr = addr
+    #only set for TCP clients, UDP clients all share the server's transport
+    self.writer = writer
+    #framed TCP messages waiting for the next flush
+    self.pending = []
+    self.room = None
+    self.next_frame = 0
+    self.desired_delay = None
+    self.playerno = 0
+    self.spectating = False
+    self.last_seen = time.time()
+
+  def send(self, msg):
+    self.server.send(msg, self)
+
+class UDPProtocol(asyncio.DatagramProtocol):
+  def __init__(self, server):
+    self.server = server
+
+  def connection_made(self, transport):
+    self.server.transport = transport
+
+  def datagram_received(self, data, addr):
+    client = self.server.clients.get(addr)
+    if client is None:
+      client = self.server.addClient(addr)
+    self.server.handleMessage(data, client)
 
 class GameServer(object):
-  #TODO: replace hard-coded ports/addresses with configurable ones
-  def __init__(self, port=9009):
-    self.settings = settingsManager.getSetting().setting
-    port =self.settings['networkServerPort']
-    self.MESSAGE_SIZE = 96
-    self.SOCKET_MODE_UDP = "udp"
-    self.SOCKET_MODE_TCP = "tcp"#not implemented yet
-    self.connect_mode = self.settings['networkProtocol']
-    if(self.connect_mode == self.SOCKET_MODE_UDP):
-        self.conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.conn.bind(("", port))#bind to everything.
-    if(self.connect_mode == self.SOCKET_MODE_TCP):
-        self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.conn.setblocking(0)
-        self.conn.bind(('', port))
-        self.conn.listen(5)
-        self.message_queues = {}
-    self.read_list = [self.conn]
-    self.write_list = []
-    self.players = {}
-    
-    self.DEBUG_ENABLED = False
-    #quick and dirty way of testing artificial latency
-    #cycles through this list and sleeps for that amount of time (in seconds)
-    self.sleep_intervals = [0,0,0,0,0,0,0,0,0,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]
-    
-    
-  def send(self,msg,target):
-      if(self.connect_mode == self.SOCKET_MODE_UDP):
-        self.conn.sendto(msg, target)
-      if(self.connect_mode == self.SOCKET_MODE_TCP):
-        if len(msg)<self.MESSAGE_SIZE:#fixed-width messages, could be made better by proper buffering 
-          msg='{message: <{fill}}'.format(message=msg, fill=self.MESSAGE_SIZE)
-        else:
-          print("message too long: "+str(len(msg))+" "+msg)
-        for s in self.read_list:
-          if s is not self.conn and s.getpeername() == target:
-            self.message_queues[s].append(msg)
-            if s not in self.write_list:
-                self.write_list.append(s)
-
-  def handleMessage(self,msg,addr):
-    if len(msg) >= 1:
-      cmd = msg[0]
-      if cmd == "c":#player connected
-        self.players[addr] = {'nextframe':0}
-        #TODO: what happens when there is more than 2 players? (game will start at 2)
-        if(len(self.players)>1):#game is ready to start, send connect message to all
-          playerno = 1#give each player a unique number
-          for player in self.players:
-            onlineMsg = """t_0_{"playerno":"""+str(playerno)+"""}"""
-            playerno+=1
-            self.send(onlineMsg, player)
-      elif cmd == "u" or cmd == "f":#update keyboard or update fighter, passthrough message
-        if len(msg) >= 2 and addr in self.players:
-          for player in self.players:
-            if(addr != player):
-              self.send(msg, player)
-        else:
-          print "Unknown message: {0},{1}".format(msg,addr)
-      elif cmd == "p":#client is progressing to frame X
-        evtSplit = msg.split("_")
-        self.status = evtSplit[0]
-        self.tick = int(evtSplit[1])
-        if addr in self.players:
-          self.players[addr]['nextframe'] = self.tick
-        else:
-          print("progress message from unknown player: " + str(addr))
-        allClientsHaveSameFrame = True
-        for player in self.players.values():
-          if player['nextframe']!=self.tick:
-            allClientsHaveSameFrame = False
-        if allClientsHaveSameFrame:
-          for playeraddr in self.players:
-              self.send(msg, playeraddr)#send to players that they can all progress to frame X
-      elif cmd == "d":#player disconnected (unused)
-        if addr in self.players:
-          del self.players[addr]
-          #TODO: if len(self.players==0), exit server
-          #TODO: close TCP connections
+  def __init__(self, port=None, protocol=None):
+    if port is None or protocol is None:
+      import settingsManager
+      self.settings = settingsManager.getSetting().setting
+      if port is None: port = self.settings['networkServerPort']
+      if protocol is None: protocol = self.settings['networkProtocol']
+    self.port = port
+    self.connect_mode = protocol
+    self.transport = None
+    #every connected client, by address
+    self.clients = {}
+    #every room, by name
+    self.rooms = {}
+    #public rooms that are still waiting for players, oldest first
+    self.open_rooms = []
+    self.room_count = 0
+    #rooms with messages waiting to go out to spectators
+    self.feeding = set()
+    #TCP clients with messages waiting to be written
+    self.unflushed = set()
+
+  #to test with latency or packet loss, run netProxy.py in front of the server
+  def send(self, msg, client):
+    if self.connect_mode == SOCKET_MODE_UDP:
+      self.transport.sendto(msg, client.addr)
+    elif client.writer is not None:
+      #held until everything that's ready has been handled, then written all at once
+      if not self.unflushed:
+        asyncio.get_event_loop().call_soon(self.flush)
+      self.unflushed.add(client)
+      client.pending.append(frameMessage(msg))
+
+  def flush(self):
+    for client in self.unflushed:
+      if client.writer is not None and client.pending:
+        client.writer.write(b"".join(client.pending))
+      client.pending = []
+    self.unflushed = set()
+
+  def addClient(self, addr, writer=None):
+    client = Client(self, addr, writer)
+    self.clients[addr] = client
+    return client
+
+  def removeClient(self, client):
+    self.leaveRoom(client)
+    if self.clients.get(client.addr) is client:
+      del self.clients[client.addr]
+    if client.writer is not None:
+      client.writer.close()
+      client.writer = None
+
+  """
+  Put a client into a room. With no name, they go into the oldest public room that
+  still has space, or a new one if there isn't any. With a name, they go into that
+  room, which is made if it doesn't exist yet.
+  """
+  def joinRoom(self, client, name=None):
+    self.leaveRoom(client)
+    if name:
+      room = self.rooms.get(name)
+      if room is None:
+        room = self.rooms[name] = Room(name, public=False)
+    else:
+      while self.open_rooms and (self.open_rooms[0].isFull() or self.open_rooms[0].started):
+        self.open_rooms.pop(0)
+      if self.open_rooms:
+        room = self.open_rooms[0]
       else:
-        print "Unexpected: {0}".format(msg)
-  
-  def process(self):
-    readable, writable, exceptional = (
-      select.select(self.read_list, self.write_list, [])
-    )
-    if self.connect_mode == self.SOCKET_MODE_UDP:
-      for f in readable:
-        if f is self.conn:
-          msg, addr = f.recvfrom(self.MESSAGE_SIZE)
-          self.handleMessage(msg,addr)
-    if self.connect_mode == self.SOCKET_MODE_TCP:
-      for s in readable:
-        if s is self.conn:
-            connection, client_address = s.accept()
-            connection.setblocking(0)
-            self.read_list.append(connection)
-            self.message_queues[connection] = []
-        else:
-            data = s.recv(self.MESSAGE_SIZE)
-            if data:
-                data = data.strip()
-                self.handleMessage(data,s.getpeername())
-            else:
-                if s in self.write_list:
-                    self.write_list.remove(s)
-                self.read_list.remove(s)
-                s.close()
-                del self.message_queues[s]
-
-    for s in writable:
-        if(len(self.message_queues[s])>0):
-            for next_msg in self.message_queues[s]:
-              s.sendall(next_msg)
-            self.message_queues[s] = []
-        self.write_list.remove(s)
-
-    for s in exceptional:
-        self.read_list.remove(s)
-        if s in self.write_list:
-            self.write_list.remove(s)
-        s.close()
-        del self.message_queues[s]
-    
-  
-  def run(self):
-    print "Staring Server"
+        self.room_count += 1
+        while 'room'+str(self.room_count) in self.rooms:
+          self.room_count += 1
+        room = self.rooms['room'+str(self.room_count)] = Room('room'+str(self.room_count))
+        self.open_rooms.append(room)
+    if room.isFull() or room.started:
+      print("room "+room.name+" is full, "+str(client.addr)+" can't join")
+      return None
+    room.add(client)
+    if room.isFull():
+      if room in self.open_rooms:
+        self.open_rooms.remove(room)
+      room.start()
+    return room
+
+  """
+  Put a client into a room to watch. With no name, they watch any match that's going, or wait
+  in the oldest public room for one to start.
+  """
+  def spectateRoom(self, client, name=None):
+    self.leaveRoom(client)
+    if name:
+      room = self.rooms.get(name)
+      if room is None:
+        room = self.rooms[name] = Room(name, public=False)
+    else:
+      room = None
+      for other in self.rooms.values():
+        if other.started and other.public:
+          room = other
+          break
+      if room is None:
+        room = self.open_rooms[0] if self.open_rooms else None
+      if room is None:
+        print("no room for "+str(client.addr)+" to watch")
+        return None
+    room.addSpectator(client)
+    return room
+
+  def leaveRoom(self, client):
+    room = client.room
+    if room is None:
+      return
+    room.remove(client)
+    self.feeding.discard(room)
+    if room.isEmpty():
+      del self.rooms[room.name]
+      if room in self.open_rooms:
+        self.open_rooms.remove(room)
+
+  def handleMessage(self, msg, client):
+    client.last_seen = time.time()
+    if len(msg) < 1:
+      return
+    cmd = msg[0:1]
+    room = client.room
+    if room is not None:
+      room.stats.messages += 1
+      room.stats.bytes += len(msg)
+    if cmd == b"c":#player connected, optionally with the name of the room to join: c_name
+      name = msg[2:].decode('ascii','replace').strip() if len(msg) > 2 else None
+      if room is not None and not client.spectating and name in [None, room.name]:
+        #over UDP, clients ask again until they hear the match has started, in case either message was lost
+        if room.started:
+          room.sendStart(client)
+      else:
+        self.joinRoom(client, name)
+    elif cmd == b"w":#spectator connected, optionally with the name of the room to watch: w_name
+      name = msg[2:].decode('ascii','replace').strip() if len(msg) > 2 else None
+      if room is not None and client.spectating and name in [None, room.name]:
+        if room.started:
+          room.sendCatchUp(client)
+      else:
+        self.spectateRoom(client, name)
+    elif cmd == b"d":#player disconnected
+      self.removeClient(client)
+    elif cmd == b"s":#clock sync, send it straight back with the time on the server's clock
+      if msg.count(b"_") == 1:
+        client.send(msg+b"_"+str(int(time.time()*1000)).encode('ascii'))
+    elif client.spectating:#spectators only watch
+      return
+    elif cmd in PASSTHROUGH_COMMANDS:#input, fighter snapshot or ping, passthrough message
+      if len(msg) >= 2 and room is not None:
+        room.forward(msg, client)
+      else:
+        print("Unknown message: {0},{1}".format(msg,client.addr))
+    elif cmd == b"p":#client is progressing to frame X
+      if room is not None:
+        parts = msg.split(b"_")
+        room.progress(client, msg, int(parts[1]), int(parts[2]) if len(parts) > 2 else None)
+      else:
+        print("progress message from unknown player: " + str(client.addr))
+    else:
+      print("Unexpected: {0}".format(msg))
+    if room is not None and room.feed:
+      self.feeding.add(room)
+
+  async def handleConnection(self, reader, writer):
+    client = self.addClient(writer.get_extra_info('peername'), writer)
+    try:
+      while True:
+        size, = LENGTH_PREFIX.unpack(await reader.readexactly(LENGTH_PREFIX.size))
+        self.handleMessage(await reader.readexactly(size), client)
+        if client.writer is None:
+          break
+    except (asyncio.IncompleteReadError, ConnectionError):
+      pass
+    finally:
+      self.removeClient(client)
+
+  def getStats(self):
+    return {'clients': len(self.clients),
+            'rooms': [room.getReport() for room in self.rooms.values()]}
+
+  async def feedSpectators(self):
     while True:
-      self.process()
-      if(self.DEBUG_ENABLED):
-        top = self.sleep_intervals.pop()#dequeue the frame that's persisted the length of the queue
-        time.sleep(top)
-        self.sleep_intervals.insert(0,top)#enqueue event onto start of queue
+      await asyncio.sleep(SPECTATOR_BATCH_INTERVAL)
+      for room in self.feeding:
+        room.flush()
+      self.feeding = set()
+
+  async def reportStats(self):
+    while True:
+      await asyncio.sleep(STATS_INTERVAL)
+      now = time.time()
+      if self.connect_mode == SOCKET_MODE_UDP:
+        #UDP never says when someone leaves, so drop anyone who's gone quiet
+        for client in list(self.clients.values()):
+          if now - client.last_seen > CLIENT_TIMEOUT:
+            self.removeClient(client)
+      playing = len([room for room in self.rooms.values() if room.started])
+      print(str(len(self.clients))+" clients, "+str(len(self.rooms))+" rooms, "+str(playing)+" playing")
+
+  async def serve(self):
+    loop = asyncio.get_event_loop()
+    if self.connect_mode == SOCKET_MODE_UDP:
+      await loop.create_datagram_endpoint(lambda: UDPProtocol(self), local_addr=("0.0.0.0", self.port))#bind to everything.
+    else:
+      self.tcp_server = await asyncio.start_server(self.handleConnection, "", self.port)
+    loop.create_task(self.feedSpectators())
+    await self.reportStats()
+
+  def run(self):
+    print("Starting Server")
+    asyncio.run(self.serve())
 
 #TODO: integrate this into tussle. Make it a menu option or something.
+#usage: python server.py [port] [udp|tcp]
 if __name__ == "__main__":
-  g = GameServer()
-  g.run()
\ No newline at end of file
+  port = int(sys.argv[1]) if len(sys.argv) > 1 else None
+  protocol = sys.argv[2] if len(sys.argv) > 2 else None
+  g = GameServer(port, protocol)
+  g.run()
@@ -6,6 +6,7 @@ import sys
 import imp
 import engine.controller
 import math
+import assetManager
 try:
     from configparser import SafeConfigParser
 except ImportError:
@@ -162,6 +163,7 @@ class Settings():
         self.setting['showSpriteArea']    = getBoolean(self.parser,'graphics','displaySpriteArea')
         self.setting['showPlatformLines'] = getBoolean(self.parser, 'graphics', 'displayPlatformLines')
         self.setting['showECB']           = getBoolean(self.parser, 'graphics', "displayECB")
+        self.setting['prewarmFlippedSprites'] = getBoolean(self.parser, 'graphics', 'prewarmFlippedSprites')
 
         self.setting['networkEnabled']          = getBoolean(self.parser,'network','enabled')
         self.setting['networkProtocol']         = getString(self.parser,'network','protocol')
@@ -169,7 +171,8 @@ class Settings():
         self.setting['networkServerPort']       = getNumber(self.parser,'network','serverport')
         self.setting['networkUDPClientPortMin'] = getNumber(self.parser,'network','udpclientportmin')
         self.setting['networkUDPClientPortMax'] = getNumber(self.parser,'network','udpclientportmax')
-        self.setting['networkBufferSize']       = getNumber(self.parser,'network','buffersize')
+        self.setting['networkBufferSize']       = getNumber(self.parser,'network','buffersize')
+        self.setting['networkSpectate']         = getBoolean(self.parser,'network','spectate')
         
         self.setting['playerColor0'] = getString(self.parser, 'playerColors', 'player0')
         self.setting['playerColor1'] = getString(self.parser, 'playerColors', 'player1')
@@ -368,6 +371,7 @@ def saveSettings(_settings):
     parser.set('graphics','displaySpriteArea',str(_settings['showSpriteArea']))
     parser.set('graphics','displayPlatformLines',str(_settings['showPlatformLines']))
     parser.set('graphics','displayECB',str(_settings['showECB']))
+    parser.set('graphics','prewarmFlippedSprites',str(_settings['prewarmFlippedSprites']))
     
     parser.add_section('playerColors')
     parser.set('playerColors','Player0',str(_settings['playerColor0']))
@@ -482,7 +486,7 @@ class sfx_library():
         for f in os.listdir(_path):
             fname, ext = os.path.splitext(f)
             if self.supported_file_types.count(ext):
-                self.sounds[_category + "_" + fname] = pygame.mixer.Sound(os.path.join(_path,f))
+                self.sounds[_category + "_" + fname] = assetManager.getAssetManager().getSound(os.path.join(_path,f))
     
 ########################################################
 #             STATIC HELPER FUNCTIONS                  #
@@ -6,7 +6,7 @@ import sys
 build_options = dict(packages = ['numpy', 'pygame', 'requests', 'xml', 'Tkinter'], 
                     excludes = [], 
                     include_files = ['Orbitron Medium.ttf', 'full Pack 2025.ttf', 'settingsManager.py',
-                                     'battle.py', 'main.py', 'musicManager.py', 'spriteManager.py',
+                                     'battle.py', 'main.py', 'musicManager.py', 'spriteManager.py', 'rosterManager.py', 'assetManager.py', 'atlasManager.py', 'fontManager.py',
                                      'engine/', 'fighters/', 'menu/', 'music/', 'settings/', 'sfx/',
                                      'builder/', 'sprites/', 'stages/', 'cacert.pem'])
 
@@ -2,7 +2,82 @@ import pygame
 import os
 import sys
 import math
+import weakref
+import numpy
 import settingsManager
+import assetManager
+import atlasManager
+import fontManager
+
+#Sheets that have already been recolored, keyed by path, modified time and palette
+recolored_sheets = {}
+#Solid color silhouettes of sprite frames, by frame and then by color. They go away with their frame.
+mask_silhouettes = weakref.WeakKeyDictionary()
+
+"""
+Packs an (r,g,b) color into a single integer, so a whole surface can be looked up at once.
+"""
+def packColor(_color):
+    return (int(_color[0]) << 16) | (int(_color[1]) << 8) | int(_color[2])
+
+"""
+Recolor a surface in place, using every from_color:to_color pair in the color map.
+
+No matter how many colors are in the map, this only makes one pass over the pixels. Every
+distinct color in the surface gets an index, the map is applied to that (much shorter) list
+of colors, and then every pixel is looked up through it. Like PixelArray.replace, only fully
+opaque pixels are changed.
+"""
+def recolorSurface(_surface,_colorMap):
+    if not _colorMap:
+        return
+    #surfarray can't work on palette surfaces, so those still get a pass per color
+    if _surface.get_bytesize() < 3:
+        arr = pygame.PixelArray(_surface)
+        for from_color,to_color in _colorMap.items():
+            arr.replace(tuple(from_color)[:3],tuple(to_color)[:3])
+        del arr
+        return
+    
+    rgb = pygame.surfarray.pixels3d(_surface)
+    packed = (rgb[:,:,0].astype(numpy.uint32) << 16) | (rgb[:,:,1].astype(numpy.uint32) << 8) | rgb[:,:,2]
+    if _surface.get_flags() & pygame.SRCALPHA:
+        #Push anything that isn't opaque out of the range of real colors, so it never matches
+        alpha = pygame.surfarray.pixels_alpha(_surface)
+        packed[alpha != 255] |= 0x1000000
+        del alpha
+    
+    colors,index = numpy.unique(packed.ravel(),return_inverse=True)
+    lookup = colors.copy()
+    for from_color,to_color in _colorMap.items():
+        key = packColor(from_color)
+        i = numpy.searchsorted(colors,key)
+        if i < len(colors) and colors[i] == key:
+            lookup[i] = packColor(to_color)
+    
+    if not (lookup == colors).all():
+        packed = lookup[index].reshape(packed.shape)
+        rgb[:,:,0] = (packed >> 16) & 0xFF
+        rgb[:,:,1] = (packed >> 8) & 0xFF
+        rgb[:,:,2] = packed & 0xFF
+    del rgb
+
+"""
+Get a sprite sheet recolored with the given palette. Each sheet is only loaded and recolored
+once per palette, so picking the same fighter and color again, or switching back to a costume,
+reuses the sheet from last time. The file on disk is never changed.
+
+The sheet is shared, so it shouldn't be drawn on. Copy it first if it needs changing.
+"""
+def getRecoloredSheet(_path,_colorMap={}):
+    key = (os.path.normpath(_path), os.path.getmtime(_path), frozenset(_colorMap.items()))
+    if not key in recolored_sheets:
+        sheet = atlasManager.getSheet(_path)
+        if sheet is None:
+            sheet = assetManager.getAssetManager().getImage(_path,True)
+        recolorSurface(sheet,_colorMap)
+        recolored_sheets[key] = sheet
+    return recolored_sheets[key]
 
 class Sprite(pygame.sprite.Sprite):
     def __init__(self):
@@ -14,13 +89,21 @@ class Sprite(pygame.sprite.Sprite):
         self.lastDrawnPosition = pygame.Rect(0,0,0,0)
         self.spriteOffset = (0,0)
         
-    def draw(self,_screen,_offset,_scale):
+        #The last image that was scaled for drawing, so it doesn't need to be scaled again if nothing changed
+        self.last_drawn_image = None
+        self.last_drawn_size = None
+        self.scaled_image = None
+        
+    """
+    Get the rect on the screen that this sprite will cover if it's drawn with the given offset and scale,
+    without drawing it. Returns None if it wouldn't be drawn at all.
+    """
+    def getDrawRect(self,_offset,_scale):
         if not self.visible:
-            return
-        #TODO: Check for bit depth first, inform user about alpha
+            return None
         h = int(self.scale*self.rect.height * _scale)
         w = int(self.scale*self.rect.width * _scale)
-        if h <= 0 or w <= 0: return
+        if h <= 0 or w <= 0: return None
         unit_vector = [math.cos(math.radians(self.angle)), math.sin(math.radians(self.angle))]
         rotated_w = abs(w*unit_vector[0])+abs(h*unit_vector[1])
         rotated_h = abs(w*unit_vector[1])+abs(h*unit_vector[0])
@@ -28,27 +111,64 @@ class Sprite(pygame.sprite.Sprite):
         dy = (rotated_h-h)/2.0
         new_off = (int((_offset[0]+self.spriteOffset[0]*self.scale) * _scale - dx - (self.scale-1)*_scale*self.rect.width*.5), 
                    int((_offset[1]+self.spriteOffset[1]*self.scale) * _scale - dy - (self.scale-1)*_scale*self.rect.height*.5))
-        w = max(0,w)
-        h = max(0,h)
-        try:
-            blit_sprite = pygame.transform.smoothscale(self.image, (int(w), int(h)))
-        except Exception as e:
-            print(e)
-            raise ValueError("Please use 32-bit PNG files")
-        if self.angle != 0:
-            blit_sprite = pygame.transform.rotate(blit_sprite,self.angle)
-        new_rect = pygame.Rect(new_off,(int(rotated_w), int(rotated_h)))
-        ret_rect = new_rect
+        return pygame.Rect(new_off,(int(rotated_w), int(rotated_h)))
+    
+    """
+    Get the image scaled and rotated the way it's drawn at the given scale. It's only scaled again
+    if something changed since the last time.
+    """
+    def getScaledImage(self,_scale):
+        h = int(self.scale*self.rect.height * _scale)
+        w = int(self.scale*self.rect.width * _scale)
+        #Anything that changes the image in place sets changed, so it gets scaled again too
+        if self.changed or self.image is not self.last_drawn_image or self.last_drawn_size != (w,h,self.angle):
+            #TODO: Check for bit depth first, inform user about alpha
+            try:
+                blit_sprite = pygame.transform.smoothscale(self.image, (int(w), int(h)))
+            except Exception as e:
+                print(e)
+                raise ValueError("Please use 32-bit PNG files")
+            if self.angle != 0:
+                blit_sprite = pygame.transform.rotate(blit_sprite,self.angle)
+            self.scaled_image = blit_sprite
+            self.last_drawn_image = self.image
+            self.last_drawn_size = (w,h,self.angle)
+            self.changed = True
+        return self.scaled_image
+    
+    """
+    Draw the sprite. Returns the part of the screen that's different from the last time it was drawn,
+    covering both where it was and where it is now, or None if it looks exactly the same as last time.
+    """
+    def draw(self,_screen,_offset,_scale):
+        new_rect = self.getDrawRect(_offset,_scale)
+        if new_rect is None:
+            #If it was on screen before, that spot needs to be redrawn without it
+            ret_rect = self.lastDrawnPosition if self.lastDrawnPosition.width > 0 else None
+            self.lastDrawnPosition = pygame.Rect(0,0,0,0)
+            return ret_rect
+        
+        blit_sprite = self.getScaledImage(_scale)
+        ret_rect = None
         if not new_rect == self.lastDrawnPosition:
             self.changed = True
-            ret_rect = new_rect.union(self.lastDrawnPosition)
-            self.lastDrawnPosition = new_rect
         if self.changed:
-            _screen.blit(blit_sprite,new_rect)
+            ret_rect = new_rect.union(self.lastDrawnPosition) if self.lastDrawnPosition.width > 0 else new_rect
+            self.lastDrawnPosition = new_rect
             self.changed = False
-            return ret_rect
-        _screen.blit(blit_sprite,new_rect) #Until this starts working
-        return None
+        _screen.blit(blit_sprite,new_rect)
+        return ret_rect
+    
+    """
+    Whether drawing the sprite with the given offset and scale would look any different from the last time it was drawn.
+    """
+    def needsRedraw(self,_offset,_scale):
+        if self.changed or self.image is not self.last_drawn_image:
+            return True
+        new_rect = self.getDrawRect(_offset,_scale)
+        if new_rect is None:
+            return self.lastDrawnPosition.width > 0
+        return new_rect != self.lastDrawnPosition
     
     def rotate(self,_angle = 0):
         self.angle = _angle
@@ -79,7 +199,7 @@ class SpriteHandler(Sprite):
         self.color_map = _colorMap
         self.scale_factor = _scale
         self.flip = _flip
-        self.image_library = self.buildImageLibrary(ImageLibrary(_directory,_prefix), _offset)
+        self.image_library = self.buildImageLibrary(ImageLibrary(_directory,_prefix,_colorMap), _offset)
         
         self.starting_image = _startingImage
         
@@ -141,18 +261,14 @@ class SpriteHandler(Sprite):
         self.get_image()
         return Sprite.draw(self,_screen,_offset,_scale)
     
+    #The flipped side of the library is only filled in as frames are used, see FlippedAnimation
     def buildImageLibrary(self,_lib,_offset):
         library = {}
         flipped_library = {}
         for key,value in _lib.image_dict.items():
             image_list = self.buildSubimage_list(value,_offset)
             library[key] = image_list
-            flip_list = []
-            for image in image_list:
-                img = image.copy()
-                img = pygame.transform.flip(img,True,False)
-                flip_list.append(img)
-            flipped_library[key] = flip_list
+            flipped_library[key] = FlippedAnimation(image_list)
 
         if self.flip == "right": reverse = "left"
         else: reverse = "right"
@@ -165,8 +281,6 @@ class SpriteHandler(Sprite):
         while index < _sheet.get_width() // _offset:
             _sheet.set_clip(pygame.Rect(index * _offset, 0, _offset,_sheet.get_height()))
             image = _sheet.subsurface(_sheet.get_clip())
-            for from_color,to_color in self.color_map.items():
-                self.recolor(image, tuple(list(from_color)), tuple(list(to_color)))
             if not self.scale_factor == 1.0:
                 w = int(image.get_width() * self.scale_factor)
                 h = int(image.get_height() * self.scale_factor)
@@ -176,17 +290,72 @@ class SpriteHandler(Sprite):
         return image_list
     
     def recolor(self,_image,_fromColor,_toColor):
-        arr = pygame.PixelArray(_image)
-        arr.replace(_fromColor,_toColor)
-        del arr
+        recolorSurface(_image,{tuple(_fromColor)[:3]: tuple(_toColor)[:3]})
         self.changed = True
-        
+    
+    """
+    Flip every frame of the given sprites right away, instead of waiting for them to be drawn
+    facing the other way. Sprites that don't exist are skipped.
+    """
+    def prewarm(self,_spriteNames):
+        for library in self.image_library.values():
+            for name in _spriteNames:
+                if name in library and isinstance(library[name],FlippedAnimation):
+                    library[name].flipAll()
+    
+    """
+    Count up the surfaces this sprite is holding on to, and roughly how much memory they use.
+    Returns a dict with the number of frames, how many of those have been flipped so far,
+    and the total bytes of pixel data.
+    """
+    def getMemoryReport(self):
+        report = {'frames': 0, 'flipped': 0, 'bytes': 0}
+        for library in self.image_library.values():
+            for animation in library.values():
+                if isinstance(animation,FlippedAnimation):
+                    images = animation.getFlipped()
+                    report['flipped'] += len(images)
+                else:
+                    images = animation
+                    report['frames'] += len(images)
+                for image in images:
+                    report['bytes'] += image.get_width() * image.get_height() * image.get_bytesize()
+        return report
+
+"""
+The mirrored frames of one animation. It acts like a list of frames, but each frame is
+only flipped the first time it's asked for, and then kept for next time. Most animations
+are only seen facing one way in a match, so most frames never need to be flipped at all.
+"""
+class FlippedAnimation():
+    def __init__(self,_frames):
+        self.frames = _frames
+        self.flipped = [None] * len(_frames)
+    
+    def __len__(self):
+        return len(self.frames)
+    
+    def __getitem__(self,_index):
+        if self.flipped[_index] is None:
+            self.flipped[_index] = pygame.transform.flip(self.frames[_index],True,False)
+        return self.flipped[_index]
+    
+    def flipAll(self):
+        for index in range(len(self.frames)):
+            self[index]
+    
+    def getFlipped(self):
+        return [image for image in self.flipped if image is not None]
             
 class ImageSprite(Sprite):
-    def __init__(self,_path):
+    def __init__(self,_path,_image=None):
         Sprite.__init__(self)
         self.path = _path
-        self.image = pygame.image.load(_path)
+        #If we're given an image that's already loaded, make our own copy of it instead of going to disk
+        if _image is not None:
+            self.image = _image.copy()
+        else:
+            self.image = assetManager.getAssetManager().getImage(_path)
         self.rect = self.image.get_rect()
         self.bounding_rect = self.getBoundingBox()
     
@@ -216,7 +385,9 @@ class SheetSprite(ImageSprite):
         
         self.sheet = _sheet
         if isinstance(_sheet,str) or isinstance(_sheet, unicode):
-            self.sheet = pygame.image.load(_sheet)
+            self.sheet = atlasManager.getSheet(_sheet)
+            if self.sheet is None:
+                self.sheet = assetManager.getAssetManager().getImage(_sheet)
         
         self.color_map = _colorMap
         self.index = 0
@@ -244,8 +415,7 @@ class SheetSprite(ImageSprite):
             self.sheet.set_clip(pygame.Rect(index * _offset, 0, _offset,_sheet.get_height()))
             image = _sheet.subsurface(_sheet.get_clip())
             #image = image.convert_alpha()
-            for from_color,to_color in self.color_map.items():
-                self.recolor(image, tuple(list(from_color)), tuple(list(to_color)))
+            recolorSurface(image,self.color_map)
             image_list.append(image)
             index += 1
         return image_list
@@ -254,11 +424,24 @@ class SheetSprite(ImageSprite):
         self.flip = not self.flip
         self.image = pygame.transform.flip(self.image,True,False)
         self.changed = True
+    
+    """
+    Go back to the first frame, unflipped and unrotated, like the sprite was just made.
+    """
+    def reset(self):
+        self.index = 0
+        self.flip = False
+        self.angle = 0
+        self.scale = 1
+        self.visible = True
+        self.spriteOffset = (0,0)
+        self.image = self.image_list[0]
+        self.rect = self.image.get_rect()
+        self.bounding_rect = self.getBoundingBox()
+        self.changed = True
         
     def recolor(self,_image,_fromColor,_toColor):
-        arr = pygame.PixelArray(_image)
-        arr.replace(_fromColor,_toColor)
-        del arr
+        recolorSurface(_image,{tuple(_fromColor)[:3]: tuple(_toColor)[:3]})
         self.changed = True
         
     def getImageAtIndex(self,_index):
@@ -275,6 +458,25 @@ class SheetSprite(ImageSprite):
     def changeImage(self,_newImage,_subImage = 0):
         pass
                     
+"""
+Get a copy of a surface with every pixel that isn't fully transparent filled in with a solid color.
+The silhouette is only made once for each surface and color.
+"""
+def getSilhouette(_surface,_color):
+    colors = mask_silhouettes.get(_surface)
+    if colors is None:
+        colors = {}
+        mask_silhouettes[_surface] = colors
+    color = tuple(_color)[:3]
+    if not color in colors:
+        silhouette = pygame.Surface(_surface.get_size(),pygame.SRCALPHA,32)
+        silhouette.fill(color + (255,))
+        alpha = pygame.surfarray.pixels_alpha(silhouette)
+        alpha[pygame.surfarray.array_alpha(_surface) == 0] = 0
+        del alpha
+        colors[color] = silhouette
+    return colors[color]
+
 class MaskSprite(ImageSprite):
     def __init__(self, _parentSprite,_color,_duration,_pulse = False,_pulseSize = 16):
         Sprite.__init__(self)
@@ -287,24 +489,33 @@ class MaskSprite(ImageSprite):
         else: self.alpha = 128
         self.visible = True
         
-        self.image = self.parent_sprite.image.copy()
+        self.image = getSilhouette(self.parent_sprite.image,self.color)
         self.rect = self.parent_sprite.rect
-        
-        self.color_surface(self.color)
-        
-        
-    def color_surface(self,_color):
-        arr = pygame.surfarray.pixels3d(self.image)
-        arr[:,:,0] = _color[0]
-        arr[:,:,1] = _color[1]
-        arr[:,:,2] = _color[2]
-        del arr
-        
-        arr = pygame.surfarray.pixels_alpha(self.image)
-        arr[arr!=0] = self.alpha
-        del arr
-        self.changed = True
-        
+        #The scaled silhouette with the mask's alpha applied, reused every frame
+        self.faded_image = None
+        self.faded_from = None
+        
+    """
+    The silhouettes are shared, so the alpha is applied to a copy of the scaled one that belongs to this mask.
+    """
+    def getScaledImage(self,_scale):
+        silhouette = Sprite.getScaledImage(self,_scale)
+        if self.faded_from == (silhouette,self.alpha):
+            return self.faded_image
+        self.faded_from = (silhouette,self.alpha)
+        if self.faded_image is None or self.faded_image.get_size() != silhouette.get_size():
+            self.faded_image = pygame.Surface(silhouette.get_size(),pygame.SRCALPHA,32)
+        self.faded_image.fill((0,0,0,0))
+        #Adding onto a blank surface copies the pixels exactly, alpha and all
+        self.faded_image.blit(silhouette,(0,0),special_flags=pygame.BLEND_RGBA_ADD)
+        self.faded_image.fill((255,255,255,self.alpha),special_flags=pygame.BLEND_RGBA_MULT)
+        return self.faded_image
+    
+    def draw(self,_screen,_offset,_scale):
+        #Follow whatever frame the parent is showing right now
+        self.image = getSilhouette(self.parent_sprite.image,self.color)
+        self.rect = self.parent_sprite.rect
+        return Sprite.draw(self,_screen,_offset,_scale)
     
     def update(self):
         if not self.duration == 0:
@@ -316,10 +527,9 @@ class MaskSprite(ImageSprite):
                 elif self.alpha < 16:
                     self.alpha = 16
                     self.pulse_size = -self.pulse_size
+                self.changed = True
             self.duration -= 1
-            self.image = self.parent_sprite.image.copy()
-            self.color_surface(self.color)
-            
+            self.image = getSilhouette(self.parent_sprite.image,self.color)
             self.rect = self.parent_sprite.rect
             
             return self
@@ -331,27 +541,51 @@ class MaskSprite(ImageSprite):
 class TextSprite(ImageSprite):
     def __init__(self,_text,_font="Orbitron Medium",_size=12,_color=[0,0,0]):
         Sprite.__init__(self)
-        self.font = pygame.font.Font(settingsManager.createPath(_font+".ttf"),_size)
+        self.font_name = _font
+        self.size = _size
+        self.font = fontManager.getFont(_font,_size)
             
-        self.image = self.font.render(_text,False,_color).convert_alpha()
+        self.image = fontManager.renderText(_text,_font,_size,_color)
         self.rect = self.image.get_rect()
+        #The rendered text is shared with every other sprite showing the same thing, until it's changed in place
+        self.shared_image = True
         
         self.text = _text
         self.color = _color
         
     def changeColor(self,_color):
-        self.image = self.font.render(self.text,False,_color).convert_alpha()
+        self.image = fontManager.renderText(self.text,self.font_name,self.size,_color)
+        self.shared_image = True
         self.color = _color
         self.changed = True
         
     def changeText(self,_text):
-        self.image = self.font.render(_text,False,self.color).convert_alpha()
+        self.image = fontManager.renderText(_text,self.font_name,self.size,self.color)
+        self.shared_image = True
         self.text = _text
         self.rect = self.image.get_rect(center=self.rect.center)
         self.changed = True
+    
+    """
+    Make a copy of the image that only this sprite uses, so it can be changed in place.
+    """
+    def ownImage(self):
+        if self.shared_image:
+            self.image = self.image.copy()
+            self.shared_image = False
+    
+    def alpha(self,_newAlpha):
+        self.ownImage()
+        ImageSprite.alpha(self,_newAlpha)
+        
+    def recolor(self,_image,_fromColor,_toColor,_ignoreAlpha=False):
+        if _image is self.image:
+            self.ownImage()
+            _image = self.image
+        ImageSprite.recolor(self,_image,_fromColor,_toColor,_ignoreAlpha)
         
 class ImageLibrary():
-    def __init__(self,_directory,_prefix=""):
+    def __init__(self,_directory,_prefix="",_colorMap={}):
         self.directory = os.path.join(os.path.dirname(__file__).replace('main.exe',''),_directory)
         if _prefix is None: _prefix=''
         self.image_dict = {}
@@ -361,8 +595,7 @@ class ImageLibrary():
             fname, ext = os.path.splitext(f)
             if fname.startswith(_prefix) and supported_file_types.count(ext):
                 sprite_name = fname[len(_prefix):]
-                sprite = pygame.image.load(os.path.join(self.directory,f))
-                sprite = sprite.convert_alpha()
+                sprite = getRecoloredSheet(os.path.join(self.directory,f),_colorMap)
                 self.image_dict[sprite_name] = sprite
                 #print(sprite.get_alpha(), sprite_name, self.image_dict[sprite_name])
 
@@ -46,6 +46,8 @@ class ArenaMovingPlatform(stage.Stage):
                                                (self.size.centerx,self.size.centery+140))
         
         self.entity_list.append(self.movingPlat)
+        #The front and back of the moving platform follow it around
+        self.animated_layers = True
         self.platform_list.append(self.movingPlat)
         
         self.spawn_locations = [[879,573],
@@ -22,30 +22,6 @@ def getMusicList():
             (settingsManager.createPath('music/No Turning Back.ogg'),2,"No Turning Back"),
             (settingsManager.createPath('music/True Arena.ogg'),1,"No Turning Back (Chiptune ver.)")]
 
-class wrapArticle(article.Article):
-    def __init__(self,spritePath, center, speed):
-        article.Article.__init__(self,spritePath, None, center)
-        self.speed = speed
-        self.frame = 0
-        
-    def update(self):
-        if self.frame % 2 == 0:
-            rect = self.image.get_rect()
-            
-            self.image.set_clip(pygame.Rect(rect.right - self.speed,0,self.speed,rect.height))
-            small_portion = self.image.subsurface(self.image.get_clip())
-            
-            self.image.set_clip(pygame.Rect(0,0,self.rect.width - self.speed,rect.height))
-            big_portion = self.image.subsurface(self.image.get_clip())
-            
-            new_surface = pygame.Surface((rect.width, rect.height), pygame.SRCALPHA, 32).convert_alpha()
-            new_surface.blit(small_portion,pygame.Rect(0,0,self.speed,rect.height))
-            new_surface.blit(big_portion,pygame.Rect(self.speed,0,rect.width - self.speed,rect.height))
-            
-            self.image = new_surface
-            self.frame = 0
-        self.frame += 1
-
 class TrueArena(stage.Stage):
     def __init__(self):
         stage.Stage.__init__(self)
@@ -54,7 +30,6 @@ class TrueArena(stage.Stage):
         self.camera_maximum = pygame.Rect(48,32,2064,1376)
         self.blast_line = pygame.Rect(0,0,2160,1440)
         
-        self.articles = []
         #self.platform_list = [stage.Platform([700,680], [1460,680],(True,True)),
         #                      stage.Platform([700,680], [700,750]),
         #                      stage.Platform([1460,680],[1460,750])]
@@ -80,34 +55,15 @@ class TrueArena(stage.Stage):
         backdrop_b.rect.centery = self.size.centery - 64
         self.addToBackground(backdrop_b,0.1)
         
-        background_element_0_a = wrapArticle(os.path.join(os.path.dirname(__file__).replace('main.exe',''),"sprites","TAscroll3.png"),
-                                             (0,self.size.centery - 20),
-                                             1)
-        self.addToBackground(background_element_0_a, 0.2)
-        background_element_0_b = wrapArticle(os.path.join(os.path.dirname(__file__).replace('main.exe',''),"sprites","TAscroll3.png"),
-                                             (background_element_0_a.image.get_rect().right,self.size.centery - 20),
-                                             1)
-        self.addToBackground(background_element_0_b, 0.2)
-        
-        background_element_1_a = wrapArticle(os.path.join(os.path.dirname(__file__).replace('main.exe',''),"sprites","TAscroll2.png"),
-                                             (0,self.size.centery),
-                                             2)
-        self.addToBackground(background_element_1_a, 0.5)
-        background_element_1_b = wrapArticle(os.path.join(os.path.dirname(__file__).replace('main.exe',''),"sprites","TAscroll2.png"),
-                                             (background_element_1_a.image.get_rect().right,self.size.centery),
-                                             2)
-        self.addToBackground(background_element_1_b, 0.5)
-        
-        background_element_2_a = wrapArticle(os.path.join(os.path.dirname(__file__).replace('main.exe',''),"sprites","TAscroll1.png"),
-                                             (0,self.size.centery+32),
-                                             4)
-        self.addToBackground(background_element_2_a, 0.8)
-        background_element_2_b = wrapArticle(os.path.join(os.path.dirname(__file__).replace('main.exe',''),"sprites","TAscroll1.png"),
-                                             (background_element_2_a.image.get_rect().right,self.size.centery+32),
-                                             4)
-        self.addToBackground(background_element_2_b, 0.8)
-        
-        self.articles.extend([background_element_0_a,background_element_0_b,background_element_1_a,background_element_1_b,background_element_2_a,background_element_2_b])
+        #Each strip is two tiles wide, the closer ones scroll faster
+        for image,y,speed,paralax in [("TAscroll3.png",self.size.centery - 20,0.5,0.2),
+                                      ("TAscroll2.png",self.size.centery,1.0,0.5),
+                                      ("TAscroll1.png",self.size.centery+32,2.0,0.8)]:
+            background_element = stage.ScrollingSprite(os.path.join(os.path.dirname(__file__).replace('main.exe',''),"sprites",image),
+                                                       _speed = speed)
+            background_element.width = background_element.rect.width * 2
+            background_element.rect.center = (0,y)
+            self.addScrollingBackground(background_element, paralax)
         
         bg_sprite_0 = spriteManager.ImageSprite(os.path.join(os.path.dirname(__file__).replace('main.exe',''),"sprites","TrueArenaBack.png"))
         bg_sprite_0.rect.topleft = [self.size.centerx - 383,self.size.centery-44]
@@ -116,8 +72,3 @@ class TrueArena(stage.Stage):
         
         self.background_color = [0,0,0]
         self.getLedges()
-    
-    def update(self):
-        stage.Stage.update(self)
-        for art in self.articles:
-            art.update()